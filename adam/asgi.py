@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI 入口: 在 ASGI 服务器(uvicorn 等)上运行 Adam
+
+    python main.py -m asgi -p 8000 -w 4
+    或者 uvicorn main:app.asgi --workers 4
+
+    * 每个 HTTP 请求在线程池里走完整的 flask 流程(路由、before/after_request、中间件)，同一个请求始终在同一个线程里
+    * 事件循环绑定为服务器的循环，async 接口函数(及 *_async 处理函数)直接在服务器的循环里执行，
+      用 motor 查询时不占用线程，各请求的协程并发执行；其中阻塞的同步调用(权限判断、redis 缓存的读写及通知、
+      mongoengine 的关联查询)用 asyncio.to_thread 放到线程里执行，不阻塞服务器的循环
+    * 请求体先读完再交给 flask，超过 ASGI_BODY_SPOOL_SIZE 的写到临时文件
+    * 不支持 websocket，需要时用 -m websocket
+"""
+import sys
+import asyncio
+import logging
+from tempfile import SpooledTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils.async_util import bind_loop
+
+logger = logging.getLogger(__name__)
+
+ASGI_THREADS = 40  # 默认的线程池大小
+ASGI_BODY_SPOOL_SIZE = 1024 * 1024  # 请求体超过这个大小时写到临时文件
+
+
+def build_environ(scope, body):
+    """
+    把 ASGI 的 http scope 转成 WSGI 的 environ
+    :param scope: ASGI scope
+    :param body: 请求体的文件对象
+    """
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,  # 请求体已经读完，没有 Content-Length 时也可以读取
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+        environ['REMOTE_PORT'] = str(client[1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key in environ:
+            value = environ[key] + ',' + value
+        environ[key] = value
+    return environ
+
+
+class AsgiApp(object):
+    """
+    把 Adam(flask) 包装成 ASGI 应用
+    """
+
+    def __init__(self, app, max_workers=None):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or app.config.get('ASGI_THREADS') or ASGI_THREADS,
+                                           thread_name_prefix='adam-asgi')
+
+    async def __call__(self, scope, receive, send):
+        # 没有 lifespan 事件的服务器，第一个请求时绑定
+        bind_loop(asyncio.get_running_loop())
+        if scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+        elif scope['type'] == 'websocket':
+            await receive()  # websocket.connect
+            await send({'type': 'websocket.close', 'code': 1003})
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                logger.info('ASGI server startup')
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                bind_loop(None)
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle_http(self, scope, receive, send):
+        body = SpooledTemporaryFile(max_size=ASGI_BODY_SPOOL_SIZE)
+        try:
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                more_body = message.get('more_body', False)
+            body.seek(0)
+            environ = build_environ(scope, body)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self.run_wsgi, environ, send, loop)
+        finally:
+            body.close()
+
+    def run_wsgi(self, environ, send, loop):
+        """
+        在线程池里执行 flask，逐块把响应发回给服务器(等发送完再取下一块，响应很大时不会堆积在内存里)
+        """
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        def send_start():
+            if 'started' not in response:
+                response['started'] = True
+                send_sync({'type': 'http.response.start', 'status': response['status'],
+                           'headers': response['headers']})
+
+        iterable = self.app(environ, start_response)
+        try:
+            for chunk in iterable:
+                send_start()
+                if chunk:
+                    send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_start()
+            send_sync({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
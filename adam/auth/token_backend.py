@@ -53,7 +53,8 @@ class TokenBackend(BasicBackend):
                         if not request.session:
                             request.session = session_model.generate(user)
                 else:
-                    session_object = session_model.objects(token=credential).first()
+                    # Session/User 的 meta 配置了 cache 时读缓存(Session 需要在 cache 的 keys 里加上 token)
+                    session_object = session_model.find_cached(token=credential)
                     if session_object:
                         if session_object.is_delete is True:
                             BaseError.unauthorized('token does not exists')
@@ -61,7 +62,7 @@ class TokenBackend(BasicBackend):
                         jwt_object = jwt.decode(credential, secret, algorithms=[jwt_alg])
                         request.jwt = jwt_object
                         request.session = session_object
-                        user = user_mode.objects(id=session_object.user.id).first()
+                        user = user_mode.find_cached(id=session_object.user.id)
                         request.user = user
                     # else:
                     #     BaseError.unauthorized('token does not exists')
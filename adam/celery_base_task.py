@@ -9,6 +9,8 @@ import inspect
 import requests
 from celery import current_app, Task
 
+from .utils.async_util import run_async
+
 
 logger = logging.getLogger(__name__)
 
@@ -77,9 +79,8 @@ class BaseTask(current_app.Task):
 
         # async 异步函数
         if inspect.iscoroutine(res):
-            # return asyncio.run(res)
-            loop = cls._get_event_loop()
-            return loop.run_until_complete(res)
+            # 与 web 请求一样提交给后台事件循环执行
+            return run_async(res)
 
         # yield 生成器函数(途中各 yield 语句返回的值会被拼接到一起，最后以 list 形式一起返回)
         if inspect.isgenerator(res):
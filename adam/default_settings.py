@@ -84,12 +84,29 @@ ALLOWED_FILTERS = ['*']         # filtering enabled by default
 VALIDATE_FILTERS = False
 SORTING = True                  # sorting enabled by default.
 JSON_SORT_KEYS = False          # json key sorting
+JSON_BACKEND = os.environ.get('JSON_BACKEND') or 'auto'  # 接口响应的 JSON 编码实现: auto, orjson, ujson, json
 EMBEDDING = True                # embedding enabled by default
 INCLUDING = True                # including enabled by default
 PROJECTION = True               # projection enabled by default
 PAGINATION = True               # pagination enabled by default.
 PAGINATION_LIMIT = 150          # 每页显示条目的最大值
 PAGINATION_DEFAULT = 25
+STREAM_PAGINATION_LIMIT = 10000  # 流式返回时每页条目的最大值
+ZIP_COMPRESS_LEVEL = None        # 导出 zip 的压缩级别(0-9)，None 为 zlib 的默认级别
+IMPORT_BATCH_SIZE = 1000         # 流式导入时每批写入的数量
+IMPORT_MAX_ERRORS = 1000         # 流式导入时最多返回的错误条数
+EXPORT_LIMIT = 100000            # 导出接口(meta['export'] 为 True 时开放)最多导出的条数
+ASYNC_TIMEOUT = None             # async 接口函数的最长执行时间(秒)，None 为不限制
+ASYNC_DISPATCH = None            # 是否使用 {action}_async 处理函数(用 motor 查询)，None 为运行在 ASGI 服务器上时使用
+ASGI_THREADS = 40                # ASGI 模式下执行 flask 请求的线程数
+IDENTITY_MAP = True              # 同一个请求里同一条数据只加载一次(按 id 的 find_one、LazyReference、RelationField)
+DOCUMENT_CACHE_SIZE = 1000       # 模型 meta['cache'] 进程内缓存的默认最大条数
+CACHE_INVALIDATE_LIMIT = 1000    # 批量 update/delete 时逐条失效缓存的最大条数，超过时整个集合的缓存失效
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') or ''  # 模型缓存用的 redis 地址(meta['cache'] 的 redis 层，各进程之间的失效通知)
+SYNC_BATCH_SIZE = 500            # 同步服务(-m sync)每批写入 ES 的最大条数
+SYNC_FLUSH_INTERVAL = 1          # 同步服务最长多久(秒)写一次 ES 并保存 resume token
+SYNC_TOKEN_COLLECTION = 'sync_tokens'  # 同步服务保存 resume token 的集合
+SYNC_DEAD_LETTER_COLLECTION = 'sync_dead_letters'  # 同步服务保存写 ES 失败(不可重试)的操作的集合
 VERSIONING = False              # turn document versioning on or off.
 VERSIONS = '_versions'          # suffix for parallel collection w/old versions
 VERSION_PARAM = 'version'       # URL param for specific version of a document.
@@ -151,6 +168,9 @@ QUERY_PROJECTION = 'projection'
 QUERY_SORT = 'sort'
 QUERY_PAGE = 'page'
 QUERY_PAGE_SIZE = 'page_size'
+QUERY_CURSOR = 'after'  # 游标分页的参数，有传(空值表示第一页)则使用游标分页
+QUERY_COUNT = 'count'  # 是否返回总数，传 0/false 时不返回
+QUERY_STREAM = 'stream'  # 列表接口是否流式返回(边查边输出)，传 1/true 时使用
 QUERY_EMBEDDED = 'embedded'
 QUERY_INCLUDED = 'included'
 QUERY_AGGREGATION = 'aggregate'
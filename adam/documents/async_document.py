@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from typing import Any, Iterable, Mapping, Optional, Sequence, Tuple, Union
 
-from pymongo import uri_parser
+from pymongo import uri_parser, InsertOne
 from motor.motor_asyncio import AsyncIOMotorClient
 from mongoengine.base import get_document
 from mongoengine.document import Document
@@ -33,6 +33,11 @@ async def drop_database(alias):
         await client.drop_database(dbs[alias].name)
 
 
+def _options(**kwargs):
+    """只传入指定了的可选参数(值为 None 的与 pymongo 的默认值一致，不传)"""
+    return {key: value for key, value in kwargs.items() if value is not None}
+
+
 def build_document(cls, doc):
     if "_cls" in doc:
         return get_document(doc["_cls"])._from_son(doc)
@@ -40,17 +45,81 @@ def build_document(cls, doc):
         return cls._from_son(doc)
 
 
-async def save_async(self):
+async def save_async(self, validate=True, clean=True, session=None):
+    """
+    异步保存(与 mongoengine 的 save 一致):
+        * 新数据 insert_one，已有数据只 $set/$unset 修改过的字段
+        * 保存后直接返回自身(写入 id)，不再重新查询
+    :param validate: 是否校验数据
+    :param clean: 校验时是否调用 clean
+    :param session: motor 的 ClientSession
+    """
+    if validate:
+        self.validate(clean=clean)
     collection = type(self).get_motor_collection()
     doc = self.to_mongo()
-    _id = doc.pop("_id", None)
-    if not _id:
-        result = await collection.insert_one(doc)
-        inserted_id = result.inserted_id
-        return await type(self).find_one_async({"_id": inserted_id})
+    id_field = self._meta['id_field']
+    if '_id' not in doc or self._created:
+        if '_id' in doc:
+            # 指定了 id 的新数据，一次 upsert，已存在时覆盖(并发保存同一个 id 时不会插入冲突)
+            await collection.replace_one({'_id': doc['_id']}, doc, upsert=True, session=session)
+            object_id = doc['_id']
+        else:
+            object_id = (await collection.insert_one(doc, session=session)).inserted_id
+        self[id_field] = self._fields[id_field].to_python(object_id)
     else:
-        await collection.replace_one({"_id": _id}, doc)
-        return await type(self).find_one_async({"_id": _id})
+        update_doc = self._get_update_doc()
+        if update_doc:
+            await collection.update_one({'_id': doc['_id']}, update_doc, upsert=True, session=session)
+    self._clear_changed_fields()
+    self._created = False
+    return self
+
+
+async def insert_many_async(cls, docs, ordered=True, validate=True, session=None):
+    """
+    批量新增，写入 id 后直接返回传入的 Document(不再重新查询)
+    :param docs: Document 或 dict 的列表
+    :param ordered: 是否按顺序写入(遇到错误时停止)
+    :param validate: 是否校验数据
+    :param session: motor 的 ClientSession
+    :return: Document 列表
+    """
+    docs = [doc if isinstance(doc, cls) else cls(**doc) for doc in docs]
+    if not docs:
+        return docs
+    if validate:
+        for doc in docs:
+            doc.validate()
+    result = await cls.get_motor_collection().insert_many([doc.to_mongo() for doc in docs], ordered=ordered,
+                                                          session=session)
+    id_field = cls._meta['id_field']
+    for doc, object_id in zip(docs, result.inserted_ids):
+        doc[id_field] = cls._fields[id_field].to_python(object_id)
+        doc._clear_changed_fields()
+        doc._created = False
+    return docs
+
+
+async def bulk_write_async(cls, requests, ordered=True, session=None, **kwargs):
+    """
+    批量写入(pymongo 的 InsertOne、UpdateOne、DeleteMany 等)，InsertOne 可以直接传 Document
+    :return: pymongo 的 BulkWriteResult
+    """
+    requests = [InsertOne(r._doc.to_mongo()) if isinstance(r, InsertOne) and isinstance(r._doc, Document) else r
+                for r in requests]
+    return await cls.get_motor_collection().bulk_write(requests, ordered=ordered, session=session, **kwargs)
+
+
+async def update_one_async(cls, filter: Mapping[str, Any],
+                           update: Union[Mapping[str, Any], Sequence[Mapping[str, Any]]],
+                           upsert: bool = False, session: Optional[ClientSession] = None, **kwargs: Any):
+    """
+    更新一条数据
+    :return: pymongo 的 UpdateResult
+    """
+    collection = cls.get_motor_collection()
+    return await collection.update_one(filter, update, upsert=upsert, session=session, **kwargs)
 
 
 async def find_one_async(cls, filter: Optional[Any] = None, *args: Any, **kwargs: Any):
@@ -91,7 +160,8 @@ async def find_one_and_update_async(
 ):
     collection = cls.get_motor_collection()
     doc = await collection.find_one_and_update(
-        filter, update, projection, sort, upsert, return_document, array_filters, hint, session, let, comment, **kwargs)
+        filter, update, projection, sort, upsert, return_document,
+        **_options(array_filters=array_filters, hint=hint, session=session, let=let, comment=comment), **kwargs)
     if not doc:
         return None
     return cls.build_document(doc)
@@ -100,7 +170,7 @@ async def find_one_and_update_async(
 async def count_async(cls, filter: Mapping[str, Any], session: Optional[ClientSession] = None,
                       comment: Optional[Any] = None, **kwargs: Any):
     collection = cls.get_motor_collection()
-    return await collection.count_documents(filter, session, comment, **kwargs)
+    return await collection.count_documents(filter, **_options(session=session, comment=comment), **kwargs)
 
 
 async def update_many_async(
@@ -114,8 +184,9 @@ async def update_many_async(
         let: Optional[Mapping[str, Any]] = None,
         comment: Optional[Any] = None):
     collection = cls.get_motor_collection()
-    res = await collection.update_many(filter, update, upsert, array_filters, bypass_document_validation, collation,
-                                       hint, session, let, comment)
+    res = await collection.update_many(filter, update, upsert=upsert, **_options(
+        array_filters=array_filters, bypass_document_validation=bypass_document_validation, collation=collation,
+        hint=hint, session=session, let=let, comment=comment))
     return res
 
 
@@ -126,7 +197,8 @@ async def delete_many_async(
         let: Optional[Mapping[str, Any]] = None,
         comment: Optional[Any] = None):
     collection = cls.get_motor_collection()
-    res = await collection.delete_many(filter, collation, hint, session, let, comment)
+    res = await collection.delete_many(filter, **_options(collation=collation, hint=hint, session=session, let=let,
+                                                          comment=comment))
     return res
 
 
@@ -146,6 +218,9 @@ def apply_patch():
     setattr(Document, "find", classmethod(find))
     setattr(Document, "find_async", classmethod(find_async))
     setattr(Document, "save_async", save_async)
+    setattr(Document, "insert_many_async", classmethod(insert_many_async))
+    setattr(Document, "bulk_write_async", classmethod(bulk_write_async))
+    setattr(Document, "update_one_async", classmethod(update_one_async))
     setattr(Document, "count_async", classmethod(count_async))
     setattr(Document, "update_many_async", classmethod(update_many_async))
     setattr(Document, "delete_many_async", classmethod(delete_many_async))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+各进程之间的缓存失效通知(redis 发布/订阅)，没有配置 CACHE_REDIS_URL 时不通知
+
+消息: {'node': 发送的进程, 'collection': 集合名, 'op': 操作, 'ids': [数据 id]}
+    * refresh: 整表缓存(CacheDocument)下次读取前增量刷新
+    * reload: 整表缓存下次读取前全量加载
+    * invalidate: 单条数据缓存(meta['cache'])按 ids 失效
+    * clear: 单条数据缓存(meta['cache'])整个集合失效
+每个进程一个订阅线程(fork 后重新启动)，收到的消息按集合名分给 subscribe 注册的函数，不处理自己发出的消息。
+"""
+import os
+import json
+import time
+import socket
+import logging
+import threading
+
+from ..utils.config_util import config
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'adam:cache'
+
+_handlers = {}  # 集合名 -> [handler(op, ids)]
+_redis = {}  # 进程 id -> redis 客户端
+_subscriber = {}  # 进程 id -> 订阅线程
+_lock = threading.Lock()
+
+
+def get_redis():
+    """通知用的 redis 客户端，没有配置 CACHE_REDIS_URL 时返回 None"""
+    if not config.CACHE_REDIS_URL:
+        return None
+    pid = os.getpid()
+    if pid not in _redis:
+        from ..utils.db_util import get_redis_client  # 这里导入，为了不强求安装 redis 依赖
+        _redis.clear()
+        _redis[pid] = get_redis_client(config.CACHE_REDIS_URL)
+    return _redis[pid]
+
+
+def _node():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def publish(collection, op, ids=None):
+    """通知其它进程集合的缓存过期"""
+    client = get_redis()
+    if client is None:
+        return
+    message = {'node': _node(), 'collection': collection, 'op': op}
+    if ids:
+        message['ids'] = [str(_id) for _id in ids]
+    try:
+        client.publish(CHANNEL, json.dumps(message))
+    except Exception as e:
+        logger.warning('publish %s cache %s error: %s', collection, op, e)
+
+
+def subscribe(collection, handler):
+    """注册集合的通知处理函数 handler(op, ids)"""
+    with _lock:
+        _handlers.setdefault(collection, []).append(handler)
+    ensure_subscriber()
+
+
+def dispatch(message):
+    """把一条通知分给注册的处理函数"""
+    data = json.loads(message)
+    for handler in _handlers.get(data.get('collection'), []):
+        try:
+            handler(data.get('op'), data.get('ids') or [])
+        except Exception as e:
+            logger.warning('handle cache event %s error: %s', data, e)
+
+
+def _listen(client):
+    """订阅其它进程的通知，断开时重连"""
+    node = _node()
+    while True:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            for message in pubsub.listen():
+                if json.loads(message['data']).get('node') != node:
+                    dispatch(message['data'])
+        except Exception as e:
+            logger.warning('cache event subscriber error: %s', e)
+            time.sleep(1)
+
+
+def ensure_subscriber():
+    """启动本进程的订阅线程，使用缓存前调用(fork 后的子进程需要重新启动)"""
+    pid = os.getpid()
+    if pid in _subscriber:
+        return
+    client = get_redis()
+    if client is None:
+        return
+    with _lock:
+        if pid not in _subscriber:
+            _subscriber.clear()
+            _subscriber[pid] = thread = threading.Thread(target=_listen, args=(client,), name='adam-cache-events',
+                                                         daemon=True)
+            thread.start()
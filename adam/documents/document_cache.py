@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+按 id 读取单条数据的缓存(item_* 接口的 find_one、TokenBackend 的 Session/User 等)
+
+在模型的 meta 里声明后启用，如:
+    meta = {'cache': {'ttl': 30, 'backend': 'local'}}
+    * ttl: 缓存时间(秒)
+    * backend: local(只用进程内的 LRU)，redis(进程内的 LRU + redis，多进程共享)
+    * size: 进程内 LRU 的最大条数，默认 settings.DOCUMENT_CACHE_SIZE
+    * local_ttl: 进程内 LRU 的缓存时间，默认同 ttl；redis 模式下其它进程的修改最多延迟这么久才可见
+    * redis_url: redis 地址，默认 settings.CACHE_REDIS_URL
+    * keys: 除 id 和 item_id_field 外，其它可用来查缓存的唯一字段，如 Session 的 ['token']
+
+缓存的是 to_mongo() 的 BSON，每次命中都重新构造 Document，各请求拿到的对象互不影响。
+按其它字段查时只缓存 "字段值 -> id" 的对应，数据本身只按 id 缓存一份，
+所以修改数据时只需按 id 失效(ResourceDocument.save、MyQuerySet.update/delete/modify 时自动失效，
+条件不是一个 id 且匹配的数据超过 settings.CACHE_INVALIDATE_LIMIT 条时整个集合的缓存失效)，
+配置了 CACHE_REDIS_URL 时同时通知其它进程删除本地的缓存(见 cache_events)。
+直接用 pymongo/motor 集合写数据(update_many_async 等)不会失效缓存，需要时用 -m sync 的同步服务按 change stream 失效。
+"""
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+import bson
+
+from ..utils.config_util import config
+from . import cache_events
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 1000  # 进程内 LRU 默认的最大条数
+_id_fields = ('id', 'pk', '_id')
+
+_caches = {}  # 模型 -> DocumentCache
+_lock = threading.Lock()
+
+
+class LocalCache(object):
+    """进程内的 LRU 缓存，每条数据有过期时间"""
+
+    def __init__(self, size=DEFAULT_SIZE, ttl=30):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (过期时间, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        expire = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expire, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache(object):
+    """redis 缓存，出错时只记录日志，当作未命中处理"""
+
+    def __init__(self, redis_url, ttl=30):
+        from ..utils.db_util import get_redis_client  # 这里导入，为了不强求安装 redis 依赖
+        self.client = get_redis_client(redis_url)
+        self.ttl = ttl
+
+    def get(self, key):
+        try:
+            return self.client.get(key)
+        except Exception as e:
+            logger.warning('redis cache get %s error: %s', key, e)
+            return None
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.client.set(key, value, ex=self.ttl if ttl is None else ttl)
+        except Exception as e:
+            logger.warning('redis cache set %s error: %s', key, e)
+
+    def delete(self, *keys):
+        try:
+            self.client.delete(*keys)
+        except Exception as e:
+            logger.warning('redis cache delete %s error: %s', keys, e)
+
+    def delete_prefix(self, prefix, batch_size=1000):
+        """删除前缀匹配的所有 key(SCAN 分批删除，不阻塞 redis)"""
+        try:
+            keys = []
+            for key in self.client.scan_iter(match=prefix + '*', count=batch_size):
+                keys.append(key)
+                if len(keys) >= batch_size:
+                    self.client.delete(*keys)
+                    keys = []
+            if keys:
+                self.client.delete(*keys)
+        except Exception as e:
+            logger.warning('redis cache delete %s* error: %s', prefix, e)
+
+
+class DocumentCache(object):
+    """一个模型的缓存: 进程内 LRU 在前，redis 在后(可选)"""
+
+    def __init__(self, model, options):
+        self.model = model
+        self.ttl = options.get('ttl') or 30
+        size = options.get('size') or int(config.DOCUMENT_CACHE_SIZE or DEFAULT_SIZE)
+        self.local = LocalCache(size, options.get('local_ttl') or self.ttl)
+        self.redis = None
+        if options.get('backend') == 'redis':
+            redis_url = options.get('redis_url') or config.CACHE_REDIS_URL
+            if redis_url:
+                self.redis = RedisCache(redis_url, self.ttl)
+            else:
+                logger.warning('%s cache backend is redis but CACHE_REDIS_URL is not set, use local only',
+                               model.__name__)
+        self.keys = set(options.get('keys') or [])
+        if model._meta.get('item_id_field'):
+            self.keys.add(model._meta['item_id_field'])
+        self.collection = model._get_collection_name()
+        self.prefix = 'adam:cache:%s:' % self.collection
+        self.local_hits = self.redis_hits = self.misses = 0
+
+    def _key(self, field, value):
+        return '%s%s:%s' % (self.prefix, 'id' if field in _id_fields else field, value)
+
+    def lookup_field(self, condition):
+        """可以用缓存的查询条件(只有一个 id 或 keys 里的字段)，返回字段名，否则返回 None"""
+        if len(condition) != 1:
+            return None
+        field, value = next(iter(condition.items()))
+        if (field in _id_fields or field in self.keys) and isinstance(value, (str, int, bson.ObjectId)):
+            return field
+        return None
+
+    def _get(self, key):
+        """依次查各层缓存，返回 (BSON, 所在的层)"""
+        data = self.local.get(key)
+        if data is not None:
+            return data, 'local'
+        if self.redis is not None:
+            data = self.redis.get(key)
+            if data is not None:
+                self.local.set(key, data)
+                return data, 'redis'
+        return None, None
+
+    def _set(self, key, data):
+        self.local.set(key, data)
+        if self.redis is not None:
+            self.redis.set(key, data)
+
+    def get(self, field, value):
+        """查缓存，命中时返回新构造的 Document，否则返回 None"""
+        if field in _id_fields:
+            data, tier = self._get(self._key(field, value))
+        else:
+            ref, tier = self._get(self._key(field, value))
+            data = None
+            if ref is not None:
+                data, tier = self._get(self._key('id', bson.decode(ref)['_id']))
+        if data is None:
+            return None
+        son = bson.decode(data)
+        if field not in _id_fields:
+            # 字段值改过时，旧的对应关系失效
+            db_field = self.model._fields[field].db_field
+            if str(son.get(db_field)) != str(value):
+                return None
+        if tier == 'local':
+            self.local_hits += 1
+        else:
+            self.redis_hits += 1
+        return self.model._from_son(son)
+
+    def set(self, doc, field=None, value=None):
+        """缓存数据，field 不是 id 时同时缓存 字段值 -> id 的对应"""
+        son = doc.to_mongo()
+        self._set(self._key('id', doc.pk), bson.encode(son))
+        if field is not None and field not in _id_fields:
+            self._set(self._key(field, value), bson.encode({'_id': doc.pk}))
+
+    def find(self, condition, loader):
+        """
+        读穿透: 先查缓存，未命中时调用 loader() 从数据库读取并缓存
+        :param condition: 查询条件，只能是一个 id 或 keys 里的字段
+        :param loader: 从数据库读取数据的函数，返回 Document 或 None
+        """
+        field, value = next(iter(condition.items()))
+        doc = self.get(field, value)
+        if doc is not None:
+            return doc
+        self.misses += 1
+        doc = loader()
+        if doc is not None:
+            self.set(doc, field, value)
+        return doc
+
+    async def find_async(self, condition, loader):
+        """find 的异步版本，loader() 返回协程"""
+        field, value = next(iter(condition.items()))
+        doc = await self._run(self.get, field, value)
+        if doc is not None:
+            return doc
+        self.misses += 1
+        doc = await loader()
+        if doc is not None:
+            await self._run(self.set, doc, field, value)
+        return doc
+
+    async def _run(self, func, *args):
+        """有 redis 时放到线程里执行(redis 的读写是阻塞的)"""
+        if self.redis is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    async def invalidate_async(self, *ids):
+        # 配置了 CACHE_REDIS_URL 时还要发布通知，同样是阻塞的
+        if self.redis is None and cache_events.get_redis() is None:
+            return self.invalidate(*ids)
+        await asyncio.to_thread(self.invalidate, *ids)
+
+    def invalidate(self, *ids):
+        """数据修改/删除后按 id 失效缓存"""
+        if not ids:
+            return
+        keys = [self._key('id', _id) for _id in ids]
+        self.local.delete(*keys)
+        if self.redis is not None:
+            self.redis.delete(*keys)
+        cache_events.publish(self.collection, 'invalidate', ids)  # 其它进程的本地缓存
+
+    def invalidate_all(self):
+        """整个集合的缓存失效(批量写入的数据太多，不逐条找出 id 时使用)"""
+        self.local.clear()
+        if self.redis is not None:
+            self.redis.delete_prefix(self.prefix)
+        cache_events.publish(self.collection, 'clear')
+
+    async def invalidate_all_async(self):
+        if self.redis is None and cache_events.get_redis() is None:
+            return self.invalidate_all()
+        await asyncio.to_thread(self.invalidate_all)
+
+    def on_event(self, op, ids):
+        """其它进程(或同步服务)的失效通知，只需要删除本进程的缓存"""
+        if op == 'invalidate':
+            self.local.delete(*[self._key('id', _id) for _id in ids])
+        elif op == 'clear':
+            self.local.clear()
+
+    def clear(self):
+        """清空进程内的缓存"""
+        self.local.clear()
+
+    def stats(self):
+        hits = self.local_hits + self.redis_hits
+        total = hits + self.misses
+        return {
+            'backend': 'redis' if self.redis is not None else 'local',
+            'hits': hits,
+            'local_hits': self.local_hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / total, 4) if total else 0,
+            'size': len(self.local),
+        }
+
+
+def get_document_cache(model):
+    """获取模型的缓存，模型没有配置 meta['cache'] 时返回 None"""
+    cache = _caches.get(model)
+    if cache is not None:
+        cache_events.ensure_subscriber()
+        return cache
+    options = model._meta.get('cache')
+    if not options:
+        return None
+    with _lock:
+        if model not in _caches:
+            _caches[model] = cache = DocumentCache(model, options)
+            cache_events.subscribe(cache.collection, cache.on_event)
+    return _caches[model]
+
+
+def cache_stats():
+    """各模型缓存的命中统计，用于 /api/status"""
+    return {model.__name__: cache.stats() for model, cache in list(_caches.items())}
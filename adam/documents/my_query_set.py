@@ -2,16 +2,27 @@
 """
 继承mongoengine的 QuerySet，实现一些基础功能
 """
+import asyncio
 import logging
 
 from bson import ObjectId
 from mongoengine.queryset.visitor import Q
-from mongoengine.queryset import QuerySetNoCache
-from ..utils.serializer import mongo_to_dict
+from mongoengine.queryset import QuerySetNoCache, transform
+
+from .document_cache import get_document_cache
+from ..utils.config_util import config
+from ..utils import identity_map
 
 
 logger = logging.getLogger(__name__)
 
+PREFETCH_BATCH_SIZE = 100  # prefetch_related 每批加载关联数据的条数
+INVALIDATE_LIMIT = 1000  # 批量写入时逐条失效缓存的最大条数，默认取配置 CACHE_INVALIDATE_LIMIT
+
+
+def _invalidate_limit():
+    return int(config.CACHE_INVALIDATE_LIMIT or INVALIDATE_LIMIT)
+
 
 class MyQuerySet(QuerySetNoCache):
     """
@@ -28,6 +39,43 @@ class MyQuerySet(QuerySetNoCache):
             self._cls_query = {}
         elif hasattr(self, '_loaded_fields'):
             self._loaded_fields.always_include = set([])
+        self._prefetch_related = ()  # prefetch_related 的关联字段
+
+    def _clone_into(self, new_qs):
+        new_qs = super()._clone_into(new_qs)
+        new_qs._prefetch_related = getattr(self, '_prefetch_related', ())
+        return new_qs
+
+    def prefetch_related(self, *fields):
+        """
+        迭代时每批数据(batch_size 条，默认 PREFETCH_BATCH_SIZE)批量加载关联数据(每个目标集合一次 $in 查询)，
+        之后 fetch() 不再查询，取到的与单独 fetch() 的一样是完整的数据(包括 hidden/protected 字段)，
+        如 Project.objects.prefetch_related('user', 'tasks')
+        :param fields: LazyReferenceField / RelationField 字段名
+        """
+        queryset = self.clone()
+        queryset._prefetch_related = tuple(fields)
+        return queryset
+
+    def __iter__(self):
+        queryset = super().__iter__()
+        if not self._prefetch_related or self._scalar or self._as_pymongo:
+            return queryset
+        return queryset._iter_prefetch()
+
+    def _iter_prefetch(self):
+        from ..utils.relation_loader import load_relations  # 这里导入，避免循环导入
+        size = self._batch_size or PREFETCH_BATCH_SIZE
+        chunk = []
+        for doc in iter(self.__next__, None):
+            chunk.append(doc)
+            if len(chunk) >= size:
+                load_relations(chunk, self._prefetch_related)
+                yield from chunk
+                chunk = []
+        if chunk:
+            load_relations(chunk, self._prefetch_related)
+            yield from chunk
 
     def by_own(self, user):
         return self.filter(user=user.id)
@@ -58,20 +106,132 @@ class MyQuerySet(QuerySetNoCache):
         else:
             return super(QuerySetNoCache, self).__call__(q_obj, **query)
 
-    async def all_async(self):
-        """Return all documents."""
+    def _cache_targets(self):
+        """
+        模型配置了缓存时，返回 (缓存, 将被修改的数据 id)，写完后按 id 失效缓存
+            条件不是一个 id 时先查出 id，最多查 CACHE_INVALIDATE_LIMIT 条，超过时 id 为 None(整个集合的缓存失效)
+        """
+        cache = get_document_cache(self._document)
+        if cache is None:
+            return None, []
+        _id = self._query.get('_id')
+        if _id is not None and not isinstance(_id, dict):
+            return cache, [_id]
+        limit = _invalidate_limit()
+        ids = list(self.clone().scalar('pk').limit(limit + 1))
+        return cache, ids if len(ids) <= limit else None
+
+    @staticmethod
+    def _invalidate(cache, ids):
+        if cache is None:
+            return
+        if ids is None:
+            cache.invalidate_all()
+        else:
+            cache.invalidate(*ids)
+
+    def _written(self):
+        """
+        写完后调用: 移除请求内已加载的数据(条件不是一个 id 时移除这个集合的所有数据)；
+        整表缓存的 Model(CacheDocument)不知道改了哪些数据，直接让整表缓存过期
+        """
+        _id = self._query.get('_id')
+        identity_map.discard(self._document, [_id] if _id is not None and not isinstance(_id, dict) else None)
+        if self._document._meta.get('cache_table'):
+            self._document.clear_cache()
+
+    def update(self, *args, **kwargs):
+        cache, ids = self._cache_targets()
+        result = super().update(*args, **kwargs)
+        self._invalidate(cache, ids)
+        self._written()
+        return result
+
+    def delete(self, *args, **kwargs):
+        cache, ids = self._cache_targets()
+        result = super().delete(*args, **kwargs)
+        self._invalidate(cache, ids)
+        self._written()
+        return result
+
+    def modify(self, *args, **kwargs):
+        doc = super().modify(*args, **kwargs)
+        if doc is not None:
+            cache = get_document_cache(self._document)
+            if cache is not None:
+                cache.invalidate(doc.pk)
+            self._written()
+        return doc
+
+    async def _invalidate_cache_async(self, session=None):
+        """异步写之前调用，返回写完后失效缓存的协程函数"""
+        cache = get_document_cache(self._document)
+        ids = []
+        if cache is not None:
+            _id = self._query.get('_id')
+            if _id is not None and not isinstance(_id, dict):
+                ids = [_id]
+            else:
+                limit = _invalidate_limit()
+                cursor = self._document.get_motor_collection().find(self._query, {'_id': 1}, session=session,
+                                                                     limit=limit + 1)
+                ids = [doc['_id'] async for doc in cursor]
+                ids = ids if len(ids) <= limit else None
+
+        async def invalidate():
+            if cache is not None and ids is None:
+                await cache.invalidate_all_async()
+            elif cache is not None:
+                await cache.invalidate_async(*ids)
+            if self._document._meta.get('cache_table'):
+                await asyncio.to_thread(self._written)  # 通知其它进程时 redis 是阻塞的
+            else:
+                self._written()
+        return invalidate
+
+    def _motor_cursor(self, session=None):
+        """
+        生成 motor 的游标，与 mongoengine 的 _cursor 一致: 带上 only/exclude 的 projection 及其它游标参数、
+        默认排序、limit/skip、hint、collation、batch_size、comment、read_preference
+        """
         collection = self._document.get_motor_collection()
-        cursor = collection.find(self._query, **self._cursor_args)
+        if self._read_preference is not None or self._read_concern is not None:
+            collection = collection.with_options(read_preference=self._read_preference,
+                                                 read_concern=self._read_concern)
+        cursor = collection.find(self._query, session=session, **self._cursor_args)
+        if self._where_clause:
+            cursor = cursor.where(self._sub_js_fields(self._where_clause))
         if self._ordering:
             cursor = cursor.sort(self._ordering)
-        if self._limit:
+        elif self._ordering is None and self._document._meta.get('ordering'):
+            cursor = cursor.sort(self._get_order_by(self._document._meta['ordering']))
+        if self._limit is not None:
             cursor = cursor.limit(self._limit)
-        if self._skip:
+        if self._skip is not None:
             cursor = cursor.skip(self._skip)
-        async for doc in cursor:
-            yield self._document.build_document(doc)
+        if self._hint != -1:
+            cursor = cursor.hint(self._hint)
+        if self._collation is not None:
+            cursor = cursor.collation(self._collation)
+        if self._batch_size is not None:
+            cursor = cursor.batch_size(self._batch_size)
+        if self._comment is not None:
+            cursor = cursor.comment(self._comment)
+        return cursor
+
+    async def all_async(self, session=None):
+        """Return all documents."""
+        if self._none or self._empty:
+            return
+        async for doc in self._motor_cursor(session):
+            # as_pymongo() 时直接返回原始数据
+            if self._as_pymongo:
+                yield doc
+                continue
+            doc = self._document._from_son(doc, _auto_dereference=self._auto_dereference)
+            yield self._get_scalar(doc) if self._scalar else doc
 
-    async def in_async(self, object_ids):
+    async def in_async(self, object_ids, session=None):
         """Retrieve a set of documents by their ids.
 
         :param object_ids: a list or tuple of ObjectId's
@@ -79,35 +239,69 @@ class MyQuerySet(QuerySetNoCache):
                 Document subclasses as values.
         """
         object_ids = [ObjectId(i) for i in object_ids]
-        async for doc in self._document.find_async({"_id": {"$in": object_ids}}, **self._cursor_args):
+        async for doc in self.filter(id__in=object_ids).all_async(session=session):
             yield doc
 
-    async def first_async(self, *q_objs, **query):
-        queryset = self.clone()
-        queryset = queryset.order_by().limit(1)
-        queryset = queryset.filter(*q_objs, **query)
-        return await self._document.find_one_async(queryset._query)
+    async def first_async(self, *q_objs, session=None, **query):
+        queryset = self.filter(*q_objs, **query).limit(1)
+        async for doc in queryset.all_async(session=session):
+            return doc
+        return None
 
     get_async = first_async  # alias for first_async(丢失了判断多个结果的功能)
 
-    async def create_async(self, **kwargs):
+    async def create_async(self, session=None, **kwargs):
         """Create new object. Returns the saved object instance."""
-        return await self._document(**kwargs).save_async()
+        return await self._document(**kwargs).save_async(session=session)
 
-    async def insert_async(self, doc_or_docs):
-        collection = self._document.get_motor_collection()
-        if isinstance(doc_or_docs, self._document):
-            doc_or_docs = [doc_or_docs]
-        docs = [mongo_to_dict(doc) for doc in doc_or_docs]
-        result = await collection.insert_many(docs)
-        return result.inserted_ids
+    async def insert_async(self, doc_or_docs, load_bulk=True, session=None):
+        """
+        批量新增(与 mongoengine 的 insert 一致)，load_bulk 为 False 时返回 id
+        """
+        docs = [doc_or_docs] if isinstance(doc_or_docs, self._document) else list(doc_or_docs)
+        docs = await self._document.insert_many_async(docs, session=session)
+        results = docs if load_bulk else [doc.pk for doc in docs]
+        return results[0] if isinstance(doc_or_docs, self._document) else results
 
-    async def count_async(self):
-        return await self._document.count_async(self._query)
+    async def count_async(self, with_limit_and_skip=False, session=None):
+        if self._none or self._empty:
+            return 0
+        kwargs = {}
+        if with_limit_and_skip:
+            if self._limit:
+                kwargs['limit'] = self._limit
+            if self._skip:
+                kwargs['skip'] = self._skip
+        return await self._document.count_async(self._query, session=session, **kwargs)
 
-    async def delete_async(self):
-        return await self._document.delete_many_async(self._query)
+    async def delete_async(self, session=None):
+        invalidate = await self._invalidate_cache_async(session)
+        result = await self._document.delete_many_async(self._query, session=session)
+        await invalidate()
+        return result
 
-    async def update_async(self, **update):
-        return await self._document.update_many_async(filter=self._query, update={'$set': update})
+    async def update_async(self, upsert=False, session=None, **update):
+        """
+        批量更新，参数与 mongoengine 的 update 一致(如 set__name='a', inc__count=1，没有操作符时为 set)
+        :return: pymongo 的 UpdateResult
+        """
+        invalidate = await self._invalidate_cache_async(session)
+        result = await self._document.update_many_async(filter=self._query, update=self._transform_update(update),
+                                                        upsert=upsert, session=session)
+        await invalidate()
+        return result
+
+    async def update_one_async(self, upsert=False, session=None, **update):
+        """
+        更新一条数据，参数同 update_async
+        :return: pymongo 的 UpdateResult
+        """
+        invalidate = await self._invalidate_cache_async(session)
+        result = await self._document.update_one_async(self._query, self._transform_update(update), upsert=upsert,
+                                                       session=session)
+        await invalidate()
+        return result
 
+    def _transform_update(self, update):
+        """把 mongoengine 形式的更新参数转成 mongodb 的更新语句(字段名转成 db_field，值转成 mongo 的类型)"""
+        return transform.update(self._document, **update)
@@ -6,14 +6,18 @@ import json
 import logging
 from datetime import datetime
 
-from mongoengine import Document, queryset_manager
+from mongoengine import Document, ValidationError, queryset_manager
 from mongoengine.fields import DateTimeField
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
 from ..utils.serializer import mongo_to_dict
-from ..utils.import_util import parse_csv_content
+from ..utils.import_util import parse_csv_content, convert_import_record
+from ..utils import identity_map
 from .my_query_set import MyQuerySet
+from .document_cache import get_document_cache
 from .async_document import get_motor_collection, build_document, find_one_async, find_one_and_update_async, find, \
-    find_async, save_async, count_async, update_many_async, delete_many_async, aggregate_async
+    find_async, save_async, count_async, update_many_async, delete_many_async, aggregate_async, insert_many_async, \
+    bulk_write_async, update_one_async
 
 
 logger = logging.getLogger(__name__)
@@ -40,6 +44,16 @@ class ResourceDocument(Document):
         'dynamic_fields': [],
         'protected': [],
         'search_fields': [],
+        'count_strategy': 'exact',  # 列表接口总数的获取方式: exact, estimated, cache, none (见 page_util)
+        'count_cache_timeout': 10,  # count_strategy 为 cache 时，总数的缓存时间(秒)
+        'page_engine': 'query',  # 列表接口分页取数据的方式: query(count + find), facet(一次 $facet 聚合，只在 count_strategy 为 exact 时生效)
+        'read_engine': 'document',  # 列表接口读数据的方式: document(构造 Document 再序列化), raw(as_pymongo 直接转换)
+        'batch_engine': 'document',  # batch 接口写数据的方式: document(逐条 save/delete), bulk(一次 update_many/delete_many)
+        'batch_hooks': False,  # batch_engine 为 bulk 时，是否仍逐条调用 before_save/after_update/after_delete
+        'update_engine': 'document',  # item_update/batch_update 写数据的方式: document(先取出数据再 save), atomic(不先取数据，只 $set 请求的字段，不调用 before_save)
+        'export': False,  # 是否开放 GET /<resource>/export 导出接口(权限与 collection_read 相同)
+        'cache': None,  # 按 id 读单条数据的缓存，如 {'ttl': 30, 'backend': 'local'}，见 document_cache
+        'es_sync': False,  # 由同步服务(-m sync)按 change stream 写 ES，save(es=True) 不再同步写
         'import_options': {
             'form': [],
             'fields': []
@@ -131,11 +145,14 @@ class ResourceDocument(Document):
         self.updated_at = datetime.utcnow()
         mode = 'create' if not self.id else 'update'
         result = super().save(*args, **kwargs)
+        if mode == 'update':
+            self.invalidate_cache()
+        identity_map.discard(self.__class__, [self.pk])  # 新增的数据也会改变已加载的关联数据
         if enable_hook and mode == 'create':
             self.after_create(result)
         elif enable_hook and mode == 'update':
             self.after_update(kwargs)
-        if es:
+        if es and not self._meta.get('es_sync'):
             if mode == 'create':
                 self.es_insert()
             elif mode == 'update':
@@ -174,9 +191,64 @@ class ResourceDocument(Document):
             docs.append(cls(**item))
         return cls.objects.insert(docs)
 
+    @classmethod
+    def _identity_id(cls, condition):
+        """按 id 查询时返回 id(用来查请求内的 identity map)，否则返回 None"""
+        if len(condition) == 1:
+            field, value = next(iter(condition.items()))
+            if field in ('id', 'pk'):
+                return value
+        return None
+
     @classmethod
     def find_one(cls, condition):
-        return cls.objects.get(**condition)
+        doc = identity_map.get(cls, cls._identity_id(condition))
+        if doc is not None:
+            return doc
+        cache = get_document_cache(cls)
+        if cache is not None and cache.lookup_field(condition):
+            doc = cache.find(condition, lambda: cls.objects(**condition).first())
+            if doc is None:
+                raise cls.DoesNotExist('%s matching query does not exist.' % cls.__name__)
+        else:
+            doc = cls.objects.get(**condition)
+        return identity_map.put(doc)
+
+    @classmethod
+    def find_cached(cls, **condition):
+        """
+        按 id 或 meta['cache'] 的 keys 字段读取一条数据，优先读请求内已加载的及缓存，不存在时返回 None
+        没有配置缓存或条件不能用缓存时同 objects(**condition).first()
+        """
+        doc = identity_map.get(cls, cls._identity_id(condition))
+        if doc is not None:
+            return doc
+        cache = get_document_cache(cls)
+        if cache is not None and cache.lookup_field(condition):
+            doc = cache.find(condition, lambda: cls.objects(**condition).first())
+        else:
+            doc = cls.objects(**condition).first()
+        return identity_map.put(doc)
+
+    @classmethod
+    async def find_cached_async(cls, **condition):
+        """find_cached 的异步版本，未命中时用 motor 查询"""
+        doc = identity_map.get(cls, cls._identity_id(condition))
+        if doc is not None:
+            return doc
+        query = cls.objects(**condition)._query
+        cache = get_document_cache(cls)
+        if cache is not None and cache.lookup_field(condition):
+            doc = await cache.find_async(condition, lambda: cls.find_one_async(query))
+        else:
+            doc = await cls.find_one_async(query)
+        return identity_map.put(doc)
+
+    def invalidate_cache(self):
+        """失效本条数据的缓存"""
+        cache = get_document_cache(self.__class__)
+        if cache is not None and self.pk is not None:
+            cache.invalidate(self.pk)
 
     @classmethod
     def find_by_ids(cls, ids):
@@ -272,6 +344,56 @@ class ResourceDocument(Document):
         items = cls.batch_insert(result)
         return items
 
+    @classmethod
+    def import_stream(cls, records, defaults=None, text=False, batch_size=1000, max_errors=1000):
+        """
+        流式导入: 逐条转换校验，每攒够 batch_size 条 insert_many(ordered=False) 一次，内存占用与导入的数量无关
+            与 batch_insert 一样不会调用 before_save / after_create
+        :param records: (行号, dict) 的迭代器，见 import_util.iter_csv_records / iter_ndjson_records
+        :param defaults: 每条数据的默认值
+        :param text: 值是否都是字符串(csv)
+        :param batch_size: 每批写入的数量
+        :param max_errors: 最多返回的错误条数(failed 仍是全部的错误数)
+        :return: {'total': 总数, 'inserted': 写入数, 'failed': 失败数, 'errors': [{'line': 行号, 'error': 错误信息}]}
+        """
+        report = {'total': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+        collection = cls._get_collection()
+
+        def add_error(line, error):
+            report['failed'] += 1
+            if len(report['errors']) < max_errors:
+                report['errors'].append({'line': line, 'error': str(error)})
+
+        def flush(lines, docs):
+            try:
+                report['inserted'] += len(collection.insert_many(docs, ordered=False).inserted_ids)
+            except BulkWriteError as e:
+                report['inserted'] += e.details.get('nInserted', 0)
+                for error in e.details.get('writeErrors', []):
+                    add_error(lines[error['index']], error.get('errmsg'))
+
+        lines, docs = [], []
+        for line, record in records:
+            report['total'] += 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                values = convert_import_record(cls, record, text=text)
+                doc = cls(**{**(defaults or {}), **values})
+                doc.validate()
+            except (ValueError, TypeError, ValidationError) as e:
+                add_error(line, e)
+                continue
+            lines.append(line)
+            docs.append(doc.to_mongo())
+            if len(docs) >= batch_size:
+                flush(lines, docs)
+                lines, docs = [], []
+        if docs:
+            flush(lines, docs)
+        report['errors'].sort(key=lambda e: e['line'])
+        return report
+
     # 以下为异步方法
     get_motor_collection = classmethod(get_motor_collection)
     build_document = classmethod(build_document)
@@ -279,8 +401,23 @@ class ResourceDocument(Document):
     find_one_and_update_async = classmethod(find_one_and_update_async)
     find = classmethod(find)
     find_async = classmethod(find_async)
-    save_async = save_async
     count_async = classmethod(count_async)
     update_many_async = classmethod(update_many_async)
+    update_one_async = classmethod(update_one_async)
+    insert_many_async = classmethod(insert_many_async)
+    bulk_write_async = classmethod(bulk_write_async)
     delete_many_async = classmethod(delete_many_async)
     aggregate_async = classmethod(aggregate_async)
+
+    async def save_async(self, validate=True, clean=True, session=None):
+        """
+        异步保存，自动更新时间戳(不调用 before_save 等事件)
+        """
+        self.updated_at = datetime.utcnow()
+        created = self.pk is None
+        result = await save_async(self, validate=validate, clean=clean, session=session)
+        cache = get_document_cache(self.__class__)
+        if not created and cache is not None:
+            await cache.invalidate_async(self.pk)
+        identity_map.discard(self.__class__, [self.pk])
+        return result
@@ -7,9 +7,12 @@ from mongoengine.fields import BaseField, RECURSIVE_REFERENCE_CONSTANT
 from mongoengine.base import get_document
 from mongoengine.queryset.visitor import Q
 
+from ..utils import identity_map
+
 
 class LazyRelation(object):
-    __slots__ = ('_cached_doc', 'passthrough', 'document_type', 'relation_type', 'query', '_target_field','instance')
+    __slots__ = ('_cached_doc', '_fetched', 'passthrough', 'document_type', 'relation_type', 'query', '_target_field',
+                 'instance')
 
     @property
     def target_field(self):
@@ -22,12 +25,28 @@ class LazyRelation(object):
     def target_field(self, value):
         self._target_field = value
 
+    @property
+    def fetched(self):
+        return self._fetched
+
+    def set_cached(self, value):
+        """放入已加载好的数据(如批量加载的结果)，之后 fetch() 不再查询"""
+        self._cached_doc = value
+        self._fetched = True
+
     def fetch(self, **filter_query):
-        if not self._cached_doc:
-            if self.relation_type == 'has_one':
+        if not self._fetched:
+            # 没有额外条件时，同一个请求里已加载过的直接用
+            found, value = (False, None) if filter_query else identity_map.get_relation(self)
+            if found:
+                self._cached_doc = value
+            elif self.relation_type == 'has_one':
                 self._cached_doc = self.objects(**filter_query).first()
             else:
                 self._cached_doc = list(self.objects(**filter_query))
+            if not filter_query and not found:
+                self._cached_doc = identity_map.put_relation(self, self._cached_doc)
+            self._fetched = True
         return self._cached_doc
 
     def objects(self, **filter_query):
@@ -49,6 +68,7 @@ class LazyRelation(object):
         self.relation_type = relation_type
         self.passthrough = passthrough
         self._cached_doc = cached_doc
+        self._fetched = cached_doc is not None
         self._target_field = target_field
         self.instance = instance
 
@@ -98,8 +118,11 @@ class RelationField(BaseField):
             # Document class being used rather than a document object
             return self
 
-        value = LazyRelation(self.document_type, relation_type=self.relation_type, target_field=self.target_field, instance=instance, passthrough=self.passthrough)
-        instance._data[self.name] = value
+        # 同一个 instance 复用同一个 LazyRelation，保留已加载的数据
+        value = instance._data.get(self.name)
+        if not isinstance(value, LazyRelation) or value.instance is not instance:
+            value = LazyRelation(self.document_type, relation_type=self.relation_type, target_field=self.target_field, instance=instance, passthrough=self.passthrough)
+            instance._data[self.name] = value
         return super(RelationField, self).__get__(instance, owner)
 
     def to_python(self, value):
@@ -19,10 +19,12 @@ import multiprocessing
 
 import celery
 from flask import Flask
+from werkzeug.utils import cached_property
 from mongoengine import register_connection
 from mongoengine.fields import ListField, ReferenceField, LazyReferenceField, EmbeddedDocumentField
 
-from .utils import celery_util, config_util
+from .utils import celery_util, config_util, identity_map
+from .utils.json_util import set_json_backend
 from .utils.import_util import import_submodules, load_modules, import_string
 from .utils.url_util import RegexConverter, underscore
 from .utils.log_filter import WerkzeugLogFilter, add_file_handler
@@ -80,6 +82,7 @@ class Adam(Flask):
         self.view_path = view_path
         self.middleware_path = middleware_path
         self.load_config()
+        set_json_backend(self.config.get('JSON_BACKEND'))
 
         # name
         self.name = self.config.get('APP_NAME') or 'default'
@@ -100,6 +103,12 @@ class Adam(Flask):
         self.views = {}
         self.models = {}
         self.middlewares = {}
+        self.asgi_mode = False  # 是否运行在 ASGI 服务器上
+
+        # 请求内的 identity map
+        identity_map.apply_patch()
+        self.before_request(identity_map.begin)
+        self.teardown_request(identity_map.end)
 
         # 加载model
         if MONGO_CONNECTIONS:
@@ -124,7 +133,7 @@ class Adam(Flask):
 
     def run(self, debug=None, **options):
         parser = argparse.ArgumentParser()
-        parser.add_argument('-m', '--mode', choices=['route', 'api', 'web', 'websocket', 'worker', 'beat', 'monitor', 'shell'])
+        parser.add_argument('-m', '--mode', choices=['route', 'api', 'web', 'asgi', 'websocket', 'worker', 'beat', 'monitor', 'sync', 'shell'])
         parser.add_argument('--pool',
                             choices=['solo', 'gevent', 'prefork', 'eventlet', 'processes', 'threads', 'custom'],
                             default='solo')  # 并发模型，可选：prefork (默认，multiprocessing), eventlet, gevent, threads.
@@ -148,7 +157,7 @@ class Adam(Flask):
         self.port = int(os.environ.get('PORT') or '8000')
         if args.port:  # 端口号，优先级： 启动参数 -> 环境变量 -> 默认值
             self.port = int(args.port)
-        if args.mode in ('route', 'api', 'websocket', 'web'):
+        if args.mode in ('route', 'api', 'websocket', 'web', 'asgi'):
             self.debug = debug
             self.load_route()  # 加载middleware、view
         celery_argv = ['celery'] if celery.__version__ < '5.2.0' else []
@@ -177,6 +186,11 @@ class Adam(Flask):
                 sys.argv += ['-k', 'gevent']   # 启用 gevent 模型
             sys.argv += ['--log-level=' + args.loglevel.lower(), '--log-file=logs/web_error.log', f'{app_module}:app']
             run(prog="gunicorn")
+        elif args.mode == 'asgi':  # 启动 uvicorn 服务器，也可以直接 uvicorn main:app.asgi 启动
+            import uvicorn
+            app_module = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+            uvicorn.run(f'{app_module}:app.asgi', host=self.host, port=self.port, workers=int(args.workers),
+                        timeout_keep_alive=5, log_level=args.loglevel.lower(), lifespan='on')
         elif args.mode == 'worker':
             celery_argv += ['worker', '-l', args.loglevel, '--pool', args.pool, '-Q', args.queues]
             ''' 交给外部统一处理(关键是提前处理)
@@ -194,6 +208,9 @@ class Adam(Flask):
         elif args.mode == 'monitor':
             self.celery.start(argv=celery_argv + ['flower', '--basic-auth=' + args.basic_auth,
                                                   '--address=' + self.host, '--port=' + str(self.port)])
+        elif args.mode == 'sync':  # 启动数据同步服务(change stream -> ES、缓存失效)
+            from .sync_worker import SyncWorker
+            SyncWorker(self.models.values()).run()
         elif args.mode == 'shell':
             from IPython import embed
             from .utils.serializer import mongo_to_dict
@@ -226,6 +243,15 @@ class Adam(Flask):
         logger.info('set log file: %s, level: %s', log_file, args.log_level)
         '''
 
+    @cached_property
+    def asgi(self):
+        """
+        ASGI 应用(程序运行在 uvicorn 等 ASGI 服务器上)，路由、中间件与 wsgi 模式相同
+        """
+        from .asgi import AsgiApp
+        self.asgi_mode = True
+        return AsgiApp(self)
+
     def load_route(self):
         # 加载view
         self.load_views(self.view_path)
@@ -256,6 +282,10 @@ class Adam(Flask):
             self.auth_backends.append(clsmembers[0][1]())
 
         with self.app_context():
+            # 预先组装各 view 的中间件调用链，避免每次请求重复组装
+            for view in self.views.values():
+                view.compile_middlewares(self.available_middlewares)
+
             # 注册特殊页面(首页、静态文件、status、错误处理等)
             from .views import index
             try:
@@ -397,6 +427,8 @@ class Adam(Flask):
     def _add_url_rule(self, action_url, endpoint, view_func, methods):
         if 'OPTIONS' not in methods:
             methods = methods + ['OPTIONS']
+        if isinstance(view_func, ResourceView):
+            view_func.register_endpoint(endpoint)  # 预先解析 endpoint，请求时不再重复解析
         return self.add_url_rule(action_url, endpoint, view_func=view_func, methods=methods)
 
     def _add_resource_url_rules(self, name, view, routes=None):
@@ -416,6 +448,9 @@ class Adam(Flask):
             self._add_url_rule(url + '/query', query_endpoint, view_func=view, methods=['GET'])
 
             for action, method in view.methods.items():
+                if action == 'collection_export':
+                    # 导出接口需要 model 开启，代理的资源不注册
+                    continue
                 endpoint = 'proxy|proxy_' + action + '|' + name + '|'
                 rest_collection_url = url
                 rest_item_url = '%s/<%s:%s>' % (rest_collection_url, item_id_format, 'id')
@@ -435,6 +470,8 @@ class Adam(Flask):
             logger.debug('load route for resource view %s', name)
             model = view.model
             for action, method in view.methods.items():
+                if action == 'collection_export' and not model._meta.get('export'):
+                    continue
                 endpoint = '|' + action + '|' + name + '|'
                 action_url = '%s/<%s:%s>' % (url, item_id_format, 'id')
                 if 'collection' in action:
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from .base import Middleware
+from .base import Middleware, build_middleware_chain
 from .token_middleware import TokenMiddleware
 from .cors_middleware import CorsMiddleware
 from .license_limit_middleware import LicenseLimitMiddleware
@@ -4,10 +4,83 @@
 class Middleware(object):
     """
     Middleware
+        * 可以直接重载 __call__，自行调用 self.get_response()
+        * 也可以只实现 before_request / after_request 钩子，这类中间件会被合并成一层平铺的调用
     """
     def __init__(self, get_response):
         self.get_response = get_response
 
+    def before_request(self):
+        """
+        请求前的钩子，返回非 None 值时直接作为响应(不再往里层执行)
+        """
+        return None
+
+    def after_request(self, response):
+        """
+        请求后的钩子，返回处理后的响应
+        """
+        return response
+
     def __call__(self):
-        response = self.get_response()
+        response = self.before_request()
+        if response is None:
+            response = self.get_response()
+        return self.after_request(response)
+
+
+class HookChain(object):
+    """
+    平铺的钩子调用链: 多个只使用钩子的中间件合并成一层，避免层层嵌套调用
+    """
+    __slots__ = ('before_hooks', 'after_hooks', 'get_response')
+
+    def __init__(self, middlewares, get_response):
+        # middlewares 为由外到内的顺序
+        self.before_hooks = tuple(mw.before_request for mw in middlewares)
+        self.after_hooks = tuple(mw.after_request for mw in middlewares)
+        self.get_response = get_response
+
+    def __call__(self):
+        response = None
+        entered = 0
+        for before in self.before_hooks:
+            entered += 1
+            response = before()
+            if response is not None:
+                break
+        if response is None:
+            response = self.get_response()
+        # after 钩子逆序执行，且只执行已经进入过的中间件
+        for index in range(entered - 1, -1, -1):
+            response = self.after_hooks[index](response)
         return response
+
+
+def build_middleware_chain(middlewares, get_response):
+    """
+    启动时把中间件预先组装成一个调用链，每次请求只需调用一次返回值
+        * middlewares: 中间件类的列表，列表前面的在外层
+        * get_response: 最里层的处理函数(无参数)
+
+        执行的顺序:
+
+        middleware1 before
+        middleware2 before
+        rest
+        middleware2 after
+        middleware1 after
+    """
+    handler = get_response
+    hooks = []  # 连续的只用钩子的中间件(由内到外)
+    for mw_class in reversed(middlewares):
+        if mw_class.__call__ is Middleware.__call__:
+            hooks.append(mw_class(None))
+            continue
+        if hooks:
+            handler = HookChain(list(reversed(hooks)), handler)
+            hooks = []
+        handler = mw_class(handler)
+    if hooks:
+        handler = HookChain(list(reversed(hooks)), handler)
+    return handler
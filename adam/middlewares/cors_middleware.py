@@ -20,15 +20,11 @@ logger = logging.getLogger(__name__)
 
 
 class CorsMiddleware(Middleware):
-    def __init__(self, get_response):
-        self.get_response = get_response
+    def before_request(self):
+        request.begin_time = time.time()
 
-    def __call__(self):
-        # before resposne
-
-        begin_time = time.time()
-        response = self.get_response()
-        time_elapsed = time.time() - begin_time
+    def after_request(self, response):
+        time_elapsed = time.time() - request.begin_time
 
         if time_elapsed >= API_WARN_TIME:  # 耗时太长
             logger.warning(u'接口耗时太长:%.4f秒 %s URL:%s, 参数: %s 返回:%s',
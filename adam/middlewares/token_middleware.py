@@ -9,13 +9,7 @@ from .base import Middleware
 
 
 class TokenMiddleware(Middleware):
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self):
+    def before_request(self):
         auth_chains = app.auth_backends or []
         for auth in auth_chains:
             auth.get_credential()
-
-        # 获取response
-        return self.get_response()
@@ -1,10 +1,111 @@
 # -*- coding: utf-8 -*-
+"""
+整表缓存在内存里的 Model(配置表等数据量小、读多写少的表)
+
+* meta['cache_keys'] 声明的字段建字典索引，get_object(key=...) 直接按字段值取，不再逐条比较
+* 每隔 MODEL_CACHE_REFRESH 秒在后台线程里增量刷新(只查 updated_at 大于上次读取时间的数据)，读取时不等待；
+  每隔 MODEL_CACHE_TIMEOUT 秒在后台全量重新加载(增量刷新查不到被删除的数据)
+* save 后直接更新本进程的缓存；配置了 CACHE_REDIS_URL 时通过 redis 的发布/订阅通知其它进程:
+  save 后其它进程下次读取前先增量刷新，queryset 的 update/delete 后其它进程下次读取前全量重新加载
+"""
 import os
 import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
 from ..documents.resource_document import ResourceDocument
+from ..documents import cache_events
+
+logger = logging.getLogger(__name__)
 
 # 缓存配置的时间(超时则重新读取数据库)
 TIMEOUT = int(os.environ.get('MODEL_CACHE_TIMEOUT') or 300)
+# 增量刷新的间隔(秒)
+REFRESH = int(os.environ.get('MODEL_CACHE_REFRESH') or 10)
+# 增量刷新时往前多查的时间(秒)，容忍各进程的时钟误差
+OVERLAP = 5
+
+_lock = threading.Lock()
+
+
+class CacheTable(object):
+    """一个 Model 在内存里的整表缓存，更新时整体替换(读的线程不需要加锁)"""
+
+    def __init__(self, model):
+        self.model = model
+        self.keys = model._meta.get('cache_keys') or []
+        self.refresh_interval = model._meta.get('cache_refresh') or REFRESH
+        self.objects = {}  # id -> Document
+        self.indexes = {key: {} for key in self.keys}  # 字段 -> {字段值: Document}
+        self.loaded_at = None  # 上次全量加载的时间
+        self.checked_at = None  # 上次增量刷新的时间
+        self.since = None  # 下次增量刷新查询 updated_at 的起始时间
+        self.stale = False  # 其它进程有修改，读取前需要先增量刷新
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def _build(self, objects):
+        indexes = {key: {} for key in self.keys}
+        for obj in objects.values():
+            for key in self.keys:
+                indexes[key].setdefault(getattr(obj, key), obj)
+        self.objects, self.indexes = objects, indexes
+
+    def load(self):
+        """全量加载"""
+        since = datetime.utcnow() - timedelta(seconds=OVERLAP)
+        self._build({obj.pk: obj for obj in self.model.objects.all()})
+        self.since, self.loaded_at, self.checked_at, self.stale = since, time.time(), time.time(), False
+
+    def refresh(self):
+        """增量刷新: 只查上次读取后修改过的数据"""
+        since = datetime.utcnow() - timedelta(seconds=OVERLAP)
+        changed = list(self.model.objects(updated_at__gte=self.since))
+        if changed:
+            objects = dict(self.objects)
+            objects.update((obj.pk, obj) for obj in changed)
+            self._build(objects)
+        self.since, self.checked_at, self.stale = since, time.time(), False
+
+    def put(self, obj):
+        """本进程保存后直接更新缓存"""
+        with self.lock:
+            if self.loaded_at is not None:
+                objects = dict(self.objects)
+                objects[obj.pk] = obj
+                self._build(objects)
+
+    def mark(self, op, ids=None):
+        """标记缓存过期，op: reload(下次读取前全量加载)，其它(下次读取前增量刷新)"""
+        if op == 'reload':
+            self.loaded_at = None
+        else:
+            self.stale = True
+
+    def _background(self, full):
+        try:
+            with self.lock:
+                self.load() if full else self.refresh()
+        except Exception as e:
+            logger.warning('refresh %s cache error: %s', self.model.__name__, e)
+        finally:
+            self.refreshing = False
+
+    def ensure(self):
+        """读取前检查: 没有加载或被通知修改时同步加载，到时间时在后台刷新"""
+        if self.loaded_at is None or self.stale:
+            with self.lock:
+                if self.loaded_at is None:
+                    self.load()
+                elif self.stale:
+                    self.refresh()
+            return
+        now = time.time()
+        full = now - self.loaded_at > TIMEOUT
+        if (full or now - self.checked_at > self.refresh_interval) and not self.refreshing:
+            self.refreshing = True
+            threading.Thread(target=self._background, args=(full,), daemon=True).start()
 
 
 class CacheDocument(ResourceDocument):
@@ -14,37 +115,62 @@ class CacheDocument(ResourceDocument):
     meta = {
         'abstract': True,  # 抽象类，设为True，表示不生成具体document
         'strict': False,  # 严格模式。当 strict 为 True 时, save 的时候传入多余字段会报错
+        'cache_table': True,  # 整表缓存，queryset 的 update/delete 后调用 clear_cache
+        'cache_keys': [],  # 建索引的字段，get_object(字段=值) 直接取
+        'cache_refresh': None,  # 增量刷新的间隔(秒)，默认 MODEL_CACHE_REFRESH
     }
 
-    # 缓存配置值
-    _objects = []
-    _last_read = None
+    @classmethod
+    def _get_table(cls):
+        table = cls.__dict__.get('_table')
+        if table is None:
+            with _lock:
+                table = cls.__dict__.get('_table')
+                if table is None:
+                    table = CacheTable(cls)
+                    cls._table = table
+                    cache_events.subscribe(cls._get_collection_name(), table.mark)
+        cache_events.ensure_subscriber()
+        return table
 
     @classmethod
-    def clear_cache(cls):
-        """删除缓存的配置,让下次读取时获取数据库最新的配置"""
-        cls._objects = None
-        cls._last_read = None
+    def clear_cache(cls, publish_change=True):
+        """删除缓存的配置,让下次读取时获取数据库最新的配置(配置了 redis 时同时通知其它进程)"""
+        cls._get_table().mark('reload')
+        if publish_change:
+            cache_events.publish(cls._get_collection_name(), 'reload')
 
     @classmethod
     def get_objects(cls, clear_cache=None, **kwargs):
         """
         :param clear_cache: 是否强行清除缓存配置
-        :param kwargs: 查询参数
+        :param kwargs: 查询参数，有参数时直接查询数据库(不缓存)
         :return: 数据库本表的所有值
         """
-        # 如果没有传参过来，则每隔 5 分钟清除缓存，因为没有定时清空缓存机制。
-        if clear_cache is None:
-            if cls._last_read is None or time.time() - cls._last_read > TIMEOUT:
-                cls._last_read = time.time()
-                clear_cache = True
-
+        if kwargs:
+            return list(cls.objects.filter(**kwargs).all())
+        table = cls._get_table()
         if clear_cache:
-            cls._objects = None
+            table.mark('reload')
+        table.ensure()
+        return list(table.objects.values())
 
-        if cls._objects:
-            return cls._objects
+    @classmethod
+    def get_object(cls, **condition):
+        """
+        按 meta['cache_keys'] 里的字段(或 id)从缓存取一条数据，如 Common.get_object(key='a')，没有时返回 None
+        """
+        (field, value), = condition.items()
+        table = cls._get_table()
+        table.ensure()
+        if field in ('id', 'pk'):
+            return table.objects.get(cls._fields['id'].to_python(value))
+        if field not in table.indexes:
+            raise KeyError('%s is not in %s cache_keys' % (field, cls.__name__))
+        return table.indexes[field].get(value)
 
-        # 读取全部的配置
-        cls._objects = list(cls.objects.filter(**kwargs).all())
-        return cls._objects
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        self._get_table().put(self)
+        cache_events.publish(self._get_collection_name(), 'refresh')
+        return result
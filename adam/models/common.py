@@ -8,19 +8,22 @@ class Common(CacheDocument):
     """
     储存全局变量用
     """
+    meta = {
+        'cache_keys': ['key'],
+    }
 
     key = StringField(required=True)  # unique=True
     value = DictField(default={})
 
     @classmethod
     def get_value(cls, key):
-        for obj in cls.get_objects():
-            if obj.key == key:
-                return obj.value
-        # 缓存没有，则查询
+        obj = cls.get_object(key=key)
+        if obj:
+            return obj.value
+        # 缓存没有(其它进程刚新增的)，则查询
         obj = cls.objects(key=key).first()
         if obj:
-            cls.clear_cache()  # 缓存没有对应的值，则让缓存过期
+            cls._get_table().put(obj)
             return obj.value
         # 查不到
         return None
@@ -31,18 +34,15 @@ class Common(CacheDocument):
         if obj:
             if obj.value != value:
                 obj.value = value
-                obj.save()
-                cls.clear_cache()
+                obj.save()  # save 时更新缓存
             return obj
         # 没有，则新增
-        obj = cls.objects.create(key=key, value=value)
-        cls.clear_cache()
-        return obj
+        return cls.objects.create(key=key, value=value)
 
     @classmethod
     def update_sub_value(cls, key, inner_key, value):
         """设置内嵌的字典值"""
-        obj_value = cls.get_value(key) or {}
+        obj_value = dict(cls.get_value(key) or {})  # 复制一份，不改缓存里的对象
         obj_value[inner_key] = value
         obj = cls.set_value(key, obj_value)
         return obj
@@ -72,8 +72,10 @@ class LogApi(ResourceDocument):
             )
 
             try:
-                obj.response = decode2str(response.get_data())
-                obj.json_response = load_json(obj.response)
+                # 流式响应读取内容会把整个响应缓存下来，不记录
+                if not response.is_streamed:
+                    obj.response = decode2str(response.get_data())
+                    obj.json_response = load_json(obj.response)
             except:
                 pass
 
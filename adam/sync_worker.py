@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+数据同步服务(python main.py -m sync): 监听 MongoDB 的 change stream(需要副本集)
+
+* meta['es_sync'] 为 True 的 model: 新增/修改的数据批量写入 Elasticsearch，删除的从 ES 删除
+  (这类 model 的 save(es=True) 不再在请求里同步写 ES)
+* 配置了 meta['cache'] 的 model 按 id 失效缓存，CacheDocument 通知各进程重新加载整表缓存
+  (直接写的数据不一定更新了 updated_at，不能增量刷新)，直接用 pymongo/motor、update_many 等写的数据也能失效缓存
+* 每个数据库连接(db_alias)一个线程；每批数据写完后把 resume token 存到 SYNC_TOKEN_COLLECTION，
+  重启后从上次的位置继续，中间的数据不会丢(可能重复处理一些，写 ES 及失效缓存都可以重复执行)
+* 写 ES 出错时: 可重试的错误(429、5xx、连接出错)不保存 token，等一会儿从上次保存的位置重新处理；
+  其它错误(如 mapping 不匹配)重试也不会成功，存到 SYNC_DEAD_LETTER_COLLECTION 后继续
+"""
+import time
+import logging
+import threading
+from datetime import datetime
+
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from pymongo.errors import OperationFailure
+
+from .utils.config_util import config
+from .documents import cache_events
+from .documents.document_cache import get_document_cache
+
+logger = logging.getLogger(__name__)
+
+CHANGE_STREAM_HISTORY_LOST = 286  # resume token 已经不在 oplog 里
+
+
+def _error_status(error):
+    """ES bulk 出错的那条操作的状态码，如 {'index': {'_id': ..., 'status': 400, 'error': {...}}}"""
+    return next(iter(error.values()), {}).get('status') or 0
+
+
+def _retryable(error):
+    status = _error_status(error)
+    return status == 429 or status >= 500
+
+
+def sync_models(models):
+    """需要同步的 model: 同步 ES 或有缓存的"""
+    return [model for model in models if not model._meta.get('abstract') and (
+        model._meta.get('es_sync') or model._meta.get('cache') or model._meta.get('cache_table'))]
+
+
+class ChangeStreamSync(object):
+    """监听一个数据库的 change stream"""
+
+    def __init__(self, alias, models, batch_size=None, flush_interval=None):
+        self.alias = alias
+        self.models = {model._get_collection_name(): model for model in models}
+        self.db = models[0]._get_db()
+        self.batch_size = int(batch_size or config.SYNC_BATCH_SIZE or 500)
+        self.flush_interval = float(flush_interval or config.SYNC_FLUSH_INTERVAL or 1)
+        self.token_collection = self.db[config.SYNC_TOKEN_COLLECTION or 'sync_tokens']
+        self.dead_letter_collection = self.db[config.SYNC_DEAD_LETTER_COLLECTION or 'sync_dead_letters']
+        self.es_utils = {}  # 集合名 -> EsModelUtil
+        self.actions = []  # 待写入 ES 的操作
+        self.reloads = set()  # 待通知重新加载整表缓存的集合
+        self.token = None  # 已处理的最后一条变更
+        self.flushed_at = time.time()
+
+    def load_token(self):
+        doc = self.token_collection.find_one({'_id': self.alias})
+        return doc['token'] if doc else None
+
+    def save_token(self, token):
+        self.token_collection.update_one({'_id': self.alias},
+                                         {'$set': {'token': token, 'updated_at': datetime.utcnow()}}, upsert=True)
+
+    def get_es_util(self, model):
+        name = model._get_collection_name()
+        if name not in self.es_utils:
+            from .utils.es_model_util import EsModelUtil  # 这里导入，为了不强求安装 es 依赖
+            self.es_utils[name] = EsModelUtil(model)
+        return self.es_utils[name]
+
+    def es_action(self, model, change):
+        """变更转成 ES bulk 的操作，不需要写 ES 时返回 None"""
+        op = change['operationType']
+        _id = str(change['documentKey']['_id'])
+        util = self.get_es_util(model)
+        if op == 'delete':
+            return {'_op_type': 'delete', '_index': util.index_name, '_id': _id}
+        document = change.get('fullDocument')
+        if document is None:  # 修改后马上被删除了，等 delete 事件
+            return None
+        source = util.build_document([model._from_son(document)])[0]
+        return {'_op_type': 'index', '_index': util.index_name, '_id': _id, '_source': source}
+
+    def invalidate(self, model, change):
+        """失效缓存，整表缓存在 flush 时每个集合通知一次"""
+        cache = get_document_cache(model)
+        if cache is not None:
+            cache.invalidate(change['documentKey']['_id'])
+        if model._meta.get('cache_table'):
+            self.reloads.add(model._get_collection_name())
+
+    def handle(self, change, token):
+        """处理一条变更"""
+        model = self.models.get(change.get('ns', {}).get('coll'))
+        if model is not None and change['operationType'] in ('insert', 'update', 'replace', 'delete'):
+            self.invalidate(model, change)
+            if model._meta.get('es_sync'):
+                action = self.es_action(model, change)
+                if action is not None:
+                    self.actions.append(action)
+        self.token = token
+
+    def write_es(self, actions):
+        """批量写入 ES，连接出错时抛出异常，返回 (成功数, 出错的操作)"""
+        from elasticsearch.helpers import bulk  # 这里导入，为了不强求安装 es 依赖
+        es = next(iter(self.es_utils.values())).es
+        return bulk(es, actions, raise_on_error=False, raise_on_exception=True)
+
+    def save_dead_letters(self, errors):
+        """保存重试也不会成功的 ES 操作，需要人工处理(如修改 mapping 后重新同步这些数据)"""
+        now = datetime.utcnow()
+        self.dead_letter_collection.insert_many([{'alias': self.alias, 'error': error, 'created_at': now}
+                                                 for error in errors])
+
+    def flush(self):
+        """
+        通知重新加载整表缓存，批量写入 ES，写完后保存 resume token
+            有可重试的错误时抛出异常，不保存 token(由 run 从上次保存的位置重新处理)
+        """
+        for collection in self.reloads:
+            cache_events.publish(collection, 'reload')
+        self.reloads = set()
+        if self.actions:
+            success, errors = self.write_es(self.actions)
+            self.actions = []
+            # 删除不存在的数据(404)不算出错
+            errors = [e for e in errors if e.get('delete', {}).get('status') != 404]
+            retryable = [e for e in errors if _retryable(e)]
+            if retryable:
+                raise RuntimeError('sync %s es errors, retry later: %s' % (self.alias, retryable[:10]))
+            if errors:
+                logger.error('sync %s es errors, saved to dead letters: %s', self.alias, errors[:10])
+                self.save_dead_letters(errors)
+            logger.debug('sync %s es %s actions', self.alias, success)
+        if self.token is not None:
+            self.save_token(self.token)
+        self.flushed_at = time.time()
+
+    def watch(self):
+        """从上次保存的位置开始监听，直到出错"""
+        pipeline = [{'$match': {'ns.coll': {'$in': list(self.models)}}}]
+        token = self.load_token()
+        logger.info('sync %s watch %s, resume after %s', self.alias, list(self.models), token)
+        with self.db.watch(pipeline, full_document='updateLookup', resume_after=token,
+                           max_await_time_ms=int(self.flush_interval * 1000)) as stream:
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    self.handle(change, stream.resume_token)
+                elif stream.resume_token is not None:
+                    self.token = stream.resume_token  # 没有变更时 token 也会前进
+                if len(self.actions) >= self.batch_size or time.time() - self.flushed_at >= self.flush_interval:
+                    self.flush()
+
+    def run(self):
+        """出错时等一会儿从上次保存的位置重新监听"""
+        while True:
+            try:
+                self.watch()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    logger.error('sync %s resume token lost, restart from now, es may need reindex', self.alias)
+                    self.token_collection.delete_one({'_id': self.alias})
+                else:
+                    logger.exception('sync %s error: %s', self.alias, e)
+                    time.sleep(5)
+            except Exception as e:
+                logger.exception('sync %s error: %s', self.alias, e)
+                time.sleep(5)
+            self.actions, self.token, self.reloads = [], None, set()  # 从保存的位置重新处理
+
+
+class SyncWorker(object):
+    """数据同步服务，每个数据库连接一个线程"""
+
+    def __init__(self, models):
+        groups = {}
+        for model in sync_models(models):
+            groups.setdefault(model._meta.get('db_alias', DEFAULT_CONNECTION_NAME), []).append(model)
+        self.streams = [ChangeStreamSync(alias, items) for alias, items in groups.items()]
+
+    def run(self):
+        if not self.streams:
+            logger.warning('no model to sync, set es_sync or cache in model meta')
+            return
+        threads = [threading.Thread(target=stream.run, name=f'adam-sync-{stream.alias}', daemon=True)
+                   for stream in self.streams]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+在同步代码(flask 视图、celery 任务)里执行协程
+
+所有协程都提交给一个后台线程里常驻的事件循环执行(asyncio.run_coroutine_threadsafe):
+    * 各请求线程提交的协程在同一个循环里并发执行，互不等待
+    * motor 的客户端绑定在第一次使用时的事件循环上，只有一个循环才能在各线程间共用
+    * 调用方的 contextvars(flask 的 request / app 上下文)会带进协程里
+协程里不要做阻塞的 IO(如 mongoengine 的查询)，否则会卡住所有在执行的协程。
+ASGI 模式下用 bind_loop 绑定服务器的事件循环，不再启动后台线程。
+"""
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+_loop = None  # 后台事件循环
+_thread = None  # 运行事件循环的线程
+_pid = None  # 创建事件循环的进程，fork 后需要重新创建
+_lock = threading.Lock()
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def _loop_alive():
+    return _loop is not None and _pid == os.getpid() and _thread.is_alive() and not _loop.is_closed()
+
+
+def bind_loop(loop):
+    """
+    使用外部的事件循环(ASGI 服务器的循环)代替后台线程，协程直接在服务器的循环里执行
+    :param loop: 正在运行的事件循环，None 时解除绑定
+    """
+    global _loop, _thread, _pid
+    if loop is _loop and _pid == os.getpid():
+        return
+    with _lock:
+        if loop is None:
+            _loop = _thread = _pid = None
+        else:
+            _loop, _thread, _pid = loop, threading.current_thread(), os.getpid()
+            logger.debug('bind event loop in process %s', _pid)
+
+
+def get_loop():
+    """获取后台事件循环，第一次调用时启动"""
+    global _loop, _thread, _pid
+    if not _loop_alive():
+        with _lock:
+            if not _loop_alive():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=_run_loop, args=(loop,), name='adam-event-loop', daemon=True)
+                thread.start()
+                _loop, _thread, _pid = loop, thread, os.getpid()
+                logger.debug('start event loop thread in process %s', _pid)
+    return _loop
+
+
+def run_async(coro, timeout=None):
+    """
+    在后台事件循环里执行协程，阻塞等待结果
+    :param coro: 协程对象
+    :param timeout: 最长等待时间(秒)，超时时取消协程并抛出 TimeoutError
+    :return: 协程的返回值，协程的异常会原样抛出
+    """
+    loop = get_loop()
+    if threading.current_thread() is _thread:
+        coro.close()
+        raise RuntimeError('run_async cannot be called inside the event loop, use await instead')
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
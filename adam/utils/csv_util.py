@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+csv 流式输出
+
+用 csv.writer 写进一个小的缓冲区，每攒够一批行就输出一次再清空，内存占用与行数无关，
+并且按 csv 规则处理逗号、引号、换行等需要转义的内容。
+"""
+import csv
+from io import StringIO
+from enum import Enum
+from datetime import datetime, date
+
+from .json_util import dumps
+
+CSV_CHUNK_SIZE = 500  # 每次输出的行数
+
+
+def csv_value(value):
+    """把一个值转成 csv 单元格的内容"""
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return csv_value(value.value)
+    if isinstance(value, (dict, list, tuple)):
+        return dumps(value)
+    return str(value)
+
+
+def iter_csv(rows, header=None, chunk_size=CSV_CHUNK_SIZE, bom=False):
+    """
+    逐批生成 csv 内容
+    :param rows: 行的迭代器，每行为值的列表
+    :param header: 表头
+    :param chunk_size: 每次输出的行数
+    :param bom: 是否在开头加上 UTF-8 BOM(Excel 打开中文不乱码)
+    :return: 生成 csv 文本片段的生成器
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    if bom:
+        buffer.write('\ufeff')
+    if header:
+        writer.writerow(header)
+    count = 0
+    for row in rows:
+        writer.writerow([csv_value(value) for value in row])
+        count += 1
+        if count >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    data = buffer.getvalue()
+    if data:
+        yield data
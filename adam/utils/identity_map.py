@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+请求内的 identity map: 同一个请求里同一条数据只从数据库加载一次，各处拿到的是同一个对象
+
+请求开始时 begin() 创建(IDENTITY_MAP 配置为 False 时不创建)，请求结束时 end() 丢弃，
+没有创建时(celery 任务、脚本等)各函数都不做任何事。使用的地方:
+    * ResourceDocument.find_one / find_cached 按 id 查询时
+    * LazyReference.fetch(apply_patch 后)
+    * LazyRelation.fetch 及 relation_loader 批量加载的关联数据
+只放入完整的数据(没有 only/exclude)；save 及 queryset 的 update/delete/modify 后移除被修改的数据。
+"""
+import contextvars
+
+from flask import current_app as app
+from mongoengine.fields import LazyReference
+
+_map = contextvars.ContextVar('adam_identity_map', default=None)
+
+
+def begin():
+    """请求开始时调用"""
+    if app.config.get('IDENTITY_MAP', True):
+        _map.set({})
+
+
+def end(exc=None):
+    """请求结束时调用"""
+    _map.set(None)
+
+
+def active():
+    return _map.get() is not None
+
+
+def _key(model, pk):
+    return model._get_collection_name(), str(pk)
+
+
+def get(model, pk):
+    """取出已加载的数据，没有时返回 None"""
+    data = _map.get()
+    if data is None or pk is None:
+        return None
+    return data.get(_key(model, pk))
+
+
+def put(doc):
+    """放入完整的数据，已有同一条数据时返回已有的对象"""
+    data = _map.get()
+    if data is None or doc is None or doc.pk is None:
+        return doc
+    return data.setdefault(_key(doc.__class__, doc.pk), doc)
+
+
+def merge(docs):
+    """批量放入，返回对应的(已有的)对象列表"""
+    if _map.get() is None:
+        return docs
+    return [put(doc) for doc in docs]
+
+
+def discard(model, ids=None):
+    """数据修改后移除，ids 为 None 时移除这个集合的所有数据"""
+    data = _map.get()
+    if not data:
+        return
+    collection = model._get_collection_name()
+    if ids is None:
+        for key in [key for key in data if key[0] == collection]:
+            data.pop(key, None)
+    else:
+        for pk in ids:
+            data.pop((collection, str(pk)), None)
+        # 关联数据的列表里可能有被修改的数据
+        for key in [key for key in data if key[0] == collection and key[1].startswith('rel:')]:
+            data.pop(key, None)
+
+
+def _relation_key(relation):
+    return (relation.document_type._get_collection_name(),
+            'rel:%s:%s:%s' % (relation.relation_type, relation.target_field, relation.instance.pk))
+
+
+def get_relation(relation):
+    """LazyRelation 已加载的数据，返回 (是否已加载, 数据)"""
+    data = _map.get()
+    if data is None or relation.instance.pk is None:
+        return False, None
+    key = _relation_key(relation)
+    return key in data, data.get(key)
+
+
+def put_relation(relation, value):
+    """放入 LazyRelation 加载的数据(has_one 为 Document 或 None，has_many 为列表)，返回对应的(已有的)对象"""
+    data = _map.get()
+    if data is None or relation.instance.pk is None:
+        return value
+    value = merge(value) if isinstance(value, list) else put(value)
+    data[_relation_key(relation)] = value
+    return value
+
+
+def _fetch(self, force=False):
+    """LazyReference.fetch: 先查 identity map，加载后放入"""
+    if not self._cached_doc or force:
+        doc = None if force else get(self.document_type, self.pk)
+        if doc is None:
+            doc = put(self.document_type.objects.get(pk=self.pk))
+        self._cached_doc = doc
+        if not self._cached_doc:
+            raise self.document_type.DoesNotExist('Trying to dereference unknown document %s' % self)
+    return self._cached_doc
+
+
+def apply_patch():
+    """打上补丁，LazyReference.fetch 先查 identity map"""
+    setattr(LazyReference, 'fetch', _fetch)
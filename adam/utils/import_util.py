@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import csv
 import sys
+import json
+import codecs
 import logging
 import inspect
 import pkgutil
@@ -9,6 +12,16 @@ import importlib
 
 logger = logging.getLogger(__name__)
 
+# 流式导入支持的请求体格式: Content-Type -> 格式
+STREAM_IMPORT_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+READ_CHUNK_SIZE = 64 * 1024  # 读取请求体时每次读取的字节数
+_true_values = ('1', 'true', 'yes', 'y', '是')
+_false_values = ('0', 'false', 'no', 'n', '否')
+
 
 def import_string(import_name: str):
     """Imports an object based on a string.  This is useful if you want to
@@ -131,3 +144,90 @@ def parse_csv_content(content, schema):
                         logger.warning('Missing type config %s', _type)
             result.append(cur_value)
     return result
+
+
+def iter_lines(stream, chunk_size=READ_CHUNK_SIZE):
+    """
+    按行读取二进制流(保留换行符)，每次只读取 chunk_size 字节
+    :param stream: 二进制的文件流，如 request.stream
+    """
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+
+def iter_csv_records(stream, encoding='utf-8-sig'):
+    """
+    逐行读取 csv(第一行为表头)，引号内的换行会合并成一条
+    :param stream: 二进制的文件流
+    :return: 生成 (行号, {表头: 值}) 的生成器
+    """
+    reader = csv.reader(codecs.iterdecode(iter_lines(stream), encoding))
+    header = None
+    for row in reader:
+        if not any(row):
+            continue
+        if header is None:
+            header = [name.strip() for name in row]
+            continue
+        yield reader.line_num, dict(zip(header, row))
+
+
+def iter_ndjson_records(stream):
+    """
+    逐行读取 json lines，每行一个 json 对象
+    :param stream: 二进制的文件流
+    :return: 生成 (行号, dict) 的生成器，解析失败时为 (行号, 异常)
+    """
+    for line_num, line in enumerate(iter_lines(stream), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('Not a json object')
+        except ValueError as e:
+            record = e
+        yield line_num, record
+
+
+def convert_import_record(model, record, text=False):
+    """
+    把一条导入的数据转成 model 字段的值
+    :param model: 导入的 model
+    :param record: 一条数据，不是 model 字段的忽略
+    :param text: 值是否都是字符串(csv)，是时按字段类型解析，空字符串视为没有值
+    :return: {字段名: 值}
+    :raise ValueError: 值不能转换
+    """
+    from mongoengine.fields import BooleanField, ListField, DictField, EmbeddedDocumentField
+
+    result = {}
+    for name, value in record.items():
+        field = model._fields.get(name)
+        if field is None or value is None:
+            continue
+        if text:
+            value = value.strip()
+            if not value:
+                continue
+            if isinstance(field, BooleanField):
+                if value.lower() not in _true_values + _false_values:
+                    raise ValueError('%s: invalid bool value %s' % (name, value))
+                value = value.lower() in _true_values
+            elif isinstance(field, ListField):
+                # 与 parse_csv_content 一致，用分号分隔；也可以是 json 数组
+                value = json.loads(value) if value.startswith('[') else re.split(r'[;；]', value)
+            elif isinstance(field, (DictField, EmbeddedDocumentField)):
+                value = json.loads(value)
+        result[name] = field.to_python(value)
+    return result
@@ -10,13 +10,28 @@ import datetime
 import logging
 import decimal
 from enum import Enum
+from bson import ObjectId
 from mongoengine import Document
 from .str_util import decode2str
 from .serializer import mongo_to_dict
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
 # base file path, for found files
 BASE_PATH = os.getcwd()
 
+JSON_BACKENDS = ('orjson', 'ujson', 'json')  # 可选的 JSON 编解码实现
+# orjson: dict 的 key 允许非字符串; datetime 交给 default 处理，与标准库的输出格式一致
+_ORJSON_OPTION = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+_backend = 'json'
+
 
 def load_json(value):
     """
@@ -33,7 +48,7 @@ def load_json(value):
         return None
 
     try:
-        return json.loads(value)
+        return loads(value)
     except ValueError as e:
         pass
 
@@ -113,6 +128,27 @@ def json_serializable(value):
         return str(value)
 
 
+# 常见类型直接按类型查找转换函数，除 UUID 外结果与 json_serializable 一致
+# UUID 用带 '-' 的标准格式: orjson 原生编码 UUID 不经过 default，各实现统一成它的格式
+_default_converters = {
+    ObjectId: str,
+    datetime.datetime: lambda v: v.strftime('%Y-%m-%dT%H:%M:%S'),
+    datetime.date: lambda v: v.strftime('%Y-%m-%d'),
+    decimal.Decimal: float,
+    uuid.UUID: str,
+}
+
+
+def json_default(value):
+    """
+    JSON 编码时不能直接编码的值的转换函数
+    """
+    convert = _default_converters.get(type(value))
+    if convert is not None:
+        return convert(value)
+    return json_serializable(value)
+
+
 class CustomJSONEncoder(json.JSONEncoder):
     """
     JSONEncoder subclass that knows how to encode date/time and decimal types.
@@ -140,3 +176,56 @@ def dump_json_file(json_value, file_path):
         logging.error('write a json file error:%s', e, exc_info=True)
     return True
 
+
+def set_json_backend(name=None):
+    """
+    选择 JSON 编解码的实现
+    :param name: auto(按 orjson > ujson > json 的顺序选已安装的), orjson, ujson, json
+    :return: 实际使用的实现
+    """
+    global _backend
+    name = (name or 'auto').lower()
+    if name == 'auto':
+        name = 'orjson' if orjson else 'ujson' if ujson else 'json'
+    elif name not in JSON_BACKENDS or (name == 'orjson' and not orjson) or (name == 'ujson' and not ujson):
+        logging.warning('JSON backend %s is not available, use json instead', name)
+        name = 'json'
+    _backend = name
+    return name
+
+
+def get_json_backend():
+    """当前使用的 JSON 编解码实现"""
+    return _backend
+
+
+def dumps(value, ensure_ascii=False, default=json_default, as_bytes=False):
+    """
+    用选定的实现编码 JSON，datetime、ObjectId、UUID、Decimal、Enum 等由 default 转换
+        * orjson 总是输出 UTF-8(不理会 ensure_ascii)
+        * UUID 在各实现下都输出为带 '-' 的标准格式
+    :param value: 要编码的值
+    :param ensure_ascii: 是否把非 ASCII 字符转义
+    :param default: 不能直接编码的值的转换函数
+    :param as_bytes: 是否返回 bytes(orjson 本身返回 bytes，可省去一次解码)
+    """
+    if _backend == 'orjson':
+        data = orjson.dumps(value, default=default, option=_ORJSON_OPTION)
+        return data if as_bytes else data.decode('utf-8')
+    if _backend == 'ujson':
+        data = ujson.dumps(value, ensure_ascii=ensure_ascii, escape_forward_slashes=False, default=default)
+    else:
+        data = json.dumps(value, ensure_ascii=ensure_ascii, default=default)
+    return data.encode('utf-8') if as_bytes else data
+
+
+def loads(value):
+    """用选定的实现解码 JSON，解码失败时抛出 ValueError"""
+    if _backend == 'orjson':
+        return orjson.loads(value)
+    if _backend == 'ujson':
+        return ujson.loads(value)
+    return json.loads(value)
+
+
+set_json_backend(os.environ.get('JSON_BACKEND'))
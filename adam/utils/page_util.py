@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+分页工具
+
+游标(keyset)分页: 用 排序字段 + id 作为范围查询条件取下一页，不再使用 skip，深度翻页也不会变慢。
+    * 第一页传 `?after=`(空值)，返回值的 meta.next_cursor 即下一页的游标
+    * 下一页传 `?after=<next_cursor>`，next_cursor 为 None 时表示没有下一页了
+    * 游标里记录了排序字段，换了排序方式的游标视为无效
+
+总数(meta.total)的获取方式，由 model 的 meta['count_strategy'] 指定:
+    * exact: 每次都 count (默认)
+    * estimated: 没有过滤条件时用 estimated_document_count (读集合元数据，不扫描)，否则 count
+    * cache: 按查询条件缓存 count 结果 meta['count_cache_timeout'] 秒，没有过滤条件时同 estimated
+    * none: 不返回总数
+    请求参数 `?count=0` 也可以不返回总数
+
+分页取数据的方式，由 model 的 meta['page_engine'] 指定:
+    * query: 先 count 再 find，两次查询 (默认)
+    * facet: 用一次 $facet 聚合同时取出一页数据及总数(一页数据不能超过 16MB)，
+      聚合里的总数是精确值，所以只在 count_strategy 为 exact 时使用，其它情况仍用 query 方式
+"""
+import time
+import base64
+import binascii
+import threading
+from enum import Enum
+
+from bson import json_util
+from bson.son import SON
+from mongoengine.queryset.visitor import Q
+
+from .bson_util import bson_dumps, bson_loads
+
+_id_fields = ('id', '_id', 'pk')
+
+COUNT_CACHE_TIMEOUT = 10  # 总数默认的缓存时间(秒)
+COUNT_CACHE_SIZE = 1000  # 总数缓存的最大条数，超过时清理过期的
+_count_cache = {}  # (集合名, 查询条件) -> (过期时间, 总数)
+_count_lock = threading.Lock()  # 请求线程及异步的事件循环线程都会读写 _count_cache
+
+
+def parse_sort(sort):
+    """
+    解析排序参数，并补上 id 作为最后的排序字段(保证排序唯一)
+    :param sort: 排序参数，如 ['-created_at', 'name']
+    :return: [(字段名, 1/-1), ...]，如 [('created_at', -1), ('name', 1), ('id', 1)]
+    """
+    sort_keys = []
+    for s in sort or []:
+        if not s:
+            continue
+        if s.startswith('-'):
+            sort_keys.append((s[1:], -1))
+        elif s.startswith('+'):
+            sort_keys.append((s[1:], 1))
+        else:
+            sort_keys.append((s, 1))
+    sort_keys = [('id' if f in _id_fields else f, d) for f, d in sort_keys]
+    if not any(f == 'id' for f, _ in sort_keys):
+        direction = sort_keys[-1][1] if sort_keys else -1
+        sort_keys.append(('id', direction))
+    return sort_keys
+
+
+def order_by_args(sort_keys):
+    """转回 queryset.order_by 的参数"""
+    return [('-' if d < 0 else '+') + f for f, d in sort_keys]
+
+
+def _get_value(item, field):
+    """取出数据对应排序字段的值(支持 Document 及 dict, 以及 a.b 形式的字段)"""
+    value = item
+    for name in field.split('.'):
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            value = value.get(name)
+        else:
+            value = getattr(value, name, None)
+    if hasattr(value, 'pk'):  # LazyReference / Document
+        value = value.pk
+    elif isinstance(value, Enum):
+        value = value.value
+    return value
+
+
+def encode_cursor(item, sort_keys):
+    """
+    根据当前页最后一条数据生成下一页的游标
+    :param item: 最后一条数据
+    :param sort_keys: parse_sort 的返回值
+    :return: 不透明的游标字符串
+    """
+    data = {
+        'k': [f for f, _ in sort_keys],
+        'v': [_get_value(item, f) for f, _ in sort_keys],
+    }
+    return base64.urlsafe_b64encode(bson_dumps(data).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_keys):
+    """
+    解析游标
+    :param cursor: 游标字符串
+    :param sort_keys: parse_sort 的返回值
+    :return: 各排序字段的值
+    :raise ValueError: 游标无效，或者与当前的排序方式不一致
+    """
+    try:
+        cursor = cursor + '=' * (-len(cursor) % 4)
+        data = bson_loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise ValueError('Invalid cursor: %s' % e)
+    if not isinstance(data, dict) or data.get('k') != [f for f, _ in sort_keys]:
+        raise ValueError('Cursor does not match the sort')
+    values = data.get('v')
+    if not isinstance(values, list) or len(values) != len(sort_keys):
+        raise ValueError('Invalid cursor values')
+    return values
+
+
+def cursor_query(sort_keys, values):
+    """
+    生成取下一页的范围查询条件:
+        (k1 > v1) or (k1 == v1 and k2 > v2) or ...
+    升序用 gt，降序用 lt。null 在 mongodb 里是最小的值(降序时排在最后)。
+    """
+    query = None
+    equals = []
+    for (field, direction), value in zip(sort_keys, values):
+        name = field.replace('.', '__')
+        if value is None:
+            # 升序时比 null 大的就是所有非 null 值; 降序时没有比 null 更小的值
+            branch = Q(**{name + '__ne': None}) if direction > 0 else None
+        elif direction > 0 or field == 'id':
+            branch = Q(**{name + ('__gt' if direction > 0 else '__lt'): value})
+        else:
+            # 降序时 null(及没有这个字段的)排在所有非 null 值后面
+            branch = Q(**{name + '__lt': value}) | Q(**{name: None})
+        if branch is not None:
+            for eq in equals:
+                branch = branch & eq
+            query = branch if query is None else (query | branch)
+        equals.append(Q(**{name: value}))
+    return query
+
+
+def _prepare_cursor_page(queryset, sort, page_size, cursor, exclude_fields=None, only_fields=None):
+    """
+    生成游标分页的查询
+    :return: (queryset, sort_keys, strip_fields)，已经没有下一页时 queryset 为 None
+    """
+    sort_keys = parse_sort(sort)
+    sort_fields = {f.split('.')[0] for f, _ in sort_keys}
+    # 排序字段必须查出来才能生成游标，生成游标后再去掉
+    strip_fields = set()
+    if exclude_fields:
+        strip_fields = sort_fields & set(exclude_fields)
+        queryset = queryset.exclude(*[f for f in exclude_fields if f not in sort_fields])
+    if only_fields:
+        strip_fields |= sort_fields - set(only_fields) - {'id'}
+        queryset = queryset.only(*(set(only_fields) | sort_fields))
+
+    queryset = queryset.order_by(*order_by_args(sort_keys))
+    if cursor:
+        query = cursor_query(sort_keys, decode_cursor(cursor, sort_keys))
+        if query is None:  # 已经是最后了
+            return None, sort_keys, strip_fields
+        queryset = queryset.filter(query)
+    return queryset.limit(page_size + 1), sort_keys, strip_fields
+
+
+def _finish_cursor_page(items, sort_keys, strip_fields, page_size):
+    """多取的一条用来判断是否有下一页，生成下一页的游标"""
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(items[-1], sort_keys)
+    for item in items:
+        for field in strip_fields:
+            setattr(item, field, None)
+    return items, next_cursor
+
+
+def cursor_page(queryset, sort, page_size, cursor, exclude_fields=None, only_fields=None):
+    """
+    游标分页取数据
+    :param queryset: 查询的 queryset(已带上过滤条件)
+    :param sort: 排序参数
+    :param page_size: 每页数量
+    :param cursor: 上一页返回的游标，空值表示取第一页
+    :param exclude_fields: 不返回的字段
+    :param only_fields: 只返回的字段
+    :return: (items, next_cursor)
+    :raise ValueError: 游标无效
+    """
+    queryset, sort_keys, strip_fields = _prepare_cursor_page(queryset, sort, page_size, cursor,
+                                                             exclude_fields, only_fields)
+    if queryset is None:
+        return [], None
+    return _finish_cursor_page(list(queryset), sort_keys, strip_fields, page_size)
+
+
+async def cursor_page_async(queryset, sort, page_size, cursor, exclude_fields=None, only_fields=None):
+    """
+    cursor_page 的异步版本(用 motor 查询)
+    """
+    queryset, sort_keys, strip_fields = _prepare_cursor_page(queryset, sort, page_size, cursor,
+                                                             exclude_fields, only_fields)
+    if queryset is None:
+        return [], None
+    items = [item async for item in queryset.all_async()]
+    return _finish_cursor_page(items, sort_keys, strip_fields, page_size)
+
+
+def get_page_range(page, page_size, total):
+    """
+    页码防呆
+    :param page: 请求的页码
+    :param page_size: 每页数量
+    :param total: 总数，None 表示不知道总数(不限制最大页码)
+    :return: (page, max_page, skip)
+    """
+    max_page = None
+    if total is not None:
+        max_page = int((total + page_size - 1) // page_size)  # 最大页码
+        page = max_page if page > max_page else page
+    page = 1 if page < 1 else page
+    skip = (page - 1) * page_size
+    return page, max_page, skip
+
+
+def _count_cache_key(queryset):
+    """以集合名及规范化后的查询条件作为缓存 key(用 bson 的 json 格式，ObjectId 与字符串不会混淆)"""
+    query = json_util.dumps(queryset._query, sort_keys=True)
+    return queryset._document._get_collection_name(), query
+
+
+def _get_cached_count(queryset, strategy):
+    """
+    cache 方式时取缓存的总数
+    :return: (缓存 key, 总数)，没有缓存时总数为 None；不使用缓存时 key 为 None
+    """
+    if strategy != 'cache':
+        return None, None
+    key = _count_cache_key(queryset)
+    with _count_lock:
+        cached = _count_cache.get(key)
+    if cached and cached[0] > time.time():
+        return key, cached[1]
+    return key, None
+
+
+def _set_cached_count(queryset, key, total, timeout):
+    """缓存总数，超过最大条数时清理过期的"""
+    if timeout is None:
+        timeout = queryset._document._meta.get('count_cache_timeout') or COUNT_CACHE_TIMEOUT
+    now = time.time()
+    with _count_lock:
+        if len(_count_cache) >= COUNT_CACHE_SIZE:
+            for k, v in list(_count_cache.items()):
+                if v[0] <= now:
+                    del _count_cache[k]
+            if len(_count_cache) >= COUNT_CACHE_SIZE:
+                _count_cache.clear()
+        _count_cache[key] = (now + timeout, total)
+
+
+def count_total(queryset, strategy=None, timeout=None):
+    """
+    按 model 配置的方式获取查询的总数
+    :param queryset: 查询的 queryset(已带上过滤条件)
+    :param strategy: 获取方式，默认取 model 的 meta['count_strategy']
+    :param timeout: cache 方式的缓存时间(秒)，默认取 model 的 meta['count_cache_timeout']
+    :return: 总数，none 方式返回 None
+    """
+    meta = getattr(queryset._document, '_meta', {})
+    strategy = strategy or meta.get('count_strategy') or 'exact'
+    if strategy == 'none':
+        return None
+    if strategy == 'exact':
+        return queryset.count()
+
+    if not queryset._query:
+        return queryset._document._get_collection().estimated_document_count()
+    key, total = _get_cached_count(queryset, strategy)
+    if total is not None:
+        return total
+    total = queryset.count()
+    if key is not None:
+        _set_cached_count(queryset, key, total, timeout)
+    return total
+
+
+async def count_total_async(queryset, strategy=None, timeout=None):
+    """
+    count_total 的异步版本(用 motor 查询)，与同步版本共用缓存
+    """
+    meta = getattr(queryset._document, '_meta', {})
+    strategy = strategy or meta.get('count_strategy') or 'exact'
+    if strategy == 'none':
+        return None
+    if strategy == 'exact':
+        return await queryset.count_async()
+
+    if not queryset._query:
+        return await queryset._document.get_motor_collection().estimated_document_count()
+    key, total = _get_cached_count(queryset, strategy)
+    if total is not None:
+        return total
+    total = await queryset.count_async()
+    if key is not None:
+        _set_cached_count(queryset, key, total, timeout)
+    return total
+
+
+def _facet_pipeline(queryset, skip, page_size):
+    """$facet 聚合的 pipeline，同时取出一页数据及总数"""
+    items_pipeline = []
+    if queryset._ordering:
+        items_pipeline.append({'$sort': SON(queryset._ordering)})
+    if skip:
+        items_pipeline.append({'$skip': skip})
+    items_pipeline.append({'$limit': page_size})
+    projection = queryset._cursor_args.get('projection')
+    if projection:
+        items_pipeline.append({'$project': projection})
+    return [
+        {'$match': queryset._query},
+        {'$facet': {
+            'items': items_pipeline,
+            'total': [{'$count': 'count'}],
+        }},
+    ]
+
+
+def _facet_result(result):
+    """解析 $facet 聚合的结果，返回 (一页的原始数据, 总数)"""
+    result = result or {}
+    total = result.get('total') or []
+    return result.get('items') or [], total[0]['count'] if total else 0
+
+
+def _facet_query(queryset, skip, page_size):
+    """执行 $facet 聚合，返回 (一页的原始数据, 总数)"""
+    return _facet_result(next(queryset._collection.aggregate(_facet_pipeline(queryset, skip, page_size)), None))
+
+
+async def _facet_query_async(queryset, skip, page_size):
+    """_facet_query 的异步版本"""
+    pipeline = _facet_pipeline(queryset, skip, page_size)
+    results = [doc async for doc in queryset._document.aggregate_async(pipeline)]
+    return _facet_result(results[0] if results else None)
+
+
+def facet_page(queryset, page, page_size, as_pymongo=False):
+    """
+    用一次 $facet 聚合同时取出一页数据及总数，代替 count + find 两次查询
+    :param queryset: 已带上过滤条件、排序(order_by)及 only/exclude 的 queryset
+    :param page: 请求的页码
+    :param page_size: 每页数量
+    :param as_pymongo: 是否直接返回原始数据(不构造 Document)
+    :return: (items, total, page, max_page)
+    """
+    page = 1 if page < 1 else page
+    docs, total = _facet_query(queryset, (page - 1) * page_size, page_size)
+    page, max_page, skip = get_page_range(page, page_size, total)
+    if not docs and total:
+        # 页码超出了最大页码，取最后一页(与 query 方式的页码防呆一致)
+        docs, total = _facet_query(queryset, skip, page_size)
+    return _facet_items(queryset, docs, as_pymongo), total, page, max_page
+
+
+async def facet_page_async(queryset, page, page_size, as_pymongo=False):
+    """
+    facet_page 的异步版本(用 motor 查询)
+    """
+    page = 1 if page < 1 else page
+    docs, total = await _facet_query_async(queryset, (page - 1) * page_size, page_size)
+    page, max_page, skip = get_page_range(page, page_size, total)
+    if not docs and total:
+        docs, total = await _facet_query_async(queryset, skip, page_size)
+    return _facet_items(queryset, docs, as_pymongo), total, page, max_page
+
+
+def _facet_items(queryset, docs, as_pymongo):
+    if as_pymongo:
+        return docs
+    document = queryset._document
+    return [document._from_son(doc, _auto_dereference=queryset._auto_dereference) for doc in docs]
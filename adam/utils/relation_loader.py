@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+关联数据的批量加载
+
+先收集一页数据里所有 LazyReference / GenericLazyReference / RelationField 的 id，
+再按目标集合各用一次 $in 查询取回，代替每条数据每个字段各查一次(N+1 查询)。
+
+只加载序列化时会展开的关联(与 serialize 的 depth 规则一致):
+    * 第一层 Document(depth 1)的 LazyReference / RelationField 字段，在 included 里时展开
+    * 第一层 Document 的 GenericLazyReference 字段，总是展开
+
+加载的是完整的 Document(不去掉 hidden/protected 字段，输出时由 serialize 去掉)，
+之后同一个请求里的 fetch()(after_* 钩子、自定义序列化等)拿到的与单独查询的一样。
+"""
+import logging
+from collections import defaultdict
+
+from mongoengine import Document
+from mongoengine.fields import LazyReference, LazyReferenceField, GenericLazyReferenceField
+from flask import current_app as app, has_app_context
+
+from ..fields import RelationField
+from .serializer import mongo_to_dict
+from . import identity_map
+
+logger = logging.getLogger(__name__)
+
+
+def collect_documents(obj, result=None):
+    """
+    找出返回值里第一层的 Document(dict / list 里面的，不含 Document 内部的)
+    """
+    if result is None:
+        result = []
+    if isinstance(obj, Document):
+        result.append(obj)
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            collect_documents(value, result)
+    elif isinstance(obj, (list, tuple, set)):
+        for value in obj:
+            collect_documents(value, result)
+    return result
+
+
+def _ref_id(value):
+    """取出引用字段的 id(LazyReference / Document / DBRef / ObjectId)"""
+    if isinstance(value, Document):
+        return value.pk
+    return getattr(value, 'id', value)
+
+
+def _relation_fields(model, fields):
+    """model 里需要加载的关联字段 [(字段名, 字段)]"""
+    result = []
+    for name, field in model._fields.items():
+        if isinstance(field, GenericLazyReferenceField):
+            # 与 serialize 一致: 找不到同名 model 的不会展开(prefetch_related 指定的除外)
+            if (fields and name in fields) or (has_app_context() and app.models.get(name.capitalize())):
+                result.append((name, field))
+        elif isinstance(field, (LazyReferenceField, RelationField)):
+            if fields and name in fields:
+                result.append((name, field))
+    return result
+
+
+def load_relations(documents, fields=None):
+    """
+    批量加载 Document 的关联数据，加载结果放进各自的缓存，之后 fetch() 不再查询数据库
+    :param documents: 同一层的 Document 列表
+    :param fields: 要展开的字段名(请求的 included)
+    """
+    refs = defaultdict(list)  # document_type -> [LazyReference]
+    relations = defaultdict(list)  # (document_type, target_field, relation_type) -> [LazyRelation]
+    field_cache = {}
+    for doc in documents:
+        model = doc.__class__
+        if model not in field_cache:
+            field_cache[model] = _relation_fields(model, fields)
+        for name, field in field_cache[model]:
+            if isinstance(field, RelationField):
+                if doc.pk is not None:
+                    relation = getattr(doc, name)
+                    if not relation.fetched:
+                        key = (relation.document_type, relation.target_field, relation.relation_type)
+                        relations[key].append(relation)
+                continue
+            ref = getattr(doc, name)
+            if isinstance(ref, LazyReference) and ref._cached_doc is None:
+                refs[ref.document_type].append(ref)
+
+    for document_type, ref_list in refs.items():
+        # 同一个请求里已加载过的直接用
+        pending = []
+        for ref in ref_list:
+            doc = identity_map.get(document_type, ref.pk)
+            if doc is not None:
+                ref._cached_doc = doc
+            else:
+                pending.append(ref)
+        if not pending:
+            continue
+        queryset = document_type.objects(id__in=list({ref.pk for ref in pending}))
+        objects = {obj.pk: identity_map.put(obj) for obj in queryset}
+        for ref in pending:
+            # 找不到的保持原样，fetch() 时照旧抛出 DoesNotExist
+            ref._cached_doc = objects.get(ref.pk)
+
+    for (document_type, target_field, relation_type), relation_list in relations.items():
+        pending = []
+        for relation in relation_list:
+            found, value = identity_map.get_relation(relation)
+            if found:
+                relation.set_cached(value)
+            else:
+                pending.append(relation)
+        if not pending:
+            continue
+        has_one = relation_type == 'has_one'
+        ids = list({relation.instance.pk for relation in pending})
+        queryset = document_type.objects(**{f'{target_field}__in': ids})
+        grouped = defaultdict(list)
+        for obj in (_has_one_objects(queryset, target_field) if has_one else queryset):
+            grouped[_ref_id(obj._data.get(target_field))].append(obj)
+        for relation in pending:
+            objects = grouped.get(relation.instance.pk, [])
+            value = (objects[0] if objects else None) if has_one else objects
+            relation.set_cached(identity_map.put_relation(relation, value))
+
+
+def _has_one_objects(queryset, target_field):
+    """
+    has_one 的关联每个 target_field 只取 id 最大的一条(与 LazyRelation.objects 的 order_by('-id').first() 一致)，
+    在数据库里分组，不取出所有子数据
+    """
+    document_type = queryset._document
+    db_field = document_type._fields[target_field].db_field
+    pipeline = [
+        {'$sort': {'_id': -1}},
+        {'$group': {'_id': '$' + db_field, 'doc': {'$first': '$$ROOT'}}},
+    ]
+    return [document_type._from_son(result['doc']) for result in queryset.aggregate(pipeline)]
+
+
+def load_dict_relations(model, items, fields):
+    """
+    批量加载 dict 形式(as_pymongo)数据的关联数据，只取目标 model 的 included_fields
+        * LazyReferenceField: 替换成关联数据的 dict，找不到时为 {}
+        * RelationField: 替换成关联数据 dict 的列表
+    :param model: 数据的 model
+    :param items: mongo_to_dict 后的数据列表
+    :param fields: 要展开的字段名(请求的 included)
+    """
+    if not items or not fields:
+        return items
+    references = defaultdict(list)  # document_type -> [字段名]
+    for field in fields:
+        orm_field = model._fields.get(field)
+        if isinstance(orm_field, RelationField):
+            _load_dict_relation(model, items, field, orm_field)
+        elif isinstance(orm_field, LazyReferenceField):
+            references[orm_field.document_type].append(field)
+
+    # 指向同一个集合的字段合并成一次查询
+    for document_type, names in references.items():
+        ids = {item[name] for item in items for name in names if item.get(name)}
+        only_fields = document_type._meta.get('included_fields', [])
+        objects = document_type.objects(id__in=list(ids)).only(*only_fields) if ids else []
+        ref_map_data = {str(obj.id): mongo_to_dict(obj, only_fields=only_fields) for obj in objects}
+        for item in items:
+            for name in names:
+                item[name] = ref_map_data.get(item.get(name)) or {}
+    return items
+
+
+def _load_dict_relation(model, items, field, orm_field):
+    id_map_index = defaultdict(list)
+    for index, item in enumerate(items):
+        id_map_index[str(item['id'])].append(index)
+        item[field] = []
+    target_field = orm_field.target_field or model._class_name.lower()
+    only_fields = orm_field.document_type._meta.get('included_fields', [])
+    queryset = orm_field.document_type.objects(**{f'{target_field}__in': list(id_map_index.keys())})
+    if only_fields:
+        # 分组需要 target_field，输出时仍只保留 included_fields
+        queryset = queryset.only(*only_fields, target_field)
+    for obj in queryset:
+        data = mongo_to_dict(obj, only_fields=only_fields)
+        for index in id_map_index.get(str(_ref_id(obj._data.get(target_field))), []):
+            items[index][field].append(data)
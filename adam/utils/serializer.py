@@ -7,13 +7,14 @@ import time
 import uuid
 import logging
 import decimal
+import functools
 import datetime
 from enum import Enum
 
 from bson import ObjectId
 from mongoengine.fields import DateTimeField, LazyReference, ReferenceField, DictField, LazyReferenceField, \
     GenericLazyReferenceField, ListField, EmbeddedDocumentField
-from mongoengine.base.fields import ObjectIdField
+from mongoengine.base.fields import ObjectIdField, BaseField, ComplexBaseField
 from mongoengine import Document, EmbeddedDocument
 from flask import current_app as app
 
@@ -84,39 +85,10 @@ def serialize(_root, obj, field_obj, depth=1, included=None, excluded=None):
         if depth <= 2 and included and _root in included:
             return serialize(_root, obj.fetch(), None, depth, included=included)
     elif isinstance(obj, EmbeddedDocument):
-        result = {}
-        for field_name, field_obj in obj._fields.items():
-            if field_name in _build_in_field_names or obj[field_name] is None or (excluded and field_name in excluded):
-                continue
-            value = serialize(field_name, obj[field_name], field_obj, depth, included=included)
-            if value is not None:
-                result[field_name] = value
-        return result
+        return _serialize_fields(obj, _embedded_plan(obj, excluded), depth, included)
     elif isinstance(obj, Document):
         if depth <= 2:
-            result = {}
-            doc_excluded = obj._meta['hidden']
-            if depth == 2:
-                doc_excluded = doc_excluded + obj._meta['protected']
-
-            norm_doc_excluded = list(filter(lambda x: '.' not in x, doc_excluded))
-            nest_doc_excluded = list(filter(lambda x: '.' in x, doc_excluded))
-            nest_doc_excluded_dict = {}
-            for n_e_i in nest_doc_excluded:
-                p, c = n_e_i.split('.')
-                if p in nest_doc_excluded_dict:
-                    nest_doc_excluded_dict[p].append(c)
-                else:
-                    nest_doc_excluded_dict[p] = [c]
-            for field_name, field_obj in obj._fields.items():
-                value = None
-                if field_name in _build_in_field_names or obj[field_name] is None or field_name in doc_excluded:
-                    continue
-                value = serialize(
-                    field_name, obj[field_name], field_obj, depth + 1, included=included,
-                    excluded=nest_doc_excluded_dict.get(field_name))
-                if value is not None:
-                    result[field_name] = value
+            result = _serialize_fields(obj, _document_plan(obj, depth), depth + 1, included)
             if obj._meta['dynamic_fields']:
                 for df_name in obj._meta['dynamic_fields']:
                     if df_name in included:
@@ -136,9 +108,174 @@ def serialize(_root, obj, field_obj, depth=1, included=None, excluded=None):
     return result
 
 
+# 常见的值类型直接转换，不用再走 serialize 的 isinstance 判断(结果与 serialize 一致)
+_scalar_converters = {
+    str: lambda v: v,
+    int: lambda v: v,
+    float: lambda v: v,
+    bool: lambda v: v,
+    decimal.Decimal: float,
+    ObjectId: str,
+    datetime.datetime: lambda v: v.isoformat(),
+    datetime.date: lambda v: v.strftime('%Y-%m-%d'),
+    uuid.UUID: lambda v: v.hex,
+}
+
+PLAN_CACHE_SIZE = 512  # 序列化计划的缓存数量
+
+
+def _serialize_fields(obj, plan, depth, included):
+    """按序列化计划逐个字段转换"""
+    result = {}
+    for field_name, field_obj, excluded in plan:
+        value = getattr(obj, field_name)
+        if value is None:
+            continue
+        convert = _scalar_converters.get(type(value))
+        if convert is not None:
+            result[field_name] = convert(value)
+            continue
+        value = serialize(field_name, value, field_obj, depth, included=included, excluded=excluded)
+        if value is not None:
+            result[field_name] = value
+    return result
+
+
+def _build_serialize_plan(fields, excluded):
+    """
+    生成序列化计划: ((字段名, 字段, 传给下一层的 excluded), ...)
+    :param fields: model 的 _fields
+    :param excluded: 不输出的字段，a.b 形式的表示下一层的字段
+    """
+    nest_excluded = {}
+    for name in excluded:
+        if '.' in name:
+            p, c = name.split('.')
+            nest_excluded.setdefault(p, []).append(c)
+    return tuple((field_name, field_obj, nest_excluded.get(field_name))
+                 for field_name, field_obj in fields.items()
+                 if field_name not in _build_in_field_names and field_name not in excluded)
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _cached_document_plan(model, depth):
+    excluded = model._meta['hidden']
+    if depth == 2:
+        excluded = excluded + model._meta['protected']
+    return _build_serialize_plan(model._fields, excluded)
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _cached_embedded_plan(model, excluded):
+    return _build_serialize_plan(model._fields, excluded)
+
+
+def _document_plan(obj, depth):
+    """Document 的序列化计划(按 model 及 depth 缓存): 第一层去掉 hidden 字段，第二层再去掉 protected 字段"""
+    if obj._dynamic:  # 动态字段每个实例都不一样，不缓存
+        excluded = obj._meta['hidden'] + (obj._meta['protected'] if depth == 2 else [])
+        return _build_serialize_plan(obj._fields, excluded)
+    return _cached_document_plan(obj.__class__, depth)
+
+
+def _embedded_plan(obj, excluded):
+    """EmbeddedDocument 的序列化计划(按 model 及 excluded 缓存)"""
+    excluded = tuple(excluded or ())
+    if obj._dynamic:
+        return _build_serialize_plan(obj._fields, excluded)
+    return _cached_embedded_plan(obj.__class__, excluded)
+
+
+def clear_plans():
+    """清空序列化计划的缓存(运行时修改了 model 的字段或 hidden/protected 配置后调用)"""
+    _cached_document_plan.cache_clear()
+    _cached_embedded_plan.cache_clear()
+    _cached_dict_plan.cache_clear()
+    _cached_raw_plan.cache_clear()
+
+
+def _is_plain_field(field):
+    """取值、赋值都不经过额外处理的字段: 数据库里的值 to_python 后就是 Document 上的值"""
+    if field is None or isinstance(field, EmbeddedDocumentField):
+        return True
+    if isinstance(field, ComplexBaseField):  # ListField / DictField
+        return _is_plain_field(field.field) and type(field).__set__ is ComplexBaseField.__set__
+    return type(field).__get__ is BaseField.__get__ and type(field).__set__ is BaseField.__set__
+
+
+def _hydrate(field, raw):
+    """与 Document 构造时一致: 有值时 to_python，没有值时取默认值"""
+    if raw is None:
+        if field.null:
+            return None
+        default = field.default
+        return default() if callable(default) else default
+    return field.to_python(raw)
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _cached_raw_plan(model):
+    plan = []
+    for field_name, field_obj, excluded in _cached_document_plan(model, 1):
+        if isinstance(field_obj, RelationField):
+            continue  # 没有 included 时不输出
+        if isinstance(field_obj, LazyReferenceField):
+            kind = 'reference'
+        elif _is_plain_field(field_obj):
+            kind = 'value'
+        else:
+            return None  # 取值时有额外处理(如自动 dereference)的字段，不支持
+        plan.append((field_name, field_obj.db_field, field_obj, excluded, kind))
+    return tuple(plan)
+
+
+def raw_plan(model):
+    """
+    model 的原始数据(as_pymongo)转换计划，model 有不支持的字段类型时返回 None
+    """
+    if model._dynamic:
+        return None
+    return _cached_raw_plan(model)
+
+
+def raw_to_dict(model, son):
+    """
+    把 as_pymongo 查出的原始数据直接转换成 serialize(Document, depth=1, included=[]) 的结果，不构造 Document
+        * 需要先用 raw_plan(model) 确认 model 支持
+    :param model: 数据的 model
+    :param son: 原始数据(key 为数据库字段名)
+    """
+    if son.get('_cls', model._class_name) != model._class_name:  # 继承的子类，字段不一样
+        return serialize('_root', model._from_son(son), None, included=[])
+    result = {}
+    for field_name, db_field, field_obj, excluded, kind in _cached_raw_plan(model):
+        value = _hydrate(field_obj, son.get(db_field))
+        if value is None:
+            continue
+        if kind == 'reference':
+            result[field_name] = {'id': str(field_obj.build_lazyref(value).id)}
+            continue
+        convert = _scalar_converters.get(type(value))
+        if convert is not None:
+            result[field_name] = convert(value)
+            continue
+        value = serialize(field_name, value, field_obj, 2, included=[], excluded=excluded)
+        if value is not None:
+            result[field_name] = value
+    return result
+
+
 def _array_to_list_field(list_field, data):
-    result = []
     field = list_field.field
+    if isinstance(field, ReferenceField):
+        # 一次 $in 查询取出所有引用的数据，不存在的为 None
+        document_type = field.document_type
+        pk_field = document_type._fields[document_type._meta['id_field']]
+        ids = [pk_field.to_python(item) for item in data]
+        objects = {obj.pk: obj for obj in document_type.objects(pk__in=list(set(ids)))} if ids else {}
+        return [objects.get(_id) for _id in ids]
+
+    result = []
     for item in data:
         if isinstance(field, EmbeddedDocumentField):
             document_type = field.document_type
@@ -146,8 +283,6 @@ def _array_to_list_field(list_field, data):
             for e_n, e_f in document_type._fields.items():
                 tmp[e_n] = item.get(e_n)
             result.append(document_type(**tmp))
-        elif isinstance(field, ReferenceField):
-            result.append(field.document_type.objects(id=item).first())
         else:
             result.append(item)
     return result
@@ -202,75 +337,121 @@ def mongo_to_dict(obj, index_only=False, exclude_fields=[], only_fields=[], date
     """
     转换成dict，depth默认是1，只关心本model的数据
     """
-    return_data = []
     if obj is None:
         return None
+    return_data = {}
     if isinstance(obj, Document):
-        return_data.append(("id", str(obj.id)))
+        return_data['id'] = str(obj.id)
 
     if index_only and not isinstance(obj, EmbeddedDocument) and not obj._meta.get('index'):
         return None
 
-    for field_name, field in obj._fields.items():
+    data_map = obj._data
+    for field_name, convert in _dict_plan(obj, index_only, exclude_fields, only_fields, date_format):
+        data = data_map.get(field_name)
+        if data is not None:
+            data = convert(data)
+            if data is not _skip:
+                return_data[field_name] = data
+        elif not without_none:
+            return_data[field_name] = None
+    return return_data
+
+
+_skip = object()  # 不输出的字段
+
+
+def _keep(data):
+    return data
+
+
+def _enum_to_dict(data):
+    return data.value if isinstance(data, Enum) else data
+
+
+def _object_id_to_dict(data):
+    return str(data)
+
+
+def _reference_to_dict(data):
+    return str(data.id)
+
+
+def _lazy_reference_to_dict(data):
+    # ugly fix
+    if isinstance(data, ObjectId):
+        return str(data)
+    elif isinstance(data, str):
+        return data
+    return str(data.id)
+
+
+def _relation_to_dict(data):
+    return _skip
+
+
+def _datetime_converter(date_format):
+    if date_format == 'keep':
+        return _keep
+    elif date_format:
+        return lambda data: data.strftime(date_format) if isinstance(data, datetime.datetime) else data
+    return lambda data: data.isoformat() if isinstance(data, datetime.datetime) else data
+
+
+def _field_converter(field, index_only, exclude_fields, only_fields, date_format):
+    """按字段类型选好转换函数，转换时不再逐个 isinstance 判断"""
+    if isinstance(field, ListField):
+        return lambda data: _list_field_to_dict(data, index_only, date_format)
+    elif isinstance(field, EmbeddedDocumentField):
+        return lambda data: mongo_to_dict(data, index_only, exclude_fields, only_fields, date_format)
+    elif isinstance(field, DictField):
+        return _keep
+    elif isinstance(field, EnumField):
+        return _enum_to_dict
+    elif isinstance(field, DateTimeField):
+        return _datetime_converter(date_format)
+    elif isinstance(field, ObjectIdField):
+        return _object_id_to_dict
+    elif isinstance(field, ReferenceField):
+        return _reference_to_dict
+    elif isinstance(field, LazyReferenceField):
+        return _lazy_reference_to_dict
+    elif isinstance(field, RelationField):
+        return _relation_to_dict
+    return _keep
+
+
+def _build_dict_plan(fields, index_only, exclude_fields, only_fields, date_format):
+    """
+    生成 mongo_to_dict 的转换计划: ((字段名, 转换函数), ...)
+    """
+    plan = []
+    for field_name, field in fields.items():
         if only_fields:
             if field_name not in only_fields:
                 continue
         elif exclude_fields and field_name in exclude_fields:
             continue
-
         if field_name in ("id",):
             continue
-
         if index_only and not (hasattr(field, 'index') and field.index):
             continue
+        plan.append((field_name, _field_converter(field, index_only, exclude_fields, only_fields, date_format)))
+    return tuple(plan)
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _cached_dict_plan(model, index_only, exclude_fields, only_fields, date_format):
+    return _build_dict_plan(model._fields, index_only, exclude_fields, only_fields, date_format)
 
-        data = obj._data.get(field_name)
-        if data is not None:
-            _field_val = obj._fields[field_name]
-            if isinstance(_field_val, ListField):
-                _result = (field_name, _list_field_to_dict(data, index_only, date_format))
-                if _result:
-                    return_data.append(_result)
-            elif isinstance(_field_val, EmbeddedDocumentField):
-                return_data.append(
-                    (field_name, mongo_to_dict(data, index_only, exclude_fields, only_fields, date_format)))
-            elif isinstance(_field_val, DictField):
-                return_data.append((field_name, data))
-            elif isinstance(_field_val, EnumField):
-                if isinstance(data, Enum):
-                    return_data.append((field_name, data.value))
-                else:
-                    return_data.append((field_name, data))
-            elif isinstance(_field_val, DateTimeField):
-                if isinstance(data, datetime.datetime):
-                    # return_data.append((field_name, data.strftime('%Y-%m-%d')))
-                    if date_format == 'keep':
-                        return_data.append((field_name, data))
-                    elif date_format:
-                        return_data.append((field_name, data.strftime(date_format)))
-                    else:
-                        return_data.append((field_name, data.isoformat()))
-                else:
-                    return_data.append((field_name, data))
-            elif isinstance(_field_val, ObjectIdField):
-                return_data.append((field_name, str(data)))
-            elif isinstance(_field_val, ReferenceField):
-                return_data.append((field_name, str(data.id)))
-            elif isinstance(_field_val, LazyReferenceField):
-                # ugly fix
-                if isinstance(data, ObjectId):
-                    return_data.append((field_name, str(data)))
-                elif isinstance(data, str):
-                    return_data.append((field_name, data))
-                else:
-                    return_data.append((field_name, str(data.id)))
-            elif not isinstance(_field_val, RelationField):
-                return_data.append((field_name, obj._data[field_name]))
-        else:
-            if not without_none:
-                return_data.append((field_name, data))
 
-    return dict(return_data)
+def _dict_plan(obj, index_only, exclude_fields, only_fields, date_format):
+    """mongo_to_dict 的转换计划(按 model 及参数缓存)"""
+    exclude_fields = frozenset(exclude_fields or ())
+    only_fields = frozenset(only_fields or ())
+    if obj._dynamic:  # 动态字段每个实例都不一样，不缓存
+        return _build_dict_plan(obj._fields, index_only, exclude_fields, only_fields, date_format)
+    return _cached_dict_plan(obj.__class__, bool(index_only), exclude_fields, only_fields, date_format)
 
 
 def _list_field_to_dict(list_field, index_only=False, date_format=None):
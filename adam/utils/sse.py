@@ -1,6 +1,5 @@
 # -*- coding:utf-8 -*-
 
-import json
 import time
 import queue
 import logging
@@ -8,7 +7,7 @@ import threading
 
 from flask import Response, stream_with_context
 
-from .json_util import CustomJSONEncoder
+from .json_util import dumps
 
 
 LOGGER = logging.getLogger(__name__)
@@ -53,7 +52,7 @@ class SseResponse:
         if isinstance(data, (tuple, set)):
             data = list(data)
         if isinstance(data, (dict, list)):
-            data = json.dumps(data, ensure_ascii=False, cls=CustomJSONEncoder)
+            data = dumps(data)
         event_name = event_name or self.message_event_name
         sse_data = f'id: {self.index}\nevent: {event_name}\ndata: {data}\n\n'
         return sse_data
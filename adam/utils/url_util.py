@@ -84,6 +84,16 @@ class ParsedRequest(object):
     # `PAGINATION_DEFAULT` unless pagination is disabled.
     page_size = 0
 
+    # `after` value of the query string (?after). 游标分页的游标，None 表示不使用游标分页,
+    # 空字符串表示游标分页的第一页
+    after = None
+
+    # `count` value of the query string (?count). 是否返回总数，None 表示按默认方式
+    count = None
+
+    # `stream` value of the query string (?stream). 列表接口是否流式返回
+    stream = False
+
     # `If-Modified-Since` request header value. Defaults to None.
     if_modified_since = None
 
@@ -211,8 +221,11 @@ def parse_request(document):
         assert r.page_size > 0
     except (ValueError, BadRequestKeyError, AssertionError):
         r.page_size = config.PAGINATION_DEFAULT
-    if r.page_size > config.PAGINATION_LIMIT:
-        r.page_size = config.PAGINATION_LIMIT
+    stream = data.get(config.QUERY_STREAM) if config.QUERY_STREAM in data else args.get(config.QUERY_STREAM)
+    r.stream = stream is not None and str(stream).lower() not in ('0', 'false', 'no', '')
+    page_limit = config.STREAM_PAGINATION_LIMIT if r.stream else config.PAGINATION_LIMIT
+    if r.page_size > page_limit:
+        r.page_size = page_limit
 
     if config.QUERY_PAGE in data or config.QUERY_PAGE in args:
         try:
@@ -220,6 +233,15 @@ def parse_request(document):
         except ValueError:
             r.page = 1
 
+    if config.QUERY_CURSOR in data:
+        r.after = data.get(config.QUERY_CURSOR) or ''
+    elif config.QUERY_CURSOR in args:
+        r.after = args.get(config.QUERY_CURSOR) or ''
+
+    count = data.get(config.QUERY_COUNT) if config.QUERY_COUNT in data else args.get(config.QUERY_COUNT)
+    if count is not None:
+        r.count = str(count).lower() not in ('0', 'false', 'no', '')
+
     if headers:
         r.if_modified_since = weak_date(headers.get('If-Modified-Since'))
         r.if_none_match = _etag_parse('If-None-Match', headers)
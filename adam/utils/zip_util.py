@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+zip 流式输出
+
+zipfile 写进一个不能 seek 的文件对象时，会在每个文件后面用 data descriptor 记录大小及 crc，
+不需要回头修改文件头，因此可以边压缩边输出，不用把整个压缩包放在内存里。
+"""
+import zipfile
+
+ZIP_CHUNK_SIZE = 64 * 1024  # 缓冲的压缩数据超过这个大小时输出一次
+
+
+class _ChunkWriter(object):
+    """只能追加写入的文件对象，写入的内容由 pop() 取出"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def iter_zip(entries, compresslevel=None, chunk_size=ZIP_CHUNK_SIZE):
+    """
+    逐块生成 zip 压缩包的内容
+    :param entries: (文件名, 内容片段的迭代器) 的迭代器，内容片段为 str(按 utf-8 编码) 或 bytes
+    :param compresslevel: 压缩级别 0-9，None 为 zlib 的默认级别
+    :param chunk_size: 每次输出的最小字节数
+    :return: 生成 bytes 片段的生成器
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, mode='w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+        for name, contents in entries:
+            # 事先不知道文件大小，总是使用 zip64，避免超过 2G 时出错
+            with archive.open(name, mode='w', force_zip64=True) as fp:
+                for data in contents:
+                    fp.write(data.encode('utf-8') if isinstance(data, str) else data)
+                    if writer.size >= chunk_size:
+                        yield writer.pop()
+            if writer.size >= chunk_size:
+                yield writer.pop()
+    data = writer.pop()
+    if data:
+        yield data
@@ -9,34 +9,93 @@ import json
 import copy
 import logging
 import inspect
+import itertools
 import asyncio
 import traceback
-from io import StringIO
-from io import BytesIO
-import zipfile
 from datetime import datetime
+from collections import defaultdict
 from urllib.parse import quote
 
 import requests
 import mongoengine
 from mongoengine import Document
-from flask import request, Response
+from flask import request, Response, stream_with_context
 from flask import current_app as app
 from bson import ObjectId
 from mongoengine.queryset.visitor import Q
-from mongoengine.fields import LazyReferenceField, ReferenceField
-from werkzeug.exceptions import NotFound, Unauthorized, BadRequest, HTTPException
+from mongoengine.fields import LazyReferenceField, ReferenceField, GridFSProxy, LazyReference
+from werkzeug.exceptions import NotFound, Unauthorized, BadRequest, HTTPException, RequestedRangeNotSatisfiable
+from werkzeug.wsgi import FileWrapper
 
 from ..exceptions import CommonException, BussinessCommonException, BaseError
-from ..utils.serializer import serialize, dict_to_mongo, mongo_to_dict
+from ..utils.serializer import serialize, dict_to_mongo, mongo_to_dict, raw_plan, raw_to_dict
 from ..utils.url_util import parse_request, payload, get_param
-from ..fields import RelationField
+from ..utils.json_util import dumps
+from ..utils.async_util import run_async
+from ..utils.csv_util import iter_csv
+from ..utils.zip_util import iter_zip
+from ..utils.import_util import STREAM_IMPORT_FORMATS, iter_csv_records, iter_ndjson_records
+from ..utils.page_util import cursor_page, count_total, get_page_range, facet_page, cursor_page_async, \
+    count_total_async, facet_page_async
+from ..utils.relation_loader import collect_documents, load_relations, load_dict_relations
 from ..documents.resource_document import ResourceDocument
+from ..fields import RelationField
+from ..middlewares.base import build_middleware_chain
 from .blueprint import return_data
-from ..celery_base_task import BaseTask
+from .endpoint import build_endpoint_descriptor
 
 logger = logging.getLogger(__name__)
 _env = os.environ.get('ENV') or 'development'
+STREAM_CHUNK_SIZE = 100  # 流式返回时每批序列化的数量
+EXPORT_BATCH_SIZE = 1000  # 导出时每次从数据库取的数量
+FILE_CHUNK_SIZE = 255 * 1024  # 流式返回文件时每次读取的大小(GridFS 默认的 chunk 大小)
+
+
+class LazyItem(object):
+    """
+    原子更新(meta['update_engine'] 为 atomic)时 item_update 收到的 instance:
+        请求时不先取出数据，读写 pk 以外的属性时才查询(原子更新后为更新后的数据)，数据不存在时 data_not_exist
+    """
+    __slots__ = ('queryset', '_pk', '_document')
+
+    def __init__(self, queryset, pk=None):
+        object.__setattr__(self, 'queryset', queryset)  # 按 id 过滤的 queryset
+        object.__setattr__(self, '_pk', pk)
+        object.__setattr__(self, '_document', None)
+
+    def _fetch(self):
+        if self._document is None:
+            document = self.queryset.first()
+            if document is None:
+                BaseError.data_not_exist()
+            self._set_document(document)
+        return self._document
+
+    def _set_document(self, document):
+        object.__setattr__(self, '_document', document)
+
+    @property
+    def pk(self):
+        return self._pk if self._pk is not None else self._fetch().pk
+
+    @property
+    def id(self):
+        return self.pk
+
+    def __getattr__(self, name):
+        return getattr(self._fetch(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._fetch(), name, value)
+
+    def __getitem__(self, name):
+        return self._fetch()[name]
+
+    def __setitem__(self, name, value):
+        self._fetch()[name] = value
+
+    def __repr__(self):
+        return '<LazyItem(%s: %s)>' % (self.queryset._document.__name__, self._pk)
 
 
 class ResourceView(object):
@@ -47,6 +106,7 @@ class ResourceView(object):
     model = None
     app = None
     acl = []  # 需要控制权限的 action 列表
+    async_dispatch = None  # 是否使用 {action}_async 处理函数，None 时按配置 ASYNC_DISPATCH
 
     meta = {
         'datasource': 'mongodb',
@@ -58,6 +118,7 @@ class ResourceView(object):
         'collection_create': {'methods': ['POST']},
         'collection_count': {'methods': ['GET'], 'url': 'count'},
         'collection_import': {'methods': ['POST'], 'url': 'import'},
+        'collection_export': {'methods': ['GET'], 'url': 'export'},
         'item_read': {'methods': ['GET']},
         'item_update': {'methods': ['PUT']},
         'item_delete': {'methods': ['DELETE']},
@@ -90,6 +151,34 @@ class ResourceView(object):
             self.name = model.__name__.lower()
         self.app = app
         self.routes = routes
+        self.middleware_chain = None  # 预先组装好的中间件调用链
+        self.endpoints = {}  # endpoint -> EndpointDescriptor，注册路由时生成
+
+    def register_endpoint(self, endpoint):
+        """
+        注册路由时预先解析 endpoint，请求时直接查找(由 Adam._add_resource_url_rules 调用)
+        """
+        descriptor = build_endpoint_descriptor(self, endpoint)
+        if descriptor:
+            self.endpoints[endpoint] = descriptor
+        return descriptor
+
+    def get_endpoint(self, endpoint=None):
+        """
+        获取 endpoint 的描述信息，默认取当前请求的
+        """
+        endpoint = endpoint or request.endpoint
+        return self.endpoints.get(endpoint) or self.register_endpoint(endpoint)
+
+    def compile_middlewares(self, middlewares):
+        """
+        启动时组装中间件调用链(由 Adam.load_route 调用)，请求时不再重复组装
+        """
+        self.middleware_chain = build_middleware_chain(middlewares, self._dispatch_view_request)
+        return self.middleware_chain
+
+    def _dispatch_view_request(self):
+        return self.dispatch_request(**request.view_args)
 
     def __call__(self, *args, **kwargs):
         """
@@ -110,20 +199,16 @@ class ResourceView(object):
             middleware2 after
             middleware1 after
         """
-        reserved_middlewares = list(reversed(self.app.available_middlewares))
-
         # pre process request
-        _, action, resource, _ = request.endpoint.split('|')
-        request.resource = resource
-        request.action = action
+        descriptor = self.get_endpoint()
+        request.resource = descriptor.resource
+        request.action = descriptor.action
         request.view = self
 
         result = None
         try:
-            def current(): return self.dispatch_request(*args, **kwargs)
-            for mw in reserved_middlewares:
-                current = mw(current)
-            result = current()
+            chain = self.middleware_chain or self.compile_middlewares(self.app.available_middlewares)
+            result = chain()
         except Exception as ex:
             result = self.render_error(400, getattr(ex, 'message', str(ex)), ex)
         return result
@@ -138,39 +223,18 @@ class ResourceView(object):
         if not included_fields:
             return items
         if items and isinstance(items[0], ResourceDocument):
+            # 每个关联的集合只查询一次，结果放进各个 LazyReference 的缓存
+            load_relations(items, included_fields)
             for item in items:
                 for field in included_fields:
                     if field in self.model._fields and item[field] and isinstance(self.model._fields[field], LazyReferenceField):
                         try:
-                            item[field] = item[field].fetch()
+                            item[field].fetch()
                         except item[field].document_type.DoesNotExist:
                             logger.warning(f'reference doesnot exist: {field}:{item[field].pk} in model {self.model.__name__}')
                             item[field] = None
         elif items and isinstance(items[0], dict):
-            id_map_index = {ObjectId(item['id']): index for index, item in enumerate(items)}
-            ids = list(id_map_index.keys())
-            for field in included_fields:
-                orm_field = self.model._fields.get(field)
-                if not orm_field:
-                    continue
-                if isinstance(orm_field, RelationField):
-                    for item in items:
-                        item[field] = []
-                    target_field = orm_field.target_field
-                    query = {f'{target_field}__in': ids}
-                    only_fields = orm_field.document_type._meta.get('included_fields', [])
-                    objects = orm_field.document_type.objects(**query).only(*only_fields)
-                    for object in objects:
-                        id = getattr(object, target_field).id
-                        items[id_map_index[id]][field].append(mongo_to_dict(object, only_fields=only_fields))
-                elif isinstance(orm_field, LazyReferenceField):
-                    query = {'id__in': [item[orm_field.name] for item in items]}
-                    only_fields = orm_field.document_type._meta.get('included_fields', [])
-                    objects = orm_field.document_type.objects(**query).only(*only_fields)
-                    ref_map_data = {str(object.id): mongo_to_dict(object, only_fields=only_fields)
-                                    for object in objects}
-                    for item in items:
-                        item[orm_field.name] = ref_map_data.get(item[orm_field.name]) or {}
+            load_dict_relations(self.model, items, included_fields)
 
     # @trace()
     def dispatch_request(self, *args, **kwargs):
@@ -182,7 +246,6 @@ class ResourceView(object):
         """
         try:
             response = None
-            handler = None
             # logger.debug(request.method + ' - ' + request.endpoint)
             if request.method == 'OPTIONS':
                 response = self.options()
@@ -190,40 +253,33 @@ class ResourceView(object):
                 # 解析请求，并放入request ctx
                 req = parse_request(self.model)
                 request.req = req
-                endpoint = request.endpoint
-                _source, action, _view_name, _item_reference = endpoint.split('|')
-                is_collection = action.startswith('collection')
-                is_item = action.startswith('item')
-                is_batch = action.startswith('batch')
-                is_proxy = action.startswith('proxy')
-                is_remote_item = action.startswith('remote_item')
-                is_customize = '@' in action
+                descriptor = self.get_endpoint()
+                endpoint = descriptor.endpoint
+                action = descriptor.action
                 instance = None
-                if is_customize:
-                    real_action = action.split('@')[-1]
-                    if is_item:
-                        handler = self.routes['item'][real_action]['function_name']
-                    elif is_collection:
-                        handler = self.routes['collection'][real_action]['function_name']
-                    elif is_remote_item:
-                        handler = self.routes['remote_item'][real_action]['function_name']
-                    else:
-                        logger.error('Unknow handler %s', action)
-                        BaseError.handle_error('Unknow handler %s' % action)
-                else:
-                    handler = action
-                if handler:
-                    if is_batch:
+                if descriptor.is_customize and not descriptor.handler_name:
+                    BaseError.handle_error('Unknow handler %s' % action)
+                handler = descriptor.handler_name
+                if handler and descriptor.async_handler and not descriptor.is_batch and not descriptor.is_proxy \
+                        and self._use_async_dispatch():
+                    # 异步处理: 查询数据及处理函数都在事件循环里执行，协程交给 render_obj 执行
+                    response = self._dispatch_async(descriptor, kwargs)
+                elif handler:
+                    if descriptor.is_batch:
                         if self.model:
                             data = request.json
                             ids = data.get('ids', [])
-                            instances = self.model.find_by_ids(ids)
+                            if self._use_bulk_batch() or (handler == 'batch_update' and self._use_atomic_update()):
+                                # 批量写入时不需要先取出数据
+                                instances = self.model.objects(id__in=ids)
+                            else:
+                                instances = self.model.find_by_ids(ids)
                             kwargs['instances'] = instances
-                    if is_item:
+                    if descriptor.is_item:
                         # 支持item, item_customize
-                        if not is_proxy and self.model:
+                        if not descriptor.is_proxy and self.model:
                             item_condition = {}
-                            id_field = self.model._meta.get('item_id_field') or 'id'
+                            id_field = descriptor.id_field
                             if self.model.is_valid_id(kwargs['id']):
                                 item_condition['id'] = kwargs['id']
                             elif id_field != 'id':
@@ -232,14 +288,11 @@ class ResourceView(object):
                                 BaseError.data_not_exist()
                             if not self.model:
                                 BaseError.data_not_exist()
-                            instance = self.model.find_one(item_condition)
-                            if not instance:
-                                BaseError.data_not_exist()
-                            kwargs['instance'] = instance
+                            instance = kwargs['instance'] = self._get_item_instance(handler, action, item_condition)
                             del kwargs['id']
                     if not self.has_permission(action, endpoint, instance) and not app.config.get('DEBUG'):
                         BaseError.forbidden()
-                    function = getattr(self, handler)
+                    function = descriptor.handler or getattr(self, handler)
                     response = function(**kwargs)
                 else:
                     BaseError.data_not_exist()
@@ -266,14 +319,54 @@ class ResourceView(object):
         except Exception as ex:
             return self.render_error(500, '未知错误', ex)
 
+    def _use_async_dispatch(self):
+        """
+        是否使用 async 处理函数: view 的 async_dispatch 优先，其次是配置 ASYNC_DISPATCH，都为 None 时运行在 ASGI 服务器上才使用
+            * 流式返回时仍使用同步处理函数(响应是在请求线程里边迭代游标边输出的)
+        """
+        if self.model is None or request.req.stream:
+            return False
+        enabled = self.async_dispatch
+        if enabled is None:
+            enabled = app.config.get('ASYNC_DISPATCH')
+        if enabled is None:
+            enabled = getattr(app, 'asgi_mode', False)
+        return bool(enabled)
+
+    async def _dispatch_async(self, descriptor, kwargs):
+        """
+        dispatch_request 的异步版本，用 motor 查询 item 数据，然后执行 {handler_name}_async
+            * 协程在事件循环里执行(ASGI 模式下是服务器的循环)，可能阻塞的同步调用(权限判断)放到线程里执行
+        """
+        instance = None
+        if descriptor.is_item:
+            item_condition = {}
+            id_field = descriptor.id_field
+            if self.model.is_valid_id(kwargs['id']):
+                item_condition['id'] = kwargs['id']
+            elif id_field != 'id':
+                item_condition[id_field] = kwargs['id']
+            else:
+                BaseError.data_not_exist()
+            instance = await self.model.find_cached_async(**item_condition)
+            if not instance:
+                BaseError.data_not_exist()
+            kwargs['instance'] = instance
+            del kwargs['id']
+        if self.acl and descriptor.action in self.acl:
+            # user.has_permission 可能查询数据库
+            allowed = await asyncio.to_thread(self.has_permission, descriptor.action, descriptor.endpoint, instance)
+            if not allowed and not app.config.get('DEBUG'):
+                BaseError.forbidden()
+        return await descriptor.async_handler(**kwargs)
+
     def render_obj(self, obj):
         included = None
 
         # async 异步函数
         if inspect.iscoroutine(obj):
-            # obj = asyncio.run(obj)
-            loop = BaseTask._get_event_loop()
-            obj = loop.run_until_complete(obj)
+            # 提交给后台事件循环执行，各请求的协程可以并发
+            obj = run_async(obj, timeout=app.config.get('ASYNC_TIMEOUT'))
         # yield 生成器函数(途中各 yield 语句返回的值会被拼接到一起，最后以 list 形式一起返回)
         elif inspect.isgenerator(obj):
             results = []
@@ -303,9 +396,76 @@ class ResourceView(object):
             obj = return_data(data=obj)
         elif obj is None:
             obj = return_data()
+        # 序列化前批量加载要展开的关联数据，避免逐条查询
+        documents = collect_documents(obj)
+        if documents:
+            load_relations(documents, included)
         response = serialize('_root', obj, None, included=included)
-        return Response(json.dumps(response), status=200, mimetype='application/json')
+        return Response(dumps(response, ensure_ascii=True, as_bytes=True), status=200, mimetype='application/json')
     
+    def render_stream(self, items, meta=None, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        流式返回列表数据: 边迭代边序列化输出，内存占用与数据量无关，首字节也更早返回
+            返回的格式与 return_data(data={'items': items, 'meta': meta}) 一致
+        :param items: 数据的迭代器(queryset、生成器等)，元素可以是 Document 或 dict
+        :param meta: 分页信息，也可以是函数(数据全部输出后再调用，如游标)
+        :param chunk_size: 每批序列化的数量(批量加载关联数据)
+            * 输出中途出错时，items 截止到出错前，meta 为 null，并带上 error: {code, message}
+        """
+        included = (request.req.included or []) if hasattr(request, 'req') else []
+
+        def generate():
+            header = dumps(return_data(), ensure_ascii=True)
+            yield header[:-1] + ',"data":{"items":['
+            # queryset 每次 iter() 都会重新查询，包一层生成器
+            iterator = (item for item in items)
+            first = True
+            try:
+                while True:
+                    chunk = list(itertools.islice(iterator, chunk_size))
+                    if not chunk:
+                        break
+                    self._patch_included(chunk, included)
+                    data = ','.join(dumps(serialize('items', item, None, included=included), ensure_ascii=True)
+                                    for item in chunk)
+                    yield data if first else ',' + data
+                    first = False
+                yield '],"meta":' + dumps(meta() if callable(meta) else meta, ensure_ascii=True) + '}}'
+            except Exception as e:
+                # 已经开始输出，状态码改不了: 补全 JSON 结构，并在最外层加上 error 标明输出不完整
+                logger.exception('流式输出异常 %s %s: %s', request.method, request.full_path, e)
+                if isinstance(e, (BussinessCommonException, CommonException)):
+                    error = {'code': e.code, 'message': e.message}
+                else:
+                    error = {'code': 500, 'message': '未知错误'}
+                yield '],"meta":null},"error":' + dumps(error, ensure_ascii=True) + '}'
+
+        return Response(stream_with_context(generate()), status=200, mimetype='application/json')
+
+    def render_file(self, grid_out, content_disposition=None, content_type=None):
+        """
+        流式返回 GridFS 文件: 每次只读一个 chunk，不把整个文件读进内存
+            * 带 Range 请求头时只返回对应的部分(206)
+            * GridFS 的文件不会被修改，用文件 id 作为 ETag，If-None-Match 匹配时返回 304
+        :param grid_out: GridOut 对象
+        :param content_disposition: Content-Disposition 响应头
+        :param content_type: 文件类型，默认取文件记录的 content_type
+        """
+        grid_out.seek(0)  # GridFSProxy 会缓存 GridOut，可能已经读过
+        content_type = content_type or grid_out.content_type or 'application/octet-stream'
+        body = FileWrapper(grid_out, buffer_size=grid_out.chunk_size or FILE_CHUNK_SIZE)
+        response = Response(body, mimetype=content_type, direct_passthrough=True)
+        if content_disposition:
+            response.headers['Content-Disposition'] = content_disposition
+        response.set_etag(str(grid_out._id))
+        response.last_modified = grid_out.upload_date
+        response.content_length = grid_out.length
+        try:
+            return response.make_conditional(request, accept_ranges=True, complete_length=grid_out.length)
+        except RequestedRangeNotSatisfiable as ex:
+            grid_out.close()
+            return ex.get_response()
+
     def render_bussiness_error(self, exception):
         if _env != 'production' and not exception.data:
             # traceback.print_exc()
@@ -314,7 +474,7 @@ class ResourceView(object):
 
         res = return_data(code=exception.code, message=exception.message, data=exception.data)
         logger.error(res, exc_info=exception)
-        return Response(json.dumps(res), status=200, mimetype='application/json')
+        return Response(dumps(res, ensure_ascii=True, as_bytes=True), status=200, mimetype='application/json')
 
     def render_error(self, code, message, ex=None):
         data = None
@@ -332,7 +492,7 @@ class ResourceView(object):
         # logger.error(res, exc_info=ex)
         logger.exception("请求异常 %s %s: %s，参数:%s", request.method, request.full_path, ex, get_param())
 
-        return Response(json.dumps(res), status=200, mimetype='application/json')
+        return Response(dumps(res, ensure_ascii=True, as_bytes=True), status=200, mimetype='application/json')
 
     def has_permission(self, action, endpoint, instance=None):
         """
@@ -388,50 +548,123 @@ class ResourceView(object):
         params = args or request.args
         return requests.request(method, url, files=request.files, params=params, json=data, headers=headers)
 
-    def collection_download_to_csv(self, data, prefix, header=None):
+    def collection_download_to_csv(self, data, prefix, header=None, bom=False):
+        """
+        下载 csv 文件，边迭代边输出
+        :param data: 行的迭代器(列表、生成器等)，每行为值的列表
+        :param prefix: 文件名前缀
+        :param header: 表头
+        :param bom: 是否在开头加上 UTF-8 BOM
+        """
         file_name = prefix + '_' + datetime.now().strftime('%Y-%m-%d') + '.csv'
         content_disposition = 'attachment; filename*=UTF-8\'\'%s' % quote(file_name)
         headers = {
-            'Content-Type': 'plain/text',
             'Content-Disposition': content_disposition
         }
-        text = ''
-        if header:
-            text = ','.join(header) + '\n'
-        for item in data:
-            text = text + ','.join(item) + '\n'
-        response = Response(text, headers=headers, mimetype='plain/text', direct_passthrough=True)
+        response = Response(stream_with_context(iter_csv(data, header, bom=bom)), headers=headers,
+                            mimetype='text/csv', direct_passthrough=True)
         return response
 
-    def collection_download_to_json_zip(self, items, prefix=''):
+    def collection_download_to_json_zip(self, items, prefix='', compresslevel=None, json_lines=False):
+        """
+        下载 json 的 zip 文件，边迭代边压缩输出
+        :param items: 数据的迭代器(queryset、生成器等)，元素为 Document 或 dict
+        :param prefix: 文件名前缀
+        :param compresslevel: 压缩级别 0-9，默认取配置 ZIP_COMPRESS_LEVEL
+        :param json_lines: 为 True 时所有数据写进一个 json lines 文件，否则每条数据一个 json 文件(按 id 或序号命名)
+        """
         file_name = self.name + '_' + prefix + '_' + datetime.now().strftime('%Y-%m-%d') + '.zip'
         content_disposition = 'attachment; filename*=UTF-8\'\'%s' % quote(file_name)
         headers = {
-            'Content-Type': 'application/zip',
             'Content-Disposition': content_disposition
         }
-        # This is my zip file
-        buff = BytesIO()
-        zip_archive = zipfile.ZipFile(buff, mode='w')
-
-        for item in items:
-            fb = StringIO()
-            fb.write(json.dumps(item.to_dict()))
-            zip_archive.writestr(str(item.id) + '.json', fb.getvalue())
-
-        zip_archive.close()
-        response = Response(buff.getvalue(), headers=headers, mimetype='application/zip', direct_passthrough=True)
+        if compresslevel is None:
+            compresslevel = app.config.get('ZIP_COMPRESS_LEVEL')
+        if hasattr(items, 'batch_size'):
+            items = items.batch_size(EXPORT_BATCH_SIZE)
+        items = (item.to_dict() if isinstance(item, Document) else item for item in items)
+        if json_lines:
+            entries = [(self.name + '.jsonl', (dumps(item) + '\n' for item in items))]
+        else:
+            # 按 id 命名，没有 id(如 only 不含 id)时按序号命名
+            entries = ((str(item['id'] if item.get('id') is not None else index) + '.json', [dumps(item)])
+                       for index, item in enumerate(items, 1))
+        response = Response(stream_with_context(iter_zip(entries, compresslevel=compresslevel)), headers=headers,
+                            mimetype='application/zip', direct_passthrough=True)
         return response
 
     def collection_import(self):
         """
         collection import endpoint POST
             - csv data import
+            - 请求体为 csv(text/csv，第一行为表头) 或 json lines(application/x-ndjson) 时流式导入，返回逐行的错误信息
         """
+        fmt = STREAM_IMPORT_FORMATS.get(request.mimetype)
+        if fmt:
+            return return_data(data=self._stream_import(fmt))
         data = request.get_json() or {}
         items = self.model.import_csv(data)
         return return_data(data={'items': items})
 
+    def _stream_import(self, fmt):
+        """
+        边读请求体边导入，import_options['form'] 里的字段从 url 参数取值作为默认值
+            ?batch_size= 每批写入的数量，默认取配置 IMPORT_BATCH_SIZE
+        """
+        import_options = self.model._meta.get('import_options') or {}
+        defaults = {key: request.args.get(key) for key in import_options.get('form') or []
+                    if request.args.get(key) is not None}
+        try:
+            batch_size = int(request.args.get('batch_size') or app.config.get('IMPORT_BATCH_SIZE') or 1000)
+            assert batch_size > 0
+        except (ValueError, AssertionError):
+            BaseError.param_error('batch_size 参数错误')
+        if fmt == 'csv':
+            records = iter_csv_records(request.stream)
+        else:
+            records = iter_ndjson_records(request.stream)
+        return self.model.import_stream(records, defaults=defaults, text=fmt == 'csv', batch_size=batch_size,
+                                        max_errors=app.config.get('IMPORT_MAX_ERRORS') or 1000)
+
+    def collection_export(self):
+        """
+        collection export endpoint GET
+            - model 的 meta['export'] 为 True 时才开放，权限与 collection_read 相同
+            - 流式导出 csv: 按 where 过滤、sort 排序，only 指定导出的字段(hidden、protected 的字段不导出)
+            - format=zip 时导出 json 的 zip 压缩包(json_lines、level 参数)
+            - 边读游标边输出，内存占用与导出的数量无关，最多导出配置 EXPORT_LIMIT 条
+        """
+        if not self.model._meta.get('export'):
+            BaseError.data_not_exist()
+        read_endpoint = (request.endpoint or '').replace('|collection_export|', '|collection_read|')
+        if not self.has_permission('collection_read', read_endpoint) and not app.config.get('DEBUG'):
+            BaseError.forbidden()
+        self._patch_where()
+        excluded = set(self.model._meta.get('hidden', [])) | set(self.model._meta.get('protected', []))
+        only_fields = request.req.only
+        if isinstance(only_fields, str):
+            only_fields = only_fields.split(',')
+        fields = [f for f in only_fields or self.model._fields_ordered if f in self.model._fields and f not in excluded]
+        fields = [f for f in fields if not isinstance(self.model._fields[f], RelationField)]
+        if not fields:
+            BaseError.param_error('没有可导出的字段')
+
+        queryset = self.model.objects(**request.req.where).order_by(*request.req.sort).only(*fields)
+        queryset = queryset.limit(app.config.get('EXPORT_LIMIT') or 100000).batch_size(EXPORT_BATCH_SIZE)
+        # 与 read_engine 无关，统一按 mongo_to_dict 转换(引用字段输出为 id 字符串)
+        items = (mongo_to_dict(item, only_fields=fields) for item in queryset)
+        if request.args.get('format') == 'zip':
+            # json 格式的 zip 压缩包，json_lines=1 时写进一个 json lines 文件
+            items = ({f: item.get(f) for f in fields} for item in items)
+            json_lines = str(request.args.get('json_lines', '')).lower() in ('1', 'true')
+            level = request.args.get('level')
+            compresslevel = min(int(level), 9) if level and level.isdigit() else None
+            return self.collection_download_to_json_zip(items, 'export', compresslevel=compresslevel,
+                                                        json_lines=json_lines)
+        rows = ([item.get(f) for f in fields] for item in items)
+        bom = str(request.args.get('bom', '')).lower() in ('1', 'true')
+        return self.collection_download_to_csv(rows, self.name, header=fields, bom=bom)
+
     def collection_count(self):
         """
         collection count endpoint GET
@@ -448,27 +681,138 @@ class ResourceView(object):
 
         items = []
         count = queryset.filter(**request.req.where).count()
-        _query = queryset.filter(**request.req.where)._query
-        sort = request.req.sort
+        if by:
+            items = list(queryset.aggregate(*self._count_by_pipeline(queryset.filter(**request.req.where), by)))
+
+        # build items
+        return return_data(data={'items': items, 'meta': {'total': count}})
+
+    async def collection_count_async(self):
+        """
+        collection count endpoint GET(异步处理时使用): 总数及分组统计用 motor 并发查询
+        """
+        self._patch_where()
+        by = request.req.by
+        queryset = self.model.objects(**request.req.where)
+        if not by:
+            return return_data(data={'items': [], 'meta': {'total': await queryset.count_async()}})
+        pipeline = self._count_by_pipeline(queryset, by)
+        count, items = await asyncio.gather(
+            queryset.count_async(), self._list_async(self.model.aggregate_async(pipeline)))
+        return return_data(data={'items': items, 'meta': {'total': count}})
+
+    def _count_by_pipeline(self, queryset, by):
+        """
+        按字段分组统计数量的聚合 pipeline
+        """
         transformed_sort = {}
-        for s in sort:
+        for s in request.req.sort:
             if s.startswith('-'):
                 transformed_sort[s[1:]] = -1
             elif s.startswith('+'):
                 transformed_sort[s[1:]] = 1
             else:
                 transformed_sort[s] = -1
+        return [
+            {"$match": queryset._query},
+            {"$group": {"_id": '$' + by, "count": {"$sum": 1}}},
+            {"$sort": transformed_sort},
+        ]
 
-        if by:
-            pipeline = [
-                {"$match": _query},
-                {"$group": {"_id": '$' + by, "count": {"$sum": 1}}},
-                {"$sort": transformed_sort},
-            ]
-            items = list(queryset.aggregate(*pipeline))
+    @staticmethod
+    async def _list_async(iterator):
+        """把异步迭代器(all_async、aggregate_async 等)的结果取成 list"""
+        return [item async for item in iterator]
 
-        # build items
-        return return_data(data={'items': items, 'meta': {'total': count}})
+    def _cursor_page(self, queryset, page_size, exclude_fields=None, only_fields=None):
+        """
+        游标分页取数据(请求带上 after 参数时使用)
+        :return: (items, meta)
+        """
+        try:
+            items, next_cursor = cursor_page(queryset, request.req.sort, page_size, request.req.after,
+                                             exclude_fields=exclude_fields, only_fields=only_fields)
+        except ValueError as e:
+            logger.warning('Invalid cursor %s: %s', request.req.after, e)
+            BaseError.param_error('游标参数错误')
+        meta = {'page_size': page_size, 'next_cursor': next_cursor}
+        total = self._page_total(queryset)
+        if total is not None:
+            meta['total'] = total
+        return items, meta
+
+    def _page_total(self, queryset):
+        """
+        分页接口的总数，按请求参数 count 及 model 的 count_strategy 获取
+            * 游标分页默认不返回总数，除非请求 count=1
+        :return: 总数，不需要时返回 None
+        """
+        if not self._need_total():
+            return None
+        return count_total(queryset)
+
+    def _need_total(self):
+        count = request.req.count
+        return not (count is False or (count is None and request.req.after is not None))
+
+    async def _page_total_async(self, queryset):
+        """
+        _page_total 的异步版本
+        """
+        if not self._need_total():
+            return None
+        return await count_total_async(queryset)
+
+    async def _cursor_page_async(self, queryset, page_size, exclude_fields=None, only_fields=None):
+        """
+        _cursor_page 的异步版本，一页数据及总数并发查询
+        :return: (items, meta)
+        """
+        try:
+            (items, next_cursor), total = await asyncio.gather(
+                cursor_page_async(queryset, request.req.sort, page_size, request.req.after,
+                                  exclude_fields=exclude_fields, only_fields=only_fields),
+                self._page_total_async(queryset))
+        except ValueError as e:
+            logger.warning('Invalid cursor %s: %s', request.req.after, e)
+            BaseError.param_error('游标参数错误')
+        meta = {'page_size': page_size, 'next_cursor': next_cursor}
+        if total is not None:
+            meta['total'] = total
+        return items, meta
+
+    async def _query_page_async(self, queryset, items_queryset, page, page_size):
+        """
+        总数及一页数据并发查询(query 方式分页的异步版本)
+        请求的页码超出最大页码时，再取一次最后一页(与同步版本的页码防呆一致)
+        :param queryset: 计算总数的 queryset
+        :param items_queryset: 取数据的 queryset(已带上排序、only/exclude)
+        :return: (items, total, page, max_page)
+        """
+        skip = (max(page, 1) - 1) * page_size
+        items_queryset = items_queryset.limit(page_size)
+        count, items = await asyncio.gather(self._page_total_async(queryset),
+                                            self._list_async(items_queryset.skip(skip).all_async()))
+        page, max_page, real_skip = get_page_range(page, page_size, count)
+        if real_skip != skip:
+            items = await self._list_async(items_queryset.skip(real_skip).all_async())
+        return items, count, page, max_page
+
+    def _use_facet(self, queryset):
+        """
+        是否用一次 $facet 聚合取出分页数据及总数(model 的 meta['page_engine'] 为 facet，且需要精确总数时)
+        count_strategy 为 estimated/cache 时仍用 query 方式，不在聚合里重新 $count
+        """
+        meta = queryset._document._meta
+        return (meta.get('page_engine') == 'facet' and (meta.get('count_strategy') or 'exact') == 'exact'
+                and request.req.count is not False)
+
+    def _use_raw_read(self, included_fields):
+        """
+        是否跳过 Document 构造，用 as_pymongo 查出的原始数据直接转换(model 的 meta['read_engine'] 为 raw，且没有 included 时)
+        """
+        return (not included_fields and self.model._meta.get('read_engine') == 'raw'
+                and raw_plan(self.model) is not None)
 
     def get_page_data(self, queryset, exclude_fields=[], only_fields=[], date_format=None, without_none=False):
         """
@@ -479,19 +823,28 @@ class ResourceView(object):
         page = request.req.page  # 第几页
         sort = request.req.sort  # 排序方式
 
-        count = queryset.count()  # 总数
-        # 页码防呆
-        max_page = int((count + page_size - 1) // page_size)  # 最大页码
-        page = max_page if page > max_page else page
-        page = 1 if page < 1 else page
-        skip = (page - 1) * page_size
+        if request.req.after is not None:
+            items, meta = self._cursor_page(queryset, page_size, exclude_fields, only_fields)
+            if exclude_fields or only_fields or date_format or without_none:
+                items = [mongo_to_dict(item, exclude_fields=exclude_fields, only_fields=only_fields,
+                                       date_format=date_format, without_none=without_none)
+                         for item in items]
+            return return_data(data={'items': items, 'meta': meta})
+
+        use_facet = self._use_facet(queryset)
+        if not use_facet:
+            count = self._page_total(queryset)  # 总数
+            page, max_page, skip = get_page_range(page, page_size, count)  # 页码防呆
         if exclude_fields:
             queryset = queryset.exclude(*exclude_fields)
         if only_fields:
             queryset = queryset.only(*only_fields)
         # 取数据
-        items = queryset.order_by(*sort).limit(page_size).skip(skip)
-        items = items if isinstance(items, list) else list(items)
+        if use_facet:
+            items, count, page, max_page = facet_page(queryset.order_by(*sort), page, page_size)
+        else:
+            items = queryset.order_by(*sort).limit(page_size).skip(skip)
+            items = items if isinstance(items, list) else list(items)
         if exclude_fields or only_fields or date_format or without_none:
             items = [mongo_to_dict(item, exclude_fields=exclude_fields, only_fields=only_fields,
                                    date_format=date_format, without_none=without_none)
@@ -504,14 +857,11 @@ class ResourceView(object):
             'total': count
         }})
 
-    def collection_read(self):
+    def _collection_query(self):
         """
-        collection endpoint GET
+        列表接口的查询(where、q 搜索、external_query_info 条件)
+        :return: (queryset, exclude_fields, included_fields)
         """
-        all_conditions = []
-        page_size = request.req.page_size  # 每页显示多少行
-        page = request.req.page  # 第几页
-        sort = request.req.sort
         only_fields = request.req.only
         included_fields = request.req.included or []  # 关联查询的字段
         q = request.req.q
@@ -556,18 +906,52 @@ class ResourceView(object):
             if or_list:
                 for or_q in or_list:
                     req_query = req_query | or_q
+        return queryset.filter(req_query), exclude_fields, included_fields
 
-        count = queryset.filter(req_query).count()  # 总数
-        # 页码防呆
-        max_page = int((count + page_size - 1) // page_size)  # 最大页码
-        page = max_page if page > max_page else page
-        page = 1 if page < 1 else page
-        skip = (page - 1) * page_size
-        # 取数据
-        items = queryset.filter(req_query).exclude(*exclude_fields).order_by(*sort).limit(page_size).skip(skip)
+    def collection_read(self):
+        """
+        collection endpoint GET
+        """
+        page_size = request.req.page_size  # 每页显示多少行
+        page = request.req.page  # 第几页
+        sort = request.req.sort
+        queryset, exclude_fields, included_fields = self._collection_query()
+
+        if request.req.after is not None:
+            items, meta = self._cursor_page(queryset, page_size, exclude_fields=exclude_fields)
+            if request.req.stream:
+                return self.render_stream(items, meta)
+            self._patch_included(items, included_fields)
+            return return_data(data={'items': items, 'meta': meta})
+
+        raw_read = self._use_raw_read(included_fields)
+        if request.req.stream:
+            # 流式返回: 边迭代游标边输出(不用 facet)
+            count = self._page_total(queryset)
+            page, max_page, skip = get_page_range(page, page_size, count)
+            items = queryset.exclude(*exclude_fields).order_by(*sort).limit(page_size).skip(skip)
+            if raw_read:
+                items = (raw_to_dict(self.model, item) for item in items.as_pymongo())
+            return self.render_stream(items, {'page': page, 'page_size': page_size, 'max_page': max_page,
+                                              'total': count})
+
+        if self._use_facet(queryset):
+            # 一次聚合取出数据及总数
+            items, count, page, max_page = facet_page(
+                queryset.exclude(*exclude_fields).order_by(*sort), page, page_size,
+                as_pymongo=raw_read)
+        else:
+            count = self._page_total(queryset)  # 总数
+            page, max_page, skip = get_page_range(page, page_size, count)  # 页码防呆
+            # 取数据
+            items = queryset.exclude(*exclude_fields).order_by(*sort).limit(page_size).skip(skip)
+            if raw_read:
+                items = items.as_pymongo()
 
         # items = list(items)
         items = items if isinstance(items, list) else list(items)
+        if raw_read:
+            items = [raw_to_dict(self.model, item) for item in items]
         self._patch_included(items, included_fields)
 
         # build items
@@ -578,6 +962,36 @@ class ResourceView(object):
             'total': count
         }})
 
+    async def collection_read_async(self):
+        """
+        collection endpoint GET(异步处理时使用): 总数及一页数据用 motor 并发查询
+        """
+        page_size = request.req.page_size  # 每页显示多少行
+        page = request.req.page  # 第几页
+        sort = request.req.sort
+        queryset, exclude_fields, included_fields = self._collection_query()
+
+        if request.req.after is not None:
+            items, meta = await self._cursor_page_async(queryset, page_size, exclude_fields=exclude_fields)
+        else:
+            raw_read = self._use_raw_read(included_fields)
+            items_queryset = queryset.exclude(*exclude_fields).order_by(*sort)
+            if self._use_facet(queryset):
+                # 一次聚合取出数据及总数
+                items, count, page, max_page = await facet_page_async(items_queryset, page, page_size,
+                                                                      as_pymongo=raw_read)
+            else:
+                if raw_read:
+                    items_queryset = items_queryset.as_pymongo()
+                items, count, page, max_page = await self._query_page_async(queryset, items_queryset, page, page_size)
+            if raw_read:
+                items = [raw_to_dict(self.model, item) for item in items]
+            meta = {'page': page, 'page_size': page_size, 'max_page': max_page, 'total': count}
+        if included_fields:
+            # 关联数据仍用 mongoengine 查询，放到线程里执行，不阻塞事件循环
+            await asyncio.to_thread(self._patch_included, items, included_fields)
+        return return_data(data={'items': items, 'meta': meta})
+
     def _before_collection_create(self):
         pass
 
@@ -590,21 +1004,9 @@ class ResourceView(object):
         create_data = dict_to_mongo(self.model, data)
         instance = self.model()
         if create_data:
+            references = self._resolve_references(create_data)
             for k, v in create_data.items():
-                o = v
-                field = self.model._fields.get(k)
-                if field:
-                    if isinstance(field, mongoengine.GenericLazyReferenceField):
-                        o = self.app.models[field.name.capitalize()].objects(id=v).first()
-                    elif isinstance(field, mongoengine.LazyReferenceField):
-                        field_cls_name = field.document_type._class_name
-                        if field_cls_name == self.model._class_name:
-                            o = self.model.objects(id=v).first()
-                        else:
-                            o = self.app.models[field_cls_name].objects(id=v).first()
-                        if not o:
-                            BaseError.data_not_exist(message="%s资源不存在" % field_cls_name)
-                    instance[k] = o
+                instance[k] = references.get(k, v)
 
         user = request.user if hasattr(request, 'user') else None
         if user and self.model._fields.get('user') and not create_data.get('user'):
@@ -612,6 +1014,41 @@ class ResourceView(object):
         instance.save()
         return return_data(data={'item': instance})
 
+    def _resolve_references(self, data):
+        """
+        检查 LazyReference / GenericLazyReference 字段引用的数据是否存在
+            每个目标 model 只用一次 $in 查询，并且只取 _id
+            * LazyReferenceField: 不存在时报错
+            * GenericLazyReferenceField: 不存在时为 None
+        :param data: dict_to_mongo 后的数据
+        :return: {字段名: 赋给字段的值}
+        """
+        targets = defaultdict(list)  # model -> [(字段名, id)]
+        result = {}
+        for k, v in data.items():
+            field = self.model._fields.get(k)
+            if isinstance(field, mongoengine.GenericLazyReferenceField):
+                model = self.app.models[field.name.capitalize()]
+            elif isinstance(field, mongoengine.LazyReferenceField):
+                model = field.document_type
+            else:
+                continue
+            pk_field = model._fields[model._meta['id_field']]
+            _id = pk_field.to_python(v.get('id') if isinstance(v, dict) else v) if v is not None else None
+            targets[model].append((k, _id))
+
+        for model, pairs in targets.items():
+            ids = list({_id for _, _id in pairs if _id is not None})
+            exists = set(model.objects(pk__in=ids).scalar('pk')) if ids else set()
+            for k, _id in pairs:
+                if _id in exists:
+                    result[k] = LazyReference(model, _id)
+                elif isinstance(self.model._fields[k], mongoengine.GenericLazyReferenceField):
+                    result[k] = None
+                else:
+                    BaseError.data_not_exist(message="%s资源不存在" % model._class_name)
+        return result
+
     def batch_update(self, instances):
         """
         batch endpoint PUT
@@ -619,6 +1056,10 @@ class ResourceView(object):
         form = payload()
         data = form.get('data', {})
         update = dict_to_mongo(self.model, data)
+        if self._use_bulk_batch():
+            return return_data(data=self._bulk_update(instances, update))
+        if self._use_atomic_update():
+            return return_data(data={'items': self._atomic_batch_update(instances, update)})
         if update:
             for instance in instances:
                 for k, v in update.items():
@@ -630,22 +1071,148 @@ class ResourceView(object):
         """
         batch endpoint PUT
         """
+        if self._use_bulk_batch():
+            return return_data(data=self._bulk_delete(instances))
         for instance in instances:
             instance.delete()
         return return_data(data={'deleted': True})
 
+    def _use_bulk_batch(self):
+        """
+        batch 接口是否用一次 update_many / delete_many 完成(model 的 meta['batch_engine'] 为 bulk)
+        """
+        return self.model._meta.get('batch_engine') == 'bulk'
+
+    def _bulk_update(self, queryset, update):
+        """
+        一次 update_many 批量更新，不逐条取出数据再 save(与 save 一致，None 值 unset)
+            meta['batch_hooks'] 为 True 时，先一次取出数据逐条调用 before_save，更新后再逐条调用 after_update；
+            before_save 里修改的其他字段按条再更新一次
+        :param queryset: 按 ids 过滤的 queryset
+        :param update: dict_to_mongo 后的更新内容
+        :return: {'matched': 匹配的数量, 'modified': 实际修改的数量}
+        """
+        if not update:
+            return {'matched': 0, 'modified': 0}
+        self._validate_update(update)
+
+        instances = list(queryset) if self.model._meta.get('batch_hooks') else []
+        changes = []
+        for instance in instances:
+            for k, v in update.items():
+                instance[k] = v
+            instance.before_save()
+            changed = {f for f in instance.real_changed_fields() if f not in update and f != 'updated_at'}
+            if changed:
+                changes.append((instance, {f: instance[f] for f in changed}))
+        result = queryset.update(full_result=True, **self._atomic_update_args(update))
+        for instance, change in changes:
+            self.model.objects(pk=instance.pk).update(**self._atomic_update_args(change))
+        for instance in instances:
+            instance.after_update({})
+        return {'matched': result.matched_count, 'modified': result.modified_count}
+
+    def _validate_update(self, update):
+        """
+        不经过 Document 直接写入时，逐个字段校验更新内容
+        """
+        for name, value in update.items():
+            if value is not None:
+                try:
+                    self.model._fields[name].validate(value)
+                except mongoengine.ValidationError as e:
+                    BaseError.param_error('%s: %s' % (name, e))
+
+    def _get_item_instance(self, handler, action, item_condition):
+        """
+        item 接口处理函数的 instance: 原子更新时不先取出数据，用 LazyItem 代替(需要权限判断时仍先取出)
+        """
+        if handler == 'item_update' and self._use_atomic_update() and action not in self.acl:
+            pk = item_condition.get('id')
+            return LazyItem(self.model.objects(**item_condition), self.model.id.to_python(pk) if pk else None)
+        instance = self.model.find_one(item_condition)
+        if not instance:
+            BaseError.data_not_exist()
+        return instance
+
+    def _use_atomic_update(self):
+        """
+        item_update / batch_update 是否不先取出数据，直接原子更新(model 的 meta['update_engine'] 为 atomic)
+        """
+        return self.model._meta.get('update_engine') == 'atomic'
+
+    def _atomic_update_args(self, update):
+        """
+        更新内容转成 queryset.update / modify 的参数: 与 save 一致，None 值 unset，其它 set，并更新 updated_at
+        """
+        self._validate_update(update)
+        if 'updated_at' in self.model._fields:
+            update = dict(update, updated_at=datetime.utcnow())
+        return {('unset__' if v is None else 'set__') + k: (1 if v is None else v) for k, v in update.items()}
+
+    def _atomic_update(self, instance, update):
+        """
+        一次 find_one_and_update 更新一条数据，返回更新后的数据(不调用 before_save，更新后调用 after_update)
+        :param instance: LazyItem(需要权限判断时为已取出的数据)
+        :param update: dict_to_mongo 后的更新内容
+        """
+        queryset = instance.queryset if isinstance(instance, LazyItem) else self.model.objects(pk=instance.pk)
+        if not update:
+            return instance._fetch() if isinstance(instance, LazyItem) else instance
+        item = queryset.modify(new=True, **self._atomic_update_args(update))
+        if not item:
+            BaseError.data_not_exist()
+        if isinstance(instance, LazyItem):
+            instance._set_document(item)  # 之后读取 instance 的属性时为更新后的数据
+        item._fields_changed = list(update)  # after_update 里 real_changed_fields 可以取到修改的字段
+        item.after_update({})
+        return item
+
+    def _atomic_batch_update(self, queryset, update):
+        """
+        一次 update_many 批量更新，再一次取出更新后的数据返回(不调用 before_save，更新后逐条调用 after_update)
+        :param queryset: 按 ids 过滤的 queryset
+        :param update: dict_to_mongo 后的更新内容
+        """
+        if update:
+            queryset.update(**self._atomic_update_args(update))
+        items = list(queryset)
+        if update:
+            for item in items:
+                item._fields_changed = list(update)
+                item.after_update({})
+        return items
+
+    def _bulk_delete(self, queryset):
+        """
+        一次 delete_many 批量删除，meta['batch_hooks'] 为 True 时，删除后逐条调用 after_delete
+        :param queryset: 按 ids 过滤的 queryset
+        :return: {'deleted': True, 'deleted_count': 删除的数量}
+        """
+        instances = list(queryset) if self.model._meta.get('batch_hooks') else []
+        deleted_count = queryset.delete()
+        for instance in instances:
+            instance.after_delete()
+        return {'deleted': True, 'deleted_count': deleted_count}
+
     def item_read(self, instance):
         """
         item endpoint GET
         """
         return return_data(data={'item': instance})
 
+    async def item_read_async(self, instance):
+        """
+        item endpoint GET(异步处理时使用，数据已经由 motor 查询出来)
+        """
+        return return_data(data={'item': instance})
+
     def item_embedded_list_create(self, instance):
         """
         item embedded endpoint POST
         """
         data = payload()
-        embedded = request.endpoint.split('|')[-1]
+        embedded = self.get_endpoint().field
         embedded_field = instance._fields.get(embedded).field
         embedded_instance = embedded_field.document_type(**data)
         instance[embedded].append(embedded_instance)
@@ -657,7 +1224,7 @@ class ResourceView(object):
         item embedded count GET
         """
         index = int(index)
-        embedded = request.endpoint.split('|')[-1]
+        embedded = self.get_endpoint().field
         embedded_field = instance._fields.get(embedded).field
         if len(instance[embedded]) < index:
             BaseError.data_not_exist('Out of Range')
@@ -672,7 +1239,7 @@ class ResourceView(object):
         """
         data = payload()
         index = int(index)
-        embedded = request.endpoint.split('|')[-1]
+        embedded = self.get_endpoint().field
         embedded_field = instance._fields.get(embedded).field
         if len(instance[embedded]) < index:
             BaseError.data_not_exist('Out of Range')
@@ -686,7 +1253,7 @@ class ResourceView(object):
         item reference endpoint POST
         """
         data = payload()
-        reference = request.endpoint.split('|')[-1]
+        reference = self.get_endpoint().field
         reference_field = instance._fields.get(reference)
         current_reference = instance[reference]
         if current_reference:
@@ -703,7 +1270,7 @@ class ResourceView(object):
         """
         item reference DELETE
         """
-        reference = request.endpoint.split('|')[-1]
+        reference = self.get_endpoint().field
         reference_field = instance._fields.get(reference)
         if reference_field:
             reference_ref = instance[reference]
@@ -719,7 +1286,7 @@ class ResourceView(object):
         """
         item reference GET
         """
-        reference = request.endpoint.split('|')[-1]
+        reference = self.get_endpoint().field
         reference_field = instance._fields.get(reference)
         if reference_field:
             obj = getattr(instance, reference)
@@ -732,31 +1299,32 @@ class ResourceView(object):
     def item_reference_file(self, instance, field, sub_field):
         """
         item reference GET
+            - GridFS 的文件按块流式输出，支持 Range(206) 及 If-None-Match / If-Modified-Since(304)
         """
         file_proxy = getattr(instance, field)
         # file_proxy = getattr(reference_obj, sub_field)
         method = request.args.get('method') or 'inline'
-        response = file_proxy.read()
-        if not response:
-            BaseError.data_not_exist()
-
         content_disposition = method
         if file_proxy.name:
             content_disposition = '%s; filename*=UTF-8\'\'%s' % (
                 method, quote(file_proxy.name))
 
+        if isinstance(file_proxy, GridFSProxy):
+            grid_out = file_proxy.get()
+            if grid_out is None or not grid_out.length:
+                BaseError.data_not_exist()
+            return self.render_file(grid_out, content_disposition, content_type=file_proxy.content_type)
+
+        response = file_proxy.read()
+        if not response:
+            BaseError.data_not_exist()
         headers = {
             'Content-Type': file_proxy.content_type,
-            'Content-Disposition': content_disposition
+            'Content-Disposition': content_disposition,
+            'ETag': response['meta']['ETag'],
+            'Last-Modified': response['meta']['Last-Modified']
         }
-        if isinstance(response, bytes):
-            data = response
-            headers['Last-Modified'] = file_proxy.grid_id.generation_time
-        else:
-            headers['ETag'] = response['meta']['ETag']
-            headers['Last-Modified'] = response['meta']['Last-Modified']
-            data = response['data']
-        response = Response(data, headers=headers, mimetype=file_proxy.content_type, direct_passthrough=True)
+        response = Response(response['data'], headers=headers, mimetype=file_proxy.content_type, direct_passthrough=True)
         return response
 
     def item_relation_create(self, instance):
@@ -764,7 +1332,7 @@ class ResourceView(object):
         item relations endpoint POST
         """
         data = payload()
-        relation = request.endpoint.split('|')[-1]
+        relation = self.get_endpoint().field
         relation_ref = getattr(instance, relation)
         relation_instance = relation_ref.document_type(**data)
         if hasattr(request, 'user') and self.model._fields.get('user'):
@@ -778,7 +1346,7 @@ class ResourceView(object):
         item relations count GET
         """
         by = request.req.by
-        relation = request.endpoint.split('|')[-1]
+        relation = self.get_endpoint().field
         relation_ref = getattr(instance, relation)
         if relation_ref:
             queryset = relation_ref.objects(**request.req.where)
@@ -798,18 +1366,17 @@ class ResourceView(object):
         page = int(request.req.page or 1)  # 第几页
         sort = request.req.sort
 
-        relation = request.endpoint.split('|')[-1]
+        relation = self.get_endpoint().field
 
         relation_ref = getattr(instance, relation)
         if relation_ref:
             # relation limit...
             queryset = relation_ref.objects(**request.req.where)
-            count = queryset.count()  # 总数
-            # 页码防呆
-            max_page = int((count + limit - 1) // limit)  # 最大页码
-            page = max_page if page > max_page else page
-            page = 1 if page < 1 else page
-            skip = (page - 1) * limit
+            if request.req.after is not None:
+                items, meta = self._cursor_page(queryset, limit)
+                return return_data(data={'items': items, 'meta': meta})
+            count = self._page_total(queryset)  # 总数
+            page, _, skip = get_page_range(page, limit, count)  # 页码防呆
             # 取数据
             items = queryset.order_by(*sort).limit(limit).skip(skip)
             return return_data(data={'items': list(items), 'meta': {
@@ -819,12 +1386,36 @@ class ResourceView(object):
             }})
         return return_data(code=400, message='Not a valid relation')
 
+    async def item_relation_read_async(self, instance):
+        """
+        item relations GET(异步处理时使用): 总数及一页数据用 motor 并发查询
+        """
+        limit = int(request.req.page_size or 25)  # 每页显示多少行
+        page = int(request.req.page or 1)  # 第几页
+        sort = request.req.sort
+
+        relation = self.get_endpoint().field
+
+        relation_ref = getattr(instance, relation)
+        if relation_ref:
+            queryset = relation_ref.objects(**request.req.where)
+            if request.req.after is not None:
+                items, meta = await self._cursor_page_async(queryset, limit)
+                return return_data(data={'items': items, 'meta': meta})
+            items, count, page, _ = await self._query_page_async(queryset, queryset.order_by(*sort), page, limit)
+            return return_data(data={'items': items, 'meta': {
+                'page': page,
+                'page_size': limit,
+                'total': count
+            }})
+        return return_data(code=400, message='Not a valid relation')
+
     def item_file_preview(self, instance):
         """
         item file preview GET
         """
         cos_id = instance.attachment.cos_id
-        _file = request.endpoint.split('|')[-1]
+        _file = self.get_endpoint().field
         file_proxy = getattr(instance, _file)
         return file_proxy.getPreview()
 
@@ -833,7 +1424,7 @@ class ResourceView(object):
         item file GET
         """
         cos_id = instance.attachment.cos_id
-        _file = request.endpoint.split('|')[-1]
+        _file = self.get_endpoint().field
         file_proxy = getattr(instance, _file)
         method = request.args.get('method') or 'inline'
         response = file_proxy.read(cos_id)
@@ -865,6 +1456,8 @@ class ResourceView(object):
         self._before_item_update()
         data = payload()
         update = dict_to_mongo(self.model, data)
+        if self._use_atomic_update():
+            return return_data(data={'item': self._atomic_update(instance, update)})
         if update:
             for k, v in update.items():
                 instance[k] = v
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Endpoint 描述信息，注册路由时预先解析好，请求时直接按 endpoint 查找
+"""
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+# endpoint 格式: '{source}|{action}|{resource}|{field}'，如 '|item_reference_read|user|default_project'
+EndpointDescriptor = namedtuple('EndpointDescriptor', [
+    'endpoint',  # 原始 endpoint 字符串
+    'source',  # 数据来源，rest 代理时为 'proxy'
+    'action',  # 动作，如 collection_read、item@remove
+    'resource',  # 资源名(view 名称)
+    'field',  # reference / relation / embedded 对应的字段名
+    'handler_name',  # 处理函数名
+    'handler',  # 处理函数(已绑定到 view)
+    'async_handler',  # 对应的 async 处理函数({handler_name}_async)，没有时为 None
+    'is_collection',
+    'is_item',
+    'is_batch',
+    'is_proxy',
+    'is_remote_item',
+    'is_customize',
+    'id_field',  # item 类型按哪个字段查找数据
+])
+
+
+def get_async_handler(view, handler_name):
+    """
+    获取处理函数对应的 async 版本({handler_name}_async)
+    子类只重写了同步的处理函数时返回 None，避免跳过子类的逻辑
+    """
+    async_name = handler_name + '_async'
+    for klass in type(view).__mro__:
+        if async_name in vars(klass):
+            return getattr(view, async_name)
+        if handler_name in vars(klass):
+            return None
+    return None
+
+
+def build_endpoint_descriptor(view, endpoint):
+    """
+    解析 endpoint 字符串，生成对应 view 的描述信息
+    :param view: ResourceView 实例
+    :param endpoint: endpoint 字符串
+    :return: EndpointDescriptor，不是资源类的 endpoint 返回 None
+    """
+    if not endpoint or '|' not in endpoint:
+        return None
+    source, action, resource, field = endpoint.split('|')
+    is_collection = action.startswith('collection')
+    is_item = action.startswith('item')
+    is_remote_item = action.startswith('remote_item')
+    is_customize = '@' in action
+
+    handler_name = None
+    if is_customize:
+        real_action = action.split('@')[-1]
+        routes = view.routes or {}
+        if is_item:
+            handler_name = routes['item'][real_action]['function_name']
+        elif is_collection:
+            handler_name = routes['collection'][real_action]['function_name']
+        elif is_remote_item:
+            handler_name = routes['remote_item'][real_action]['function_name']
+        else:
+            logger.error('Unknow handler %s', action)
+    else:
+        handler_name = action
+
+    id_field = 'id'
+    if view.model is not None and hasattr(view.model, '_meta'):
+        id_field = view.model._meta.get('item_id_field') or 'id'
+
+    return EndpointDescriptor(
+        endpoint=endpoint,
+        source=source,
+        action=action,
+        resource=resource,
+        field=field,
+        handler_name=handler_name,
+        handler=getattr(view, handler_name, None) if handler_name else None,
+        async_handler=get_async_handler(view, handler_name) if handler_name else None,
+        is_collection=is_collection,
+        is_item=is_item,
+        is_batch=action.startswith('batch'),
+        is_proxy=action.startswith('proxy'),
+        is_remote_item=is_remote_item,
+        is_customize=is_customize,
+        id_field=id_field,
+    )
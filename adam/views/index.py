@@ -6,6 +6,7 @@ import logging
 from flask import jsonify, request, current_app
 from .blueprint import return_data
 from ..utils.config_util import config
+from ..documents.document_cache import cache_stats
 from ..utils.json_util import json_serializable
 from ..utils.celery_util import get_pending_msg, get_beat, get_workers, get_beat_schedule, delete_repeat_task, clear_tasks
 
@@ -28,6 +29,7 @@ def status():
         message['update_time'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getmtime(__file__)))
         message['publish_time'] = PUBLISH_TIME  # 发布时间
         message['now'] = time.strftime('%Y-%m-%d %H:%M:%S')  # 系统时间,用来核对系统时间是否正确
+        message['cache'] = cache_stats()  # 各模型单条数据缓存的命中情况
         # message['argv'] = sys.argv  # 系统启动参数
         # 任务队列情况
         message['beat'] = get_beat()
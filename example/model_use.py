@@ -42,7 +42,8 @@ async def main_test():
         User(user_name='User C', user_type=UserEnum.MANAGER)
     ]
     User.objects.insert(new_users)
-    await User.objects.insert_async(new_users)  # 异步操作
+    new_users = [User(user_name='User D', user_type=UserEnum.MANAGER)]
+    new_users = await User.objects.insert_async(new_users)  # 异步操作，返回写入了 id 的 Document
     logging.info(f'新增后有 {User.objects.count()} 个用户')
 
 
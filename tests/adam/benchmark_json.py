@@ -0,0 +1,61 @@
+#!python
+# -*- coding:utf-8 -*-
+"""
+JSON 编码性能测试: 对比各个已安装的 JSON 实现，编码一页 150 条数据的接口响应
+
+    python tests/adam/benchmark_json.py
+"""
+import os
+import sys
+import time
+import uuid
+import decimal
+import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from bson import ObjectId
+
+from adam.utils import json_util
+
+PAGE_SIZE = 150  # 每页数量
+REPEAT = 200  # 重复次数
+
+
+def build_response():
+    """已经 serialize 过的接口响应(render_obj 编码的内容)"""
+    now = datetime.datetime.utcnow().isoformat()
+    items = [{
+        'id': str(ObjectId()), 'name': 'item%s' % i, 'title': '标题%s' % i, 'count': i, 'price': i * 1.5,
+        'enabled': i % 2 == 0, 'tags': ['a', 'b'], 'others': {'k': i, 'v': None},
+        'owner': {'id': str(ObjectId())}, 'created_at': now, 'updated_at': now,
+    } for i in range(PAGE_SIZE)]
+    return {'code': 0, 'message': 'success', 'data': {'items': items, 'meta': {'page': 1, 'page_size': PAGE_SIZE}}}
+
+
+def build_raw_items():
+    """未转换的数据(SSE、日志等直接编码的内容)，需要 default 转换"""
+    now = datetime.datetime.utcnow()
+    return [{'id': ObjectId(), 'uuid': uuid.uuid4(), 'amount': decimal.Decimal('1.5'), 'created_at': now,
+             'name': 'item%s' % i} for i in range(PAGE_SIZE)]
+
+
+def bench(name, value):
+    json_util.dumps(value, as_bytes=True)  # 预热
+    start_time = time.perf_counter()
+    for _ in range(REPEAT):
+        json_util.dumps(value, as_bytes=True)
+    run_time = time.perf_counter() - start_time
+    print('%-8s %-10s %8.2f ms/page %8.0f pages/s' % (
+        json_util.get_json_backend(), name, run_time * 1000 / REPEAT, REPEAT / run_time))
+
+
+if __name__ == '__main__':
+    response = build_response()
+    raw_items = build_raw_items()
+    for backend in json_util.JSON_BACKENDS:
+        if backend != 'json' and getattr(json_util, backend) is None:
+            continue  # 没有安装
+        json_util.set_json_backend(backend)
+        bench('response', response)
+        bench('raw', raw_items)
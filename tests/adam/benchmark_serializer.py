@@ -0,0 +1,81 @@
+#!python
+# -*- coding:utf-8 -*-
+"""
+序列化性能测试(不需要连接数据库): 一页 150 条数据的 serialize() 及 mongo_to_dict() 耗时
+
+    python tests/adam/benchmark_serializer.py
+"""
+import os
+import sys
+import time
+import datetime
+from enum import Enum
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from bson import ObjectId
+from mongoengine import EmbeddedDocument
+from mongoengine.fields import StringField, IntField, BooleanField, DateTimeField, ListField, DictField, \
+    EmbeddedDocumentField, LazyReferenceField, ObjectIdField
+
+from adam.fields import EnumField
+from adam.documents import ResourceDocument
+from adam.utils.serializer import serialize, mongo_to_dict
+
+PAGE_SIZE = 150  # 每页数量
+REPEAT = 200  # 重复次数
+
+
+class BenchState(Enum):
+    NEW = 'new'
+    DONE = 'done'
+
+
+class BenchAddress(EmbeddedDocument):
+    city = StringField()
+    street = StringField()
+
+
+class BenchItem(ResourceDocument):
+    meta = {'hidden': ['secret'], 'protected': ['note']}
+
+    name = StringField()
+    title = StringField()
+    secret = StringField()
+    note = StringField()
+    count = IntField()
+    enabled = BooleanField()
+    state = EnumField(enum=BenchState)
+    tags = ListField(StringField())
+    others = DictField()
+    address = EmbeddedDocumentField(BenchAddress)
+    owner = LazyReferenceField(document_type='BenchItem')
+    source_id = ObjectIdField()
+    finished_at = DateTimeField()
+
+
+def build_items():
+    now = datetime.datetime.utcnow()
+    return [BenchItem(
+        id=ObjectId(), name='item%s' % i, title='标题%s' % i, secret='x', note='y', count=i, enabled=i % 2 == 0,
+        state=BenchState.DONE, tags=['a', 'b'], others={'k': i}, address=BenchAddress(city='sz', street='st'),
+        owner=ObjectId(), source_id=ObjectId(), finished_at=now, created_at=now, updated_at=now,
+    ) for i in range(PAGE_SIZE)]
+
+
+def bench(name, func, items):
+    func(items)  # 预热
+    start_time = time.perf_counter()
+    for _ in range(REPEAT):
+        func(items)
+    run_time = time.perf_counter() - start_time
+    print('%-20s %8.2f ms/page %8.2f us/doc' % (
+        name, run_time * 1000 / REPEAT, run_time * 1000000 / REPEAT / len(items)))
+
+
+if __name__ == '__main__':
+    page = build_items()
+    bench('serialize', lambda items: serialize('_root', {'items': items}, None, included=[]), page)
+    bench('mongo_to_dict', lambda items: [mongo_to_dict(item) for item in items], page)
+    bench('mongo_to_dict(only)', lambda items: [mongo_to_dict(item, only_fields=['name', 'count'])
+                                                for item in items], page)
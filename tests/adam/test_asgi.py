@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+"""
+asgi unittest
+"""
+
+import json
+import asyncio
+import unittest
+
+from flask import Flask, request, Response
+
+from adam.asgi import AsgiApp, build_environ
+
+
+def call(asgi, method, path, query_string=b'', body=b'', headers=()):
+    """模拟 ASGI 服务器发起一个请求，返回 (status, headers, body, 消息数)"""
+    messages = [{'type': 'http.request', 'body': body[:2], 'more_body': True},
+                {'type': 'http.request', 'body': body[2:], 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'root_path': '',
+             'headers': list(headers), 'server': ('127.0.0.1', 8000), 'client': ('1.2.3.4', 5678)}
+    asyncio.run(asgi(scope, receive, send))
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    return sent[0]['status'], dict(sent[0]['headers']), body, len(sent)
+
+
+class TestAsgi(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+
+        @app.route('/echo', methods=['POST'])
+        def echo():
+            return {'args': request.args.get('a'), 'json': request.json, 'remote': request.remote_addr}
+
+        @app.route('/stream')
+        def stream():
+            return Response((str(i) for i in range(3)), mimetype='text/plain')
+
+        self.asgi = AsgiApp(app, max_workers=2)
+
+    def test_build_environ(self):
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/中文', 'root_path': '/api', 'query_string': b'a=1',
+                 'headers': [(b'content-type', b'text/plain'), (b'x-a', b'1'), (b'x-a', b'2')]}
+        environ = build_environ(scope, None)
+        self.assertEqual(environ['SCRIPT_NAME'], '/api')
+        self.assertEqual(environ['PATH_INFO'], '/中文'.encode('utf-8').decode('latin-1'))
+        self.assertEqual(environ['QUERY_STRING'], 'a=1')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_X_A'], '1,2')
+
+    def test_request(self):
+        body = json.dumps({'x': 1}).encode()
+        status, headers, data, _ = call(self.asgi, 'POST', '/echo', b'a=b', body,
+                                        [(b'content-type', b'application/json')])
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        self.assertEqual(json.loads(data), {'args': 'b', 'json': {'x': 1}, 'remote': '1.2.3.4'})
+
+        status, _, _, _ = call(self.asgi, 'GET', '/none')
+        self.assertEqual(status, 404)
+
+    def test_stream(self):
+        # 每块单独发送，最后一条消息结束响应
+        status, _, data, count = call(self.asgi, 'GET', '/stream')
+        self.assertEqual((status, data, count), (200, b'012', 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# -*- coding:utf-8 -*-
+"""
+async document unittest
+
+需要 mongomock-motor(pip install mongomock-motor)，或者用环境变量 MONGO_TEST_URI 指定本地的 mongod，
+如 MONGO_TEST_URI=mongodb://127.0.0.1:27017/adam_test，都没有时跳过
+"""
+
+import os
+import asyncio
+import unittest
+
+import mongoengine
+from bson import ObjectId
+from pymongo import InsertOne, DeleteOne
+from mongoengine.fields import StringField, IntField
+
+from adam.documents import ResourceDocument
+from adam.documents import async_document
+from adam.utils.async_util import run_async
+
+ALIAS = 'adam_async_test'
+MONGO_TEST_URI = os.environ.get('MONGO_TEST_URI')
+
+try:
+    from mongomock_motor import AsyncMongoMockClient
+except ImportError:
+    AsyncMongoMockClient = None
+
+
+class AsyncItem(ResourceDocument):
+    meta = {'db_alias': ALIAS}
+
+    name = StringField()
+    count = IntField(default=0)
+    note = StringField(db_field='n')
+
+
+@unittest.skipUnless(MONGO_TEST_URI or AsyncMongoMockClient, 'mongomock-motor or MONGO_TEST_URI required')
+class TestAsyncDocument(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Model.objects 需要同步的连接
+        if MONGO_TEST_URI:
+            mongoengine.register_connection(ALIAS, host=MONGO_TEST_URI)
+            async_document.register_connection(ALIAS, MONGO_TEST_URI)
+        else:
+            import mongomock
+            mongoengine.register_connection(ALIAS, host='mongodb://localhost/adam_test',
+                                            mongo_client_class=mongomock.MongoClient)
+            async_document.clients[ALIAS] = client = AsyncMongoMockClient()
+            async_document.dbs[ALIAS] = client['adam_test']
+
+    def setUp(self):
+        run_async(AsyncItem.get_motor_collection().delete_many({}))
+
+    def test_save(self):
+        async def main():
+            item = AsyncItem(name='a')
+            self.assertIs(await item.save_async(), item)  # 不再重新查询
+            self.assertIsNotNone(item.id)
+            item.count = 2
+            await item.save_async()
+            saved = await AsyncItem.objects.first_async(id=item.id)
+            return saved.name, saved.count, await AsyncItem.objects.count_async()
+
+        self.assertEqual(run_async(main()), ('a', 2, 1))
+
+    def test_save_with_id(self):
+        async def main():
+            # 指定了 id 的新数据一次 upsert，并发保存同一个 id 时不会插入冲突
+            _id = ObjectId()
+            await asyncio.gather(*[AsyncItem(id=_id, name='n%d' % i).save_async() for i in range(3)])
+            await AsyncItem(id=_id, name='b', count=5).save_async()  # 已存在时覆盖
+            saved = await AsyncItem.objects.first_async(id=_id)
+            return saved.name, saved.count, await AsyncItem.objects.count_async()
+
+        self.assertEqual(run_async(main()), ('b', 5, 1))
+
+    def test_insert_and_query(self):
+        async def main():
+            items = await AsyncItem.objects.insert_async([AsyncItem(name='n%d' % i, count=i, note='x') for i in range(5)])
+            self.assertTrue(all(item.id for item in items))
+            # only / exclude 的 projection，排序、skip、limit
+            queryset = AsyncItem.objects(count__gte=1).only('name').order_by('-count').skip(1).limit(2)
+            only = [(item.name, item.note) async for item in queryset.all_async()]
+            excluded = [item.note async for item in AsyncItem.objects.exclude('note').all_async()]
+            names = [name async for name in AsyncItem.objects.order_by('count').scalar('name').all_async()]
+            count = await AsyncItem.objects.limit(2).count_async(with_limit_and_skip=True)
+            return only, excluded, names, count
+
+        only, excluded, names, count = run_async(main())
+        self.assertEqual(only, [('n3', None), ('n2', None)])
+        self.assertEqual(excluded, [None] * 5)
+        self.assertEqual(names, ['n0', 'n1', 'n2', 'n3', 'n4'])
+        self.assertEqual(count, 2)
+
+    def test_update(self):
+        async def main():
+            await AsyncItem.insert_many_async([{'name': 'a'}, {'name': 'b'}])
+            await AsyncItem.objects(name='a').update_one_async(inc__count=2, note='x')  # 字段名转成 db_field
+            await AsyncItem.objects.update_async(inc__count=1)
+            result = await AsyncItem.bulk_write_async([InsertOne(AsyncItem(name='c')), DeleteOne({'name': 'b'})])
+            a = await AsyncItem.objects.first_async(name='a')
+            return a.count, a.note, result.inserted_count, result.deleted_count, await AsyncItem.objects.count_async()
+
+        self.assertEqual(run_async(main()), (3, 'x', 1, 1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
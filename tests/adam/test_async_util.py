@@ -0,0 +1,71 @@
+# -*- coding:utf-8 -*-
+"""
+async Utility unittest
+"""
+
+import time
+import asyncio
+import unittest
+import threading
+import contextvars
+
+from adam.utils import async_util
+
+_var = contextvars.ContextVar('var', default=None)
+
+
+class TestAsyncUtil(unittest.TestCase):
+
+    def test_run_async(self):
+        async def double(x):
+            await asyncio.sleep(0.01)
+            return x * 2, _var.get()
+
+        _var.set('caller')
+        self.assertEqual(async_util.run_async(double(2)), (4, 'caller'))
+
+        async def fail():
+            raise KeyError('x')
+
+        with self.assertRaises(KeyError):
+            async_util.run_async(fail())
+
+    def test_concurrent(self):
+        # 各线程提交的协程在同一个事件循环里并发执行
+        results = []
+
+        def call():
+            results.append(async_util.run_async(asyncio.sleep(0.2, result=True)))
+
+        start = time.time()
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        self.assertEqual(len(results), 5)
+        self.assertLess(time.time() - start, 0.8)
+
+    def test_timeout(self):
+        with self.assertRaises(Exception):
+            async_util.run_async(asyncio.sleep(1), timeout=0.05)
+
+    def test_bind_loop(self):
+        # 绑定外部的事件循环后，其它线程提交的协程在该循环里执行，循环里不能调用 run_async
+        async def main():
+            async_util.bind_loop(asyncio.get_running_loop())
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, async_util.run_async, asyncio.sleep(0.01, result='ok'))
+                self.assertEqual(result, 'ok')
+                self.assertIs(async_util.get_loop(), asyncio.get_running_loop())
+                with self.assertRaises(RuntimeError):
+                    async_util.run_async(asyncio.sleep(0))
+            finally:
+                async_util.bind_loop(None)
+
+        asyncio.run(main())
+        # 解除绑定后重新启动后台线程
+        self.assertEqual(async_util.run_async(asyncio.sleep(0, result=1)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+"""
+cache model unittest
+
+需要 mongomock(pip install mongomock)，没有时跳过
+"""
+
+import time
+import unittest
+from datetime import datetime
+
+import mongoengine
+
+from adam.models import CacheDocument
+from adam.fields import StringField, IntField
+
+ALIAS = 'adam_cache_model_test'
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class Config(CacheDocument):
+    meta = {'db_alias': ALIAS, 'cache_keys': ['key'], 'cache_refresh': 1}
+
+    key = StringField()
+    value = IntField()
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestCacheModel(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.register_connection(ALIAS, host='mongodb://localhost/adam_test',
+                                        mongo_client_class=mongomock.MongoClient)
+
+    def setUp(self):
+        Config.objects.delete()  # queryset 的 delete 让整表缓存过期
+        Config(key='a', value=1).save()
+        Config(key='b', value=2).save()
+
+    def test_index(self):
+        self.assertEqual(sorted(obj.key for obj in Config.get_objects()), ['a', 'b'])
+        a = Config.get_object(key='a')
+        self.assertEqual(a.value, 1)
+        self.assertIs(Config.get_object(id=str(a.id)), a)
+        self.assertIsNone(Config.get_object(key='x'))
+        with self.assertRaises(KeyError):
+            Config.get_object(value=1)
+
+    def test_save(self):
+        Config.get_objects()
+        Config(key='c', value=3).save()
+        a = Config.objects(key='a').first()
+        a.value = 10
+        a.save()
+        self.assertEqual((Config.get_object(key='a').value, Config.get_object(key='c').value), (10, 3))
+
+    def test_delta_refresh(self):
+        Config.get_objects()
+        loaded_at = Config._get_table().loaded_at
+        # 其它进程写入的数据(不经过本进程的 save)
+        Config._get_collection().insert_one({'key': 'd', 'value': 4, 'updated_at': datetime.utcnow()})
+        Config._get_table().mark('refresh')  # 收到通知
+        self.assertEqual(Config.get_object(key='d').value, 4)
+        self.assertEqual(Config._get_table().loaded_at, loaded_at)  # 只是增量刷新
+
+        # 没有通知时按间隔在后台刷新
+        Config._get_collection().insert_one({'key': 'e', 'value': 5, 'updated_at': datetime.utcnow()})
+        Config._get_table().checked_at -= 2
+        Config.get_objects()
+        for _ in range(100):
+            if Config.get_object(key='e'):
+                break
+            time.sleep(0.01)
+        self.assertEqual(Config.get_object(key='e').value, 5)
+
+    def test_queryset_write(self):
+        Config.get_objects()
+        Config.objects(key='a').update(set__value=5)  # 不改 updated_at，整表重新加载
+        self.assertEqual(Config.get_object(key='a').value, 5)
+        Config.objects(key='b').delete()
+        self.assertIsNone(Config.get_object(key='b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+# -*- coding:utf-8 -*-
+"""
+csv Utility unittest
+"""
+
+import csv
+import datetime
+import unittest
+from io import StringIO
+
+from adam.utils import csv_util
+
+
+class TestCsvUtil(unittest.TestCase):
+
+    def test_csv_value(self):
+        self.assertEqual(csv_util.csv_value(None), '')
+        self.assertEqual(csv_util.csv_value(True), 'true')
+        self.assertEqual(csv_util.csv_value(1.5), '1.5')
+        self.assertEqual(csv_util.csv_value(datetime.datetime(2024, 5, 6, 7, 8, 9)), '2024-05-06T07:08:09')
+        self.assertEqual(csv_util.csv_value(['a']), '["a"]')
+
+    def test_iter_csv(self):
+        rows = [['a,b', 'say "hi"'], ['多\n行', None]] * 3
+        chunks = list(csv_util.iter_csv(iter(rows), header=['x', 'y'], chunk_size=4))
+        self.assertEqual(len(chunks), 2)
+        result = list(csv.reader(StringIO(''.join(chunks))))
+        self.assertEqual(result[0], ['x', 'y'])
+        self.assertEqual(result[1:], [['a,b', 'say "hi"'], ['多\n行', '']] * 3)
+
+        chunks = list(csv_util.iter_csv([], header=['x'], bom=True))
+        self.assertEqual(chunks, ['\ufeffx\r\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
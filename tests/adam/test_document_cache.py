@@ -0,0 +1,130 @@
+# -*- coding:utf-8 -*-
+"""
+document cache unittest
+
+模型部分需要 mongomock(pip install mongomock)，没有时跳过
+"""
+
+import time
+import unittest
+
+import mongoengine
+from mongoengine.fields import StringField, IntField
+
+from adam.documents import ResourceDocument
+from adam.documents.document_cache import LocalCache, get_document_cache
+from adam.utils.config_util import config
+
+ALIAS = 'adam_cache_test'
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class CachedItem(ResourceDocument):
+    meta = {'db_alias': ALIAS, 'item_id_field': 'code', 'cache': {'ttl': 30, 'backend': 'local', 'keys': ['token']}}
+
+    code = StringField()
+    token = StringField()
+    count = IntField(default=0)
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = LocalCache(size=2, ttl=30)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # a 最近用过，超出时先淘汰 b
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        cache.delete('a', 'x')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 1)
+
+    def test_ttl(self):
+        cache = LocalCache(ttl=30)
+        cache.set('a', 1, ttl=0.01)
+        cache.set('b', 2)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestDocumentCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.register_connection(ALIAS, host='mongodb://localhost/adam_test',
+                                        mongo_client_class=mongomock.MongoClient)
+
+    def setUp(self):
+        CachedItem.objects.delete()
+        self.cache = get_document_cache(CachedItem)
+        self.cache.clear()
+
+    def test_read_through(self):
+        item = CachedItem(code='a', token='t1').save()
+        misses = self.cache.misses
+        first = CachedItem.find_one({'id': str(item.id)})
+        second = CachedItem.find_one({'id': str(item.id)})
+        self.assertEqual((first.code, second.code), ('a', 'a'))
+        self.assertIsNot(first, second)  # 每次命中都是新的对象
+        self.assertEqual(self.cache.misses, misses + 1)
+        # 按 item_id_field 及 keys 查，数据只按 id 缓存一份
+        self.assertEqual(CachedItem.find_one({'code': 'a'}).id, item.id)
+        self.assertEqual(CachedItem.find_cached(token='t1').id, item.id)
+        self.assertIsNone(CachedItem.find_cached(token='none'))
+        with self.assertRaises(CachedItem.DoesNotExist):
+            CachedItem.find_one({'code': 'none'})
+
+    def test_invalidate(self):
+        item = CachedItem(code='a').save()
+        CachedItem.find_one({'code': 'a'})
+        item.count = 1
+        item.save()
+        self.assertEqual(CachedItem.find_one({'id': item.id}).count, 1)
+        CachedItem.objects(id=item.id).update(inc__count=1)
+        self.assertEqual(CachedItem.find_one({'id': item.id}).count, 2)
+        CachedItem.objects(code='a').modify(set__code='b')
+        self.assertEqual(CachedItem.find_one({'code': 'b'}).id, item.id)
+        with self.assertRaises(CachedItem.DoesNotExist):
+            CachedItem.find_one({'code': 'a'})  # 字段值改过，旧的对应关系失效
+        item.reload()
+        item.delete()
+        self.assertIsNone(CachedItem.find_cached(id=item.id))
+
+    def test_invalidate_many(self):
+        items = [CachedItem(code='c%d' % i).save() for i in range(3)]
+        for item in items:
+            CachedItem.find_one({'id': item.id})
+        limit = config.CACHE_INVALIDATE_LIMIT
+        config.set_key_value('CACHE_INVALIDATE_LIMIT', 2)
+        try:
+            # 不超过上限时按 id 失效，其它数据的缓存还在
+            CachedItem.objects(code__in=['c0', 'c1']).update(inc__count=1)
+            self.assertEqual(len(self.cache.local), 1)
+            self.assertEqual(CachedItem.find_one({'id': items[0].id}).count, 1)
+            # 超过上限时不再逐条查出 id，整个集合的缓存失效
+            CachedItem.find_one({'id': items[1].id})
+            CachedItem.objects(code__startswith='c').update(inc__count=1)
+            self.assertEqual(len(self.cache.local), 0)
+            self.assertEqual([CachedItem.find_one({'id': item.id}).count for item in items], [2, 2, 1])
+        finally:
+            config.set_key_value('CACHE_INVALIDATE_LIMIT', limit)
+
+    def test_stats(self):
+        item = CachedItem(code='a').save()
+        CachedItem.find_one({'id': item.id})
+        CachedItem.find_one({'id': item.id})
+        stats = self.cache.stats()
+        self.assertEqual(stats['backend'], 'local')
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertGreaterEqual(stats['misses'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
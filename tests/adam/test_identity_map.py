@@ -0,0 +1,118 @@
+# -*- coding:utf-8 -*-
+"""
+identity map / prefetch_related unittest
+
+需要 mongomock(pip install mongomock)，没有时跳过
+"""
+
+import unittest
+
+import mongoengine
+from flask import Flask
+from mongoengine.fields import StringField, LazyReferenceField
+
+from adam.documents import ResourceDocument
+from adam.fields import RelationField
+from adam.utils import identity_map
+
+ALIAS = 'adam_identity_test'
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class IdOwner(ResourceDocument):
+    meta = {'db_alias': ALIAS, 'hidden': ['password'], 'protected': ['email']}
+
+    name = StringField()
+    password = StringField()
+    email = StringField()
+    items = RelationField(document_type='IdItem', relation_type='has_many', target_field='owner')
+
+
+class IdItem(ResourceDocument):
+    meta = {'db_alias': ALIAS}
+
+    name = StringField()
+    owner = LazyReferenceField(document_type=IdOwner)
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestIdentityMap(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.register_connection(ALIAS, host='mongodb://localhost/adam_test',
+                                        mongo_client_class=mongomock.MongoClient)
+        identity_map.apply_patch()
+        cls.app = Flask(__name__)
+
+    def setUp(self):
+        IdOwner.objects.delete()
+        IdItem.objects.delete()
+        self.owner = IdOwner(name='o', password='secret', email='o@a.com').save()
+        self.items = [IdItem(name='i%d' % i, owner=self.owner).save() for i in range(3)]
+        self.queries = []
+        for model in (IdOwner, IdItem):
+            collection = model._get_collection()
+            find = collection.find
+            collection.find = lambda *a, _find=find, _name=collection.name, **k: (self.queries.append(_name),
+                                                                                  _find(*a, **k))[1]
+        self.context = self.app.test_request_context('/')
+        self.context.push()
+        identity_map.begin()
+
+    def tearDown(self):
+        identity_map.end()
+        self.context.pop()
+        for model in (IdOwner, IdItem):
+            model._get_collection().__dict__.pop('find', None)
+
+    def test_find_one(self):
+        owner = IdOwner.find_one({'id': str(self.owner.id)})
+        self.assertIs(IdOwner.find_cached(id=self.owner.id), owner)
+        item = IdItem.find_one({'id': self.items[0].id})
+        self.assertIs(item.owner.fetch(), owner)  # LazyReference.fetch 也查 identity map
+        self.assertEqual(self.queries, ['id_owner', 'id_item'])
+
+        owner.name = 'changed'
+        owner.save()  # 修改后移除
+        self.assertIsNot(IdOwner.find_one({'id': self.owner.id}), owner)
+
+    def test_relation(self):
+        owner = IdOwner.find_one({'id': self.owner.id})
+        items = owner.items.fetch()
+        self.assertIs(owner.items, owner.items)  # 同一个 instance 复用同一个 LazyRelation
+        self.assertIs(IdItem.find_one({'id': self.items[1].id}), items[1])
+        # 其它对象的同一个关联也直接用已加载的
+        self.assertIs(IdOwner.objects.first().items.fetch(), items)
+        self.assertEqual(self.queries, ['id_owner', 'id_item', 'id_owner'])
+
+    def test_prefetch_related(self):
+        items = list(IdItem.objects.prefetch_related('owner').batch_size(2))
+        # 每批一次查询，第二批的 owner 已经在 identity map 里
+        self.assertEqual(self.queries, ['id_item', 'id_owner'])
+        self.assertTrue(all(item.owner.fetch() is items[0].owner.fetch() for item in items))
+        self.queries.clear()
+        owners = list(IdOwner.objects.prefetch_related('items'))
+        self.assertEqual([len(owner.items.fetch()) for owner in owners], [3])
+        self.assertEqual(self.queries, ['id_owner', 'id_item'])
+
+    def test_prefetch_full_documents(self):
+        # 预加载的与单独 fetch() 的一样是完整的数据，不去掉 hidden/protected 字段
+        identity_map.end()
+        owner = list(IdItem.objects.prefetch_related('owner'))[0].owner.fetch()
+        self.assertEqual((owner.password, owner.email), ('secret', 'o@a.com'))
+        self.assertEqual(owner.to_mongo(), IdItem.objects.first().owner.fetch().to_mongo())
+        items = list(IdOwner.objects.prefetch_related('items'))[0].items.fetch()
+        self.assertEqual([item.to_mongo() for item in items], [item.to_mongo() for item in IdItem.objects])
+
+    def test_inactive(self):
+        identity_map.end()
+        self.assertIsNot(IdOwner.find_one({'id': self.owner.id}), IdOwner.find_one({'id': self.owner.id}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding:utf-8 -*-
+"""
+import Utility unittest
+"""
+
+import io
+import unittest
+
+from mongoengine import Document
+from mongoengine.fields import StringField, IntField, BooleanField, ListField, DictField
+
+from adam.utils import import_util
+
+
+class ImportItem(Document):
+    name = StringField()
+    count = IntField()
+    enabled = BooleanField()
+    tags = ListField(StringField())
+    others = DictField()
+
+
+class TestImportUtil(unittest.TestCase):
+
+    def test_iter_lines(self):
+        stream = io.BytesIO(b'a\nbb\n\nccc')
+        self.assertEqual(list(import_util.iter_lines(stream, chunk_size=2)), [b'a\n', b'bb\n', b'\n', b'ccc'])
+
+    def test_iter_csv_records(self):
+        content = '\ufeffname,count\n哈哈,1\n\n"多\n行",2\n'.encode('utf-8')
+        records = list(import_util.iter_csv_records(io.BytesIO(content)))
+        self.assertEqual(records, [(2, {'name': '哈哈', 'count': '1'}), (5, {'name': '多\n行', 'count': '2'})])
+
+    def test_iter_ndjson_records(self):
+        records = list(import_util.iter_ndjson_records(io.BytesIO(b'{"a": 1}\n\n[1]\n')))
+        self.assertEqual(records[0], (1, {'a': 1}))
+        self.assertEqual(records[1][0], 3)
+        self.assertTrue(isinstance(records[1][1], ValueError))
+
+    def test_convert_import_record(self):
+        record = {'name': ' a ', 'count': '2', 'enabled': '否', 'tags': 'x;y', 'others': '{"k": 1}', 'unknown': '1'}
+        self.assertEqual(import_util.convert_import_record(ImportItem, record, text=True), {
+            'name': 'a', 'count': 2, 'enabled': False, 'tags': ['x', 'y'], 'others': {'k': 1}})
+        self.assertEqual(import_util.convert_import_record(ImportItem, {'count': ''}, text=True), {})
+        with self.assertRaises(ValueError):
+            import_util.convert_import_record(ImportItem, {'enabled': 'maybe'}, text=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,12 +4,15 @@ json Utility unittest
 """
 
 import os
+import json
 import uuid
 import time
 import decimal
 import datetime
 import unittest
 
+from bson import ObjectId
+
 from adam.utils import json_util
 
 
@@ -93,6 +96,27 @@ class TestJsonUtil(unittest.TestCase):
              '元组': [list(set('abcd')), 55.6722, '2015-06-28T14:19:41'],
              '2019-06-18': '81ab20bfecd94cc7beb1498da7e0b75d'})
 
+    def test_dumps(self):
+        """dumps / loads 各实现的结果一致"""
+        value = {'id': ObjectId('6ad2ee7cf4fb50c6e35ad858'), 'at': datetime.datetime(2015, 6, 28, 14, 19, 41),
+                 'amount': decimal.Decimal('1.5'), 'name': u'哈哈', 'tags': ('a', 1), 'none': None,
+                 'uuid': uuid.UUID('81ab20bf-ecd9-4cc7-beb1-498da7e0b75d')}
+        expected = {'id': '6ad2ee7cf4fb50c6e35ad858', 'at': '2015-06-28T14:19:41', 'amount': 1.5, 'name': u'哈哈',
+                    'tags': ['a', 1], 'none': None, 'uuid': '81ab20bf-ecd9-4cc7-beb1-498da7e0b75d'}
+        backend = json_util.get_json_backend()
+        try:
+            for name in json_util.JSON_BACKENDS:
+                if name != 'json' and getattr(json_util, name) is None:
+                    continue
+                self.assertEqual(json_util.set_json_backend(name), name)
+                self.assertEqual(json.loads(json_util.dumps(value)), expected)
+                self.assertEqual(json.loads(json_util.dumps(value, as_bytes=True)), expected)
+                self.assertEqual(json_util.loads('{"a": [1, "哈"]}'), {'a': [1, u'哈']})
+                self.assertEqual(json_util.load_json(b'{"a": null}'), {'a': None})
+            self.assertEqual(json_util.set_json_backend('unknown'), 'json')
+        finally:
+            json_util.set_json_backend(backend)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,136 @@
+# -*- coding:utf-8 -*-
+"""
+page Utility unittest
+
+游标分页的查询部分需要 mongomock(pip install mongomock)，没有时跳过
+"""
+
+import datetime
+import unittest
+
+import mongoengine
+from bson import ObjectId
+from mongoengine.fields import IntField
+
+from adam.documents import ResourceDocument
+from adam.utils import page_util
+
+ALIAS = 'adam_page_test'
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class PageItem(ResourceDocument):
+    meta = {'db_alias': ALIAS}
+
+    a = IntField()
+    n = IntField()
+
+
+class TestPageUtil(unittest.TestCase):
+
+    def test_parse_sort(self):
+        self.assertEqual(page_util.parse_sort(['-id']), [('id', -1)])
+        self.assertEqual(page_util.parse_sort(['-created_at']), [('created_at', -1), ('id', -1)])
+        self.assertEqual(page_util.parse_sort(['name', '+age']), [('name', 1), ('age', 1), ('id', 1)])
+        self.assertEqual(page_util.parse_sort(['-_id']), [('id', -1)])
+        self.assertEqual(page_util.parse_sort([]), [('id', -1)])
+        self.assertEqual(page_util.order_by_args([('name', 1), ('id', -1)]), ['+name', '-id'])
+
+    def test_cursor(self):
+        sort_keys = page_util.parse_sort(['-created_at', 'name'])
+        _id = ObjectId()
+        created_at = datetime.datetime(2024, 5, 6, 7, 8, 9)
+        item = {'id': _id, 'created_at': created_at, 'name': '哈哈'}
+        cursor = page_util.encode_cursor(item, sort_keys)
+        self.assertTrue(isinstance(cursor, str))
+        self.assertNotIn('=', cursor)
+        self.assertEqual(page_util.decode_cursor(cursor, sort_keys), [created_at, '哈哈', _id])
+
+        # 换了排序方式，游标无效
+        with self.assertRaises(ValueError):
+            page_util.decode_cursor(cursor, page_util.parse_sort(['-id']))
+        with self.assertRaises(ValueError):
+            page_util.decode_cursor('garbage', sort_keys)
+
+    def test_cursor_query(self):
+        sort_keys = page_util.parse_sort(['-created_at'])
+        query = page_util.cursor_query(sort_keys, [1, 2])
+        # 降序时 null 排在最后，也要包含在下一页里
+        self.assertEqual(query.to_query(None), {'$or': [
+            {'created_at': {'$lt': 1}},
+            {'created_at': None},
+            {'created_at': 1, 'id': {'$lt': 2}},
+        ]})
+        # 降序时没有比 null 更小的值
+        query = page_util.cursor_query([('name', -1)], [None])
+        self.assertIsNone(query)
+
+    def test_get_page_range(self):
+        self.assertEqual(page_util.get_page_range(2, 10, 35), (2, 4, 10))
+        self.assertEqual(page_util.get_page_range(9, 10, 35), (4, 4, 30))
+        self.assertEqual(page_util.get_page_range(3, 10, 0), (1, 0, 0))
+        # 不知道总数时，不限制最大页码
+        self.assertEqual(page_util.get_page_range(9, 10, None), (9, None, 80))
+
+    def test_finish_cursor_page(self):
+        # 多取的一条用来判断是否有下一页，游标取自本页最后一条
+        sort_keys = page_util.parse_sort(['-id'])
+        items = [{'id': ObjectId()} for _ in range(3)]
+        page, next_cursor = page_util._finish_cursor_page(list(items), sort_keys, set(), 2)
+        self.assertEqual(page, items[:2])
+        self.assertEqual(page_util.decode_cursor(next_cursor, sort_keys), [items[1]['id']])
+        self.assertEqual(page_util._finish_cursor_page(items[:2], sort_keys, set(), 2), (items[:2], None))
+
+    def test_facet_result(self):
+        self.assertEqual(page_util._facet_result({'items': [{'a': 1}], 'total': [{'count': 5}]}), ([{'a': 1}], 5))
+        self.assertEqual(page_util._facet_result({'items': [], 'total': []}), ([], 0))
+        self.assertEqual(page_util._facet_result(None), ([], 0))
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestCursorPage(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.register_connection(ALIAS, host='mongodb://localhost/adam_test',
+                                        mongo_client_class=mongomock.MongoClient)
+
+    def setUp(self):
+        PageItem.objects.delete()
+        for a, n in [(1, 3), (None, 2), (1, None), (2, 1), (None, None), (1, 2), (None, 3)]:
+            PageItem(a=a, n=n).save()
+
+    def pages(self, sort, page_size=2):
+        """游标分页取出所有数据"""
+        result, cursor = [], ''
+        while True:
+            items, cursor = page_util.cursor_page(PageItem.objects, sort, page_size, cursor)
+            result.extend(items)
+            if cursor is None:
+                return result
+
+    def assert_same_as_offset(self, sort):
+        expected = list(PageItem.objects.order_by(*page_util.order_by_args(page_util.parse_sort(sort))))
+        for page_size in (1, 2, 3):
+            self.assertEqual([item.id for item in self.pages(sort, page_size)], [item.id for item in expected])
+
+    def test_nulls(self):
+        self.assertEqual([item.n for item in self.pages(['-n'])], [3, 3, 2, 2, 1, None, None])
+        self.assertEqual([item.n for item in self.pages(['n'])], [None, None, 1, 2, 2, 3, 3])
+        for sort in (['-n'], ['n'], ['-a', '-n'], ['a', '-n'], ['-a', 'n'], ['a', 'n']):
+            self.assert_same_as_offset(sort)
+
+    def test_count_cache_key(self):
+        # ObjectId 与同样内容的字符串是不同的查询条件
+        _id = ObjectId()
+        key = page_util._count_cache_key(PageItem.objects(__raw__={'owner': _id}))
+        self.assertNotEqual(key, page_util._count_cache_key(PageItem.objects(__raw__={'owner': str(_id)})))
+        self.assertEqual(key, page_util._count_cache_key(PageItem.objects(__raw__={'owner': _id})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# -*- coding:utf-8 -*-
+"""
+relation loader unittest
+
+需要 mongomock(pip install mongomock)，没有时跳过
+"""
+
+import unittest
+
+import mongoengine
+from bson import ObjectId
+from mongoengine.fields import StringField, LazyReferenceField
+
+from adam.documents import ResourceDocument
+from adam.fields import RelationField
+from adam.utils.relation_loader import load_relations
+from adam.utils.serializer import serialize
+
+ALIAS = 'adam_relation_test'
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class RlUser(ResourceDocument):
+    meta = {'db_alias': ALIAS, 'hidden': ['password'], 'protected': ['email']}
+
+    name = StringField()
+    password = StringField()
+    email = StringField()
+    projects = RelationField(document_type='RlProject', relation_type='has_many', target_field='owner')
+    latest = RelationField(document_type='RlProject', relation_type='has_one', target_field='owner')
+
+
+class RlProject(ResourceDocument):
+    meta = {'db_alias': ALIAS}
+
+    name = StringField()
+    owner = LazyReferenceField(document_type=RlUser)
+    reviewer = LazyReferenceField(document_type=RlUser)
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestRelationLoader(unittest.TestCase):
+    in_aggregate = False
+
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.register_connection(ALIAS, host='mongodb://localhost/adam_test',
+                                        mongo_client_class=mongomock.MongoClient)
+
+    def setUp(self):
+        RlUser.objects.delete()
+        RlProject.objects.delete()
+        self.users = [RlUser(name='u%d' % i, password='secret', email='u%d@a.com' % i).save() for i in range(3)]
+        u0, u1, u2 = self.users
+        self.projects = [
+            RlProject(name='p0', owner=u0, reviewer=u1).save(),
+            RlProject(name='p1', owner=u0, reviewer=u2).save(),
+            RlProject(name='p2', owner=u1, reviewer=u0).save(),
+            RlProject(name='p3', owner=ObjectId(), reviewer=u2).save(),  # owner 不存在
+        ]
+        self.queries = []
+        for model in (RlUser, RlProject):
+            collection = model._get_collection()
+            for method in ('find', 'aggregate'):
+                setattr(collection, method, self.record(collection, method))
+
+    def record(self, collection, method):
+        """记录查询(mongomock 的 aggregate 内部调用的 find 不算)"""
+        origin = getattr(collection, method)
+
+        def wrapper(*args, **kwargs):
+            if not self.in_aggregate:
+                self.queries.append((collection.name, method))
+            self.in_aggregate = method == 'aggregate'
+            try:
+                return origin(*args, **kwargs)
+            finally:
+                self.in_aggregate = False
+        return wrapper
+
+    def tearDown(self):
+        for model in (RlUser, RlProject):
+            model._get_collection().__dict__.pop('find', None)
+            model._get_collection().__dict__.pop('aggregate', None)
+
+    def test_references(self):
+        projects = list(RlProject.objects.order_by('name'))
+        self.queries.clear()
+        load_relations(projects, ['owner', 'reviewer'])
+        # 两个字段指向同一个集合，只查询一次
+        self.assertEqual(self.queries, [('rl_user', 'find')])
+        self.assertEqual([p.owner.fetch().name for p in projects[:3]], ['u0', 'u0', 'u1'])
+        self.assertEqual([p.reviewer.fetch().name for p in projects], ['u1', 'u2', 'u0', 'u2'])
+        self.assertIs(projects[0].owner.fetch(), projects[2].reviewer.fetch())
+        self.assertEqual(len(self.queries), 1)
+        # 加载的是完整的数据，hidden/protected 字段也在
+        self.assertEqual((projects[0].owner.fetch().password, projects[0].owner.fetch().email), ('secret', 'u0@a.com'))
+        # 输出时仍由 serialize 去掉 hidden/protected 字段
+        self.assertEqual(serialize(None, projects[0], None, included=['owner'])['owner'].keys(),
+                         {'id', 'name', 'created_at', 'updated_at'})
+        # 找不到的 fetch() 时照旧抛出 DoesNotExist
+        with self.assertRaises(RlUser.DoesNotExist):
+            projects[3].owner.fetch()
+
+    def test_relations(self):
+        users = list(RlUser.objects.order_by('name'))
+        self.queries.clear()
+        load_relations(users, ['projects', 'latest'])
+        # has_many 一次 find，has_one 一次聚合(每个 owner 只取 id 最大的一条)
+        self.assertEqual(sorted(self.queries), [('rl_project', 'aggregate'), ('rl_project', 'find')])
+        self.assertEqual([sorted(p.name for p in u.projects.fetch()) for u in users], [['p0', 'p1'], ['p2'], []])
+        self.assertEqual([u.latest.fetch() and u.latest.fetch().name for u in users], ['p1', 'p2', None])
+        self.assertEqual(len(self.queries), 2)
+        # 与单独查询的结果一致
+        for user in users:
+            self.assertEqual(user.latest.fetch(), user.latest.objects().first())
+
+    def test_not_included(self):
+        projects = list(RlProject.objects)
+        self.queries.clear()
+        load_relations(projects, ['name'])
+        load_relations([], ['owner'])
+        self.assertEqual(self.queries, [])
+        self.assertIsNone(projects[0].owner._cached_doc)
+
+
+if __name__ == '__main__':
+    unittest.main()
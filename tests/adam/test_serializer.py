@@ -0,0 +1,80 @@
+# -*- coding:utf-8 -*-
+"""
+serializer Utility unittest
+"""
+
+import datetime
+import unittest
+from enum import Enum
+
+from bson import ObjectId
+from mongoengine import EmbeddedDocument
+from mongoengine.fields import StringField, IntField, DateTimeField, ListField, DictField, EmbeddedDocumentField, \
+    LazyReferenceField, ReferenceField
+
+from adam.fields import EnumField
+from adam.documents import ResourceDocument
+from adam.utils import serializer
+
+
+class SerializerState(Enum):
+    NEW = 'new'
+    DONE = 'done'
+
+
+class SerializerAddress(EmbeddedDocument):
+    city = StringField()
+
+
+class SerializerItem(ResourceDocument):
+    meta = {'hidden': ['secret'], 'protected': ['note']}
+
+    name = StringField()
+    secret = StringField()
+    note = StringField(default='note')
+    count = IntField()
+    state = EnumField(enum=SerializerState, default=SerializerState.NEW)
+    tags = ListField(StringField())
+    others = DictField()
+    address = EmbeddedDocumentField(SerializerAddress)
+    owner = LazyReferenceField(document_type='SerializerItem')
+    finished_at = DateTimeField()
+
+
+class SerializerRefItem(ResourceDocument):
+    owner = ReferenceField(document_type='SerializerItem')
+
+
+class TestSerializer(unittest.TestCase):
+
+    def test_mongo_to_dict(self):
+        _id, owner = ObjectId(), ObjectId()
+        item = SerializerItem(id=_id, name='哈哈', count=1, state=SerializerState.DONE, owner=owner,
+                              finished_at=datetime.datetime(2024, 5, 6, 7, 8, 9))
+        data = serializer.mongo_to_dict(item, only_fields=['name', 'state', 'owner', 'finished_at', 'address'])
+        self.assertEqual(data, {'id': str(_id), 'name': '哈哈', 'state': 'done', 'owner': str(owner),
+                                'finished_at': '2024-05-06T07:08:09', 'address': None})
+        data = serializer.mongo_to_dict(item, only_fields=['name', 'address'], without_none=True)
+        self.assertEqual(data, {'id': str(_id), 'name': '哈哈'})
+        data = serializer.mongo_to_dict(item, only_fields=['finished_at'], date_format='%Y-%m-%d')
+        self.assertEqual(data['finished_at'], '2024-05-06')
+
+    def test_raw_to_dict(self):
+        item = SerializerItem(id=ObjectId(), name='哈哈', secret='x', count=1, tags=['a'], others={'a': None},
+                              address=SerializerAddress(city='sz'), owner=ObjectId(),
+                              finished_at=datetime.datetime(2024, 5, 6, 7, 8, 9))
+        son = item.to_mongo().to_dict()
+        son.pop('note')
+        son['state'] = None
+        expected = serializer.serialize('_root', SerializerItem._from_son(son), None, included=[])
+        self.assertEqual(serializer.raw_to_dict(SerializerItem, son), expected)
+        self.assertNotIn('secret', expected)
+        self.assertEqual(expected['note'], 'note')  # 没有值时取默认值
+        self.assertEqual(expected['state'], 'new')
+
+        # 取值时会自动 dereference 的字段不支持
+        self.assertIsNone(serializer.raw_plan(SerializerRefItem))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# -*- coding:utf-8 -*-
+"""
+sync worker unittest
+
+mongomock 不支持 change stream，这里只测试变更的处理，需要 mongomock(pip install mongomock)，没有时跳过
+"""
+
+import unittest
+from unittest import mock
+
+import mongoengine
+from mongoengine.fields import StringField
+
+from adam.documents import ResourceDocument, cache_events
+from adam.sync_worker import ChangeStreamSync, SyncWorker, sync_models
+
+ALIAS = 'adam_sync_test'
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class SyncItem(ResourceDocument):
+    meta = {'db_alias': ALIAS, 'es_sync': True, 'cache': {'ttl': 30}}
+
+    name = StringField()
+
+
+class SyncTable(ResourceDocument):
+    meta = {'db_alias': ALIAS, 'cache_table': True}
+
+    name = StringField()
+
+
+class PlainItem(ResourceDocument):
+    meta = {'db_alias': ALIAS}
+
+    name = StringField()
+
+
+class FakeEsUtil(object):
+    index_name = 'syncitem'
+
+    @staticmethod
+    def build_document(docs):
+        return [{'id': str(doc.id), 'name': doc.name} for doc in docs]
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestSyncWorker(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.register_connection(ALIAS, host='mongodb://localhost/adam_test',
+                                        mongo_client_class=mongomock.MongoClient)
+
+    def setUp(self):
+        SyncItem.objects.delete()
+        self.sync = ChangeStreamSync(ALIAS, [SyncItem])
+        self.sync.es_utils['sync_item'] = FakeEsUtil()
+        self.sync.token_collection.delete_many({})
+        self.sync.dead_letter_collection.delete_many({})
+
+    def test_models(self):
+        self.assertEqual(sync_models([SyncItem, PlainItem, ResourceDocument]), [SyncItem])
+        self.assertEqual([stream.alias for stream in SyncWorker([SyncItem, PlainItem]).streams], [ALIAS])
+
+    def test_handle(self):
+        item = SyncItem(name='a').save()
+        self.assertIsNotNone(SyncItem.find_cached(id=item.id))
+        # 直接写集合(不经过 save)，由 change stream 失效缓存
+        SyncItem._get_collection().update_one({'_id': item.id}, {'$set': {'name': 'b'}})
+        key = {'_id': item.id}
+        self.sync.handle({'operationType': 'update', 'ns': {'coll': 'sync_item'}, 'documentKey': key,
+                          'fullDocument': SyncItem._get_collection().find_one(key)}, {'_data': '1'})
+        self.sync.handle({'operationType': 'delete', 'ns': {'coll': 'sync_item'}, 'documentKey': key}, {'_data': '2'})
+        self.sync.handle({'operationType': 'update', 'ns': {'coll': 'sync_item'}, 'documentKey': key,
+                          'fullDocument': None}, {'_data': '3'})
+        self.sync.handle({'operationType': 'insert', 'ns': {'coll': 'other'}, 'documentKey': key}, {'_data': '4'})
+        self.assertEqual(SyncItem.find_cached(id=item.id).name, 'b')
+        self.assertEqual(self.sync.actions, [
+            {'_op_type': 'index', '_index': 'syncitem', '_id': str(item.id),
+             '_source': {'id': str(item.id), 'name': 'b'}},
+            {'_op_type': 'delete', '_index': 'syncitem', '_id': str(item.id)},
+        ])
+        self.assertEqual(self.sync.token, {'_data': '4'})
+
+    def test_reload_table(self):
+        # 直接写的数据不一定更新了 updated_at，整表缓存通知重新加载，每次 flush 每个集合只通知一次
+        published = []
+        self.sync.models['sync_table'] = SyncTable
+        key = {'_id': 1}
+        with mock.patch.object(cache_events, 'publish', lambda *args: published.append(args)):
+            for op in ('insert', 'update', 'replace', 'delete'):
+                self.sync.handle({'operationType': op, 'ns': {'coll': 'sync_table'}, 'documentKey': key}, None)
+            self.assertEqual(published, [])
+            self.sync.flush()
+        self.assertEqual(published, [('sync_table', 'reload')])
+
+    def test_es_errors(self):
+        self.sync.token = {'_data': '1'}
+        self.sync.flush()
+        results = []
+        self.sync.write_es = lambda actions: results.pop(0)
+        # 可重试的错误不保存 token
+        self.sync.actions, self.sync.token = [{'_op_type': 'index'}], {'_data': '2'}
+        results.append((0, [{'index': {'_id': 'a', 'status': 429}}]))
+        with self.assertRaises(RuntimeError):
+            self.sync.flush()
+        self.assertEqual(self.sync.load_token(), {'_data': '1'})
+        # 不可重试的错误存到 dead letter 后继续，删除不存在的数据不算出错
+        self.sync.actions = [{'_op_type': 'index'}, {'_op_type': 'delete'}]
+        results.append((0, [{'index': {'_id': 'a', 'status': 400}}, {'delete': {'_id': 'b', 'status': 404}}]))
+        with self.assertLogs('adam.sync_worker', 'ERROR'):
+            self.sync.flush()
+        self.assertEqual(self.sync.load_token(), {'_data': '2'})
+        self.assertEqual([doc['error'] for doc in self.sync.dead_letter_collection.find()],
+                         [{'index': {'_id': 'a', 'status': 400}}])
+
+    def test_token(self):
+        self.assertIsNone(self.sync.load_token())
+        self.sync.token = {'_data': '1'}
+        self.sync.flush()  # 没有 ES 操作时只保存 token
+        self.sync.token = {'_data': '2'}
+        self.sync.flush()
+        self.assertEqual(ChangeStreamSync(ALIAS, [SyncItem]).load_token(), {'_data': '2'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,546 @@
+# -*- coding:utf-8 -*-
+"""
+ResourceView unittest
+
+直接在请求上下文里调用 ResourceView 的处理函数，读写数据的部分需要 mongomock(pip install mongomock)，没有时跳过
+"""
+
+import io
+import json
+import asyncio
+import zipfile
+import datetime
+import threading
+import unittest
+from types import SimpleNamespace
+
+import mongoengine
+from bson import ObjectId
+from flask import Flask, request
+from werkzeug.routing import Rule
+from mongoengine.fields import IntField, StringField, ListField, ReferenceField, LazyReferenceField, \
+    GenericLazyReferenceField
+
+from adam.documents import ResourceDocument
+from adam.exceptions import BussinessCommonException
+from adam.utils.config_util import config
+from adam.utils.serializer import dict_to_mongo
+from adam.utils.url_util import parse_request
+from adam.views import ResourceView
+from adam.views.base import LazyItem
+
+ALIAS = 'adam_view_test'
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class ViewItem(ResourceDocument):
+    meta = {'db_alias': ALIAS}
+
+    n = IntField()
+
+
+class HookItem(ResourceDocument):
+    """记录各个 hook 的调用"""
+    meta = {'db_alias': ALIAS}
+    calls = []
+
+    name = StringField(max_length=5)
+    n = IntField(min_value=0)
+    double = IntField()  # 由 before_save 计算
+
+    def before_save(self, *args, **kwargs):
+        super().before_save(*args, **kwargs)
+        self.calls.append(('before_save', self.name))
+        if self.double is not None:
+            self.double = (self.n or 0) * 2
+
+    def after_update(self, payload):
+        self.calls.append(('after_update', self.name, sorted(self.real_changed_fields())))
+
+    def after_delete(self):
+        self.calls.append(('after_delete', self.name))
+
+
+class RefTarget(ResourceDocument):
+    meta = {'db_alias': ALIAS}
+
+    name = StringField()
+
+
+class RefTag(ResourceDocument):
+    meta = {'db_alias': ALIAS}
+
+    name = StringField()
+
+
+class RefItem(ResourceDocument):
+    meta = {'db_alias': ALIAS}
+
+    owner = LazyReferenceField(document_type=RefTarget)
+    reviewer = LazyReferenceField(document_type=RefTarget)
+    reftarget = GenericLazyReferenceField()  # 按字段名找 model: app.models['Reftarget']
+    tags = ListField(ReferenceField(RefTag))
+
+
+class ViewTestCase(unittest.TestCase):
+    """在请求上下文里调用 view 的处理函数"""
+    model = None
+
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.register_connection(ALIAS, host='mongodb://localhost/adam_test',
+                                        mongo_client_class=mongomock.MongoClient)
+        config.add_values('adam.default_settings')
+        cls.app = Flask(__name__)
+
+    def setUp(self):
+        self.model.objects.delete()
+        self.view = ResourceView(self.app, self.model, {})
+
+    def call(self, handler, path='/', method='GET', json=None, headers=None, **kwargs):
+        with self.app.test_request_context(path, method=method, json=json, headers=headers):
+            request.req = parse_request(self.model)
+            return getattr(self.view, handler)(**kwargs)
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestFacetPage(ViewTestCase):
+    model = ViewItem
+
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            ViewItem(n=i).save()
+
+    def tearDown(self):
+        ViewItem._meta.update({'page_engine': 'query', 'count_strategy': 'exact'})
+
+    def read(self, page_engine, page):
+        ViewItem._meta['page_engine'] = page_engine
+        data = self.call('collection_read', '/?sort=n&page_size=2&page=%s' % page)['data']
+        return [item.n for item in data['items']], data['meta']
+
+    def test_same_as_query(self):
+        for page in (1, 2, 3, 9):  # 超出最大页码时取最后一页
+            self.assertEqual(self.read('facet', page), self.read('query', page))
+        self.assertEqual(self.read('facet', 9), ([4], {'page': 3, 'page_size': 2, 'max_page': 3, 'total': 5}))
+        ViewItem.objects.delete()
+        self.assertEqual(self.read('facet', 2), self.read('query', 2))
+
+    def test_count_strategy(self):
+        # 只有需要精确总数时才用 facet
+        ViewItem._meta['page_engine'] = 'facet'
+        for strategy, use_facet in (('exact', True), ('estimated', False), ('cache', False), ('none', False)):
+            ViewItem._meta['count_strategy'] = strategy
+            with self.app.test_request_context('/'):
+                request.req = parse_request(ViewItem)
+                self.assertEqual(self.view._use_facet(ViewItem.objects), use_facet)
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestBulkBatch(ViewTestCase):
+    model = HookItem
+
+    def setUp(self):
+        super().setUp()
+        HookItem._meta['batch_engine'] = 'bulk'
+        self.items = [HookItem(name='i%d' % i, n=i, double=0).save() for i in range(3)]
+        self.ids = [str(item.id) for item in self.items[:2]] + [str(ObjectId())]
+        HookItem.calls.clear()
+
+    def tearDown(self):
+        HookItem._meta.update({'batch_engine': 'document', 'batch_hooks': False})
+
+    def update(self, data):
+        return self.call('batch_update', method='PUT', json={'ids': self.ids, 'data': data},
+                         instances=HookItem.objects(id__in=self.ids))['data']
+
+    def delete(self):
+        return self.call('batch_delete', method='DELETE', json={'ids': self.ids},
+                         instances=HookItem.objects(id__in=self.ids))['data']
+
+    def test_update(self):
+        self.assertEqual(self.update({'n': 4}), {'matched': 2, 'modified': 2})  # 不存在的 id 不算
+        self.assertEqual([item.n for item in HookItem.objects.order_by('name')], [4, 4, 2])
+        # 与 save 一致，None 值 unset
+        self.update({'n': None})
+        self.assertEqual([item.to_mongo().get('n', 'unset') for item in HookItem.objects.order_by('name')],
+                         ['unset', 'unset', 2])
+        self.assertEqual(self.update({}), {'matched': 0, 'modified': 0})
+        self.assertEqual(HookItem.calls, [])  # 默认不调用 hook
+
+    def test_validate(self):
+        for data in ({'n': -1}, {'name': 'too long'}):
+            with self.assertRaises(BussinessCommonException) as cm:
+                self.update(data)
+            self.assertEqual(cm.exception.code, 502)
+            self.assertIn(list(data)[0], cm.exception.message)
+        self.assertEqual([item.n for item in HookItem.objects.order_by('name')], [0, 1, 2])
+
+    def test_delete(self):
+        self.assertEqual(self.delete(), {'deleted': True, 'deleted_count': 2})
+        self.assertEqual([item.name for item in HookItem.objects], ['i2'])
+        self.assertEqual(HookItem.calls, [])
+
+    def test_hooks(self):
+        HookItem._meta['batch_hooks'] = True
+        self.update({'n': 5})
+        self.assertEqual(HookItem.calls, [('before_save', 'i0'), ('before_save', 'i1'),
+                                          ('after_update', 'i0', ['double', 'n']),
+                                          ('after_update', 'i1', ['double', 'n'])])
+        # before_save 里修改的字段也写入
+        self.assertEqual([item.double for item in HookItem.objects.order_by('name')], [10, 10, 4])
+        HookItem.calls.clear()
+        self.delete()
+        self.assertEqual(HookItem.calls, [('after_delete', 'i0'), ('after_delete', 'i1')])
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestCreateReferences(ViewTestCase):
+    model = RefItem
+
+    def setUp(self):
+        super().setUp()
+        self.app.models = {'Reftarget': RefTarget}
+        RefTarget.objects.delete()
+        RefTag.objects.delete()
+        self.targets = [RefTarget(name='t%d' % i).save() for i in range(2)]
+        self.tags = [RefTag(name='g%d' % i).save() for i in range(2)]
+        self.queries = []
+        for model in (RefTarget, RefTag):
+            collection = model._get_collection()
+            find = collection.find
+            collection.find = lambda *a, _find=find, _name=collection.name, **k: (self.queries.append(_name),
+                                                                                  _find(*a, **k))[1]
+
+    def tearDown(self):
+        del self.app.models
+        for model in (RefTarget, RefTag):
+            model._get_collection().__dict__.pop('find', None)
+
+    def create(self, **data):
+        return self.call('collection_create', method='POST', json=data)['data']['item']
+
+    def test_create(self):
+        t0, t1 = self.targets
+        g0, g1 = self.tags
+        item = self.create(owner=str(t0.id), reviewer={'id': str(t1.id)}, reftarget={'id': str(t0.id)},
+                           tags=[str(g1.id), str(g0.id), str(g1.id)])
+        # 每个目标 model 只查询一次
+        self.assertEqual(sorted(self.queries), ['ref_tag', 'ref_target'])
+        item = RefItem.objects.get(id=item.id)
+        self.assertEqual((item.owner.pk, item.reviewer.pk, item.reftarget.pk), (t0.id, t1.id, t0.id))
+        self.assertEqual(item.tags, [g1, g0, g1])
+
+    def test_reference_list(self):
+        g0, g1 = self.tags
+        tags = dict_to_mongo(RefItem, {'tags': [str(g1.id), str(ObjectId()), str(g0.id), str(g1.id)]})['tags']
+        # 一次查询，保持顺序及重复的，不存在的为 None
+        self.assertEqual(self.queries, ['ref_tag'])
+        self.assertEqual(tags, [g1, None, g0, g1])
+        self.assertEqual(dict_to_mongo(RefItem, {'tags': []})['tags'], [])
+        self.assertEqual(self.queries, ['ref_tag'])
+
+    def test_missing_reference(self):
+        with self.assertRaises(BussinessCommonException) as cm:
+            self.create(owner=str(ObjectId()), reviewer=str(self.targets[0].id))
+        self.assertEqual((cm.exception.code, cm.exception.message), (404, 'RefTarget资源不存在'))
+        self.assertEqual(RefItem.objects.count(), 0)
+
+    def test_missing_generic_reference(self):
+        item = self.create(owner=str(self.targets[0].id), reftarget={'id': str(ObjectId())})
+        item = RefItem.objects.get(id=item.id)
+        self.assertEqual((item.owner.pk, item.reftarget), (self.targets[0].id, None))
+        self.assertEqual(self.queries, ['ref_target'])
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestAtomicUpdate(ViewTestCase):
+    model = HookItem
+
+    def setUp(self):
+        super().setUp()
+        HookItem._meta['update_engine'] = 'atomic'
+        self.items = [HookItem(name='i%d' % i, n=i).save() for i in range(3)]
+        self.old = datetime.datetime(2020, 1, 1)
+        HookItem._get_collection().update_many({}, {'$set': {'updated_at': self.old}})
+        HookItem.calls.clear()
+
+    def tearDown(self):
+        HookItem._meta['update_engine'] = 'document'
+
+    def instance(self, _id):
+        return self.view._get_item_instance('item_update', 'item_update', {'id': str(_id)})
+
+    def update(self, instance, data):
+        return self.call('item_update', method='PUT', json=data, instance=instance)['data']['item']
+
+    def test_update(self):
+        instance = self.instance(self.items[0].id)
+        self.assertIsInstance(instance, LazyItem)
+        self.assertEqual(instance.pk, self.items[0].id)
+        self.assertIsNone(instance._document)  # 还没有查询
+        item = self.update(instance, {'name': None, 'n': 5})
+        self.assertEqual((item.name, item.n), (None, 5))
+        # null 的字段 unset，并更新 updated_at
+        raw = HookItem._get_collection().find_one({'_id': self.items[0].id})
+        self.assertNotIn('name', raw)
+        self.assertEqual(raw['n'], 5)
+        self.assertGreater(raw['updated_at'], self.old)
+        # 不调用 before_save，after_update 里 real_changed_fields 为请求的字段
+        self.assertEqual(HookItem.calls, [('after_update', None, ['n', 'name'])])
+        # 更新后 instance 为更新后的数据
+        self.assertIs(instance._document, item)
+        self.assertEqual(instance.n, 5)
+
+    def test_lazy_instance(self):
+        # 重写 item_update 的子类可以照常读写 instance 的属性
+        instance = self.instance(self.items[1].id)
+        self.assertEqual((instance.name, instance['n'], instance.id), ('i1', 1, self.items[1].id))
+        instance.n = 9
+        self.assertEqual(instance._document.n, 9)
+        self.assertEqual(self.update(instance, {}).n, 9)  # 没有更新内容时返回取出的数据
+
+    def test_not_exist(self):
+        for data in ({'n': 5}, {}):
+            with self.assertRaises(BussinessCommonException) as cm:
+                self.update(self.instance(ObjectId()), data)
+            self.assertEqual(cm.exception.code, 404)
+        with self.assertRaises(BussinessCommonException):
+            getattr(self.instance(ObjectId()), 'name')
+        self.assertEqual(HookItem.calls, [])
+
+    def test_acl(self):
+        # 需要权限判断时仍先取出数据
+        self.view.acl = ['item_update']
+        instance = self.instance(self.items[0].id)
+        self.assertIsInstance(instance, HookItem)
+        self.assertEqual(self.update(instance, {'n': 5}).n, 5)
+        self.assertEqual(HookItem.objects.get(id=self.items[0].id).n, 5)
+        self.assertEqual(HookItem.calls, [('after_update', 'i0', ['n'])])
+        # 其它 action 不受影响
+        self.view.acl = []
+        self.assertIsInstance(self.view._get_item_instance('item_read', 'item_read', {'id': str(self.items[0].id)}),
+                              HookItem)
+
+    def test_batch_update(self):
+        ids = [str(item.id) for item in self.items[:2]]
+        items = self.call('batch_update', method='PUT', json={'ids': ids, 'data': {'n': 7}},
+                          instances=HookItem.objects(id__in=ids))['data']['items']
+        self.assertEqual(sorted((item.name, item.n) for item in items), [('i0', 7), ('i1', 7)])
+        self.assertEqual([item.n for item in HookItem.objects.order_by('name')], [7, 7, 2])
+        self.assertTrue(all(item.updated_at > self.old for item in items))
+        self.assertEqual(sorted(HookItem.calls), [('after_update', 'i0', ['n']), ('after_update', 'i1', ['n'])])
+
+
+class ExportItem(ResourceDocument):
+    meta = {'db_alias': ALIAS, 'export': True, 'hidden': ['password'], 'protected': ['email']}
+
+    name = StringField()
+    password = StringField()
+    email = StringField()
+    owner = LazyReferenceField(document_type=RefTarget)
+
+
+class PermissionUser(object):
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+
+    def has_permission(self, endpoint, instance=None):
+        return endpoint in self.endpoints
+
+
+@unittest.skipUnless(mongomock, 'mongomock required')
+class TestExport(ViewTestCase):
+    model = ExportItem
+
+    def setUp(self):
+        super().setUp()
+        self.owner = RefTarget(name='o').save()
+        for i in range(3):
+            ExportItem(name='e%d' % i, password='secret', email='e%d@a.com' % i, owner=self.owner).save()
+
+    def tearDown(self):
+        ExportItem._meta.update({'export': True, 'read_engine': 'document'})
+        self.view.acl = []
+        self.app.config.pop('EXPORT_LIMIT', None)
+
+    def export(self, path='/?sort=name', user=None):
+        with self.app.test_request_context(path):
+            request.url_rule = Rule('/', endpoint='|collection_export|export_item|')
+            request.req = parse_request(self.model)
+            request.user = user
+            response = self.view.collection_export()
+            if response.mimetype == 'application/zip':
+                return zipfile.ZipFile(io.BytesIO(b''.join(response.response)))
+            return ''.join(response.response).splitlines()
+
+    def test_fields(self):
+        owner = str(self.owner.id)
+        self.assertEqual(self.export('/?sort=name&only=["name","owner"]'),
+                         ['name,owner', 'e0,' + owner, 'e1,' + owner, 'e2,' + owner])
+        # hidden、protected 的字段即使 only 指定也不导出
+        self.assertEqual(self.export('/?sort=name&only=["name","email","password"]')[:2], ['name', 'e0'])
+        self.assertEqual(self.export()[0], 'id,created_at,updated_at,name,owner')
+        # 与 read_engine 无关
+        ExportItem._meta['read_engine'] = 'raw'
+        self.assertEqual(self.export('/?sort=name&only=["name","owner"]')[1], 'e0,' + owner)
+
+    def test_zip(self):
+        items = ExportItem.objects.order_by('name')
+        archive = self.export('/?sort=name&format=zip')
+        self.assertEqual(archive.namelist(), ['%s.json' % item.id for item in items])
+        # only 不含 id 时按序号命名
+        archive = self.export('/?sort=name&format=zip&only=["name"]')
+        self.assertEqual(archive.namelist(), ['1.json', '2.json', '3.json'])
+        self.assertEqual(json.loads(archive.read('2.json')), {'name': 'e1'})
+
+    def test_limit(self):
+        self.app.config['EXPORT_LIMIT'] = 2
+        self.assertEqual(len(self.export()), 3)
+
+    def test_not_enabled(self):
+        ExportItem._meta['export'] = False
+        with self.assertRaises(BussinessCommonException) as cm:
+            self.export()
+        self.assertEqual(cm.exception.code, 404)
+
+    def test_permission(self):
+        # 权限与 collection_read 相同
+        self.view.acl = ['collection_read']
+        with self.assertRaises(BussinessCommonException) as cm:
+            self.export(user=PermissionUser([]))
+        self.assertEqual(cm.exception.code, 402)
+        self.assertEqual(len(self.export(user=PermissionUser(['|collection_read|export_item|']))), 4)
+
+
+class TestDispatchAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.view = ResourceView(self.app, ViewItem, {})
+        self.threads = []
+        self.view.has_permission = lambda *args: self.threads.append(threading.current_thread()) or self.allowed
+
+    def dispatch(self):
+        async def handler():
+            return threading.current_thread()
+
+        descriptor = SimpleNamespace(is_item=False, action='collection_read', endpoint='|collection_read|view_item|',
+                                     async_handler=handler)
+        with self.app.test_request_context('/'):
+            return asyncio.run(self.view._dispatch_async(descriptor, {}))
+
+    def test_permission_in_thread(self):
+        # 权限判断可能查询数据库，不在事件循环的线程里执行
+        self.view.acl, self.allowed = ['collection_read'], True
+        loop_thread = self.dispatch()
+        self.assertEqual(len(self.threads), 1)
+        self.assertIsNot(self.threads[0], loop_thread)
+        self.allowed = False
+        with self.assertRaises(BussinessCommonException):
+            self.dispatch()
+
+    def test_no_acl(self):
+        self.view.acl = []
+        self.dispatch()
+        self.assertEqual(self.threads, [])
+
+
+class FakeGridOut(io.BytesIO):
+    """GridFS 的 GridOut(只有 render_file 用到的属性)"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self._id = ObjectId()
+        self.length = len(data)
+        self.chunk_size = 4
+        self.content_type = 'text/plain'
+        self.upload_date = datetime.datetime(2024, 5, 6, 7, 8, 9)
+
+
+class TestRenderFile(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        view = ResourceView(app, None, {})
+        self.file = FakeGridOut(b'0123456789')
+        app.add_url_rule('/file', 'file', lambda: view.render_file(self.file, 'attachment; filename="a.txt"'))
+        self.client = app.test_client()
+
+    def get(self, headers=None):
+        response = self.client.get('/file', headers=headers)
+        return response, response.data
+
+    def test_full(self):
+        response, data = self.get()
+        self.assertEqual((response.status_code, data), (200, b'0123456789'))
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.headers['Content-Length'], '10')
+        self.assertEqual(response.headers['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename="a.txt"')
+        self.assertEqual(response.get_etag(), (str(self.file._id), False))
+        # 已经读过的文件从头开始返回
+        self.assertEqual(self.get()[1], b'0123456789')
+
+    def test_range(self):
+        response, data = self.get({'Range': 'bytes=2-5'})
+        self.assertEqual((response.status_code, data), (206, b'2345'))
+        self.assertEqual(response.headers['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response.headers['Content-Length'], '4')
+        response, data = self.get({'Range': 'bytes=-3'})
+        self.assertEqual((response.status_code, data), (206, b'789'))
+        # If-Range 不匹配时返回整个文件
+        response, data = self.get({'Range': 'bytes=2-5', 'If-Range': '"other"'})
+        self.assertEqual((response.status_code, data), (200, b'0123456789'))
+
+    def test_not_modified(self):
+        response, data = self.get({'If-None-Match': '"%s"' % self.file._id})
+        self.assertEqual((response.status_code, data), (304, b''))
+        response, _ = self.get({'If-None-Match': '"other"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_range_not_satisfiable(self):
+        response, _ = self.get({'Range': 'bytes=20-30'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */10')
+        self.assertTrue(self.file.closed)
+
+
+class TestRenderStream(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        self.view = ResourceView(app, None, {})
+        app.add_url_rule('/stream', 'stream', lambda: self.view.render_stream(self.items(), {'page': 1}, chunk_size=2))
+        self.client = app.test_client()
+        self.error = None
+
+    def items(self):
+        for i in range(5):
+            if i == 3 and self.error:
+                raise self.error
+            yield {'n': i}
+
+    def test_stream(self):
+        response = self.client.get('/stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['data'], {'items': [{'n': i} for i in range(5)], 'meta': {'page': 1}})
+
+    def test_error(self):
+        # 出错时补全 JSON，items 截止到出错前的那批，带上 error
+        for error, expected in ((ValueError('boom'), {'code': 500, 'message': '未知错误'}),
+                                (BussinessCommonException(404, 'not found'), {'code': 404, 'message': 'not found'})):
+            self.error = error
+            with self.assertLogs('adam.views.base', 'ERROR'):
+                data = json.loads(self.client.get('/stream').data)
+            self.assertEqual(data['data'], {'items': [{'n': 0}, {'n': 1}], 'meta': None})
+            self.assertEqual(data['error'], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+# -*- coding:utf-8 -*-
+"""
+zip Utility unittest
+"""
+
+import io
+import zipfile
+import unittest
+
+from adam.utils import zip_util
+
+
+class TestZipUtil(unittest.TestCase):
+
+    def test_iter_zip(self):
+        lines = ['{"id": %d, "name": "数据"}\n' % i for i in range(2000)]
+        entries = [('a.jsonl', iter(lines)), ('b.json', [b'{}'])]
+        chunks = list(zip_util.iter_zip(iter(entries), compresslevel=1, chunk_size=1024))
+        self.assertGreater(len(chunks), 1)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['a.jsonl', 'b.json'])
+        self.assertEqual(archive.read('a.jsonl').decode('utf-8'), ''.join(lines))
+        self.assertEqual(archive.read('b.json'), b'{}')
+
+        # 没有文件时也是合法的压缩包
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(zip_util.iter_zip([]))))
+        self.assertEqual(archive.namelist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
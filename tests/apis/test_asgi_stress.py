@@ -0,0 +1,78 @@
+#!python
+# -*- coding:utf-8 -*-
+"""
+压力测试: 对比 ASGI(uvicorn) 与 gunicorn + gevent 两种启动方式的吞吐量及延迟
+
+先在两个端口用不同模式启动同一个项目(同样的进程数):
+    python main.py -m web --pool gevent -p 8000 -w 4
+    python main.py -m asgi -p 8001 -w 4
+然后执行本脚本，分别对两个地址发起同样的请求
+"""
+import sys
+import time
+import logging
+import threading
+
+from __init__ import get, set_host  # 导入环境
+from adam.utils.thread_util import ThreadPool
+
+THREAD_LINE = 50  # 线程数
+repeat_number = 2000  # 重复次数
+URL = 'api/project?page_size=20'  # 要测试的接口
+HOSTS = {
+    'gevent': 'http://127.0.0.1:8000/',
+    'asgi': 'http://127.0.0.1:8001/',
+}
+
+lock = threading.Lock()
+durations = []  # 各请求的耗时
+error_time = 0  # 出错次数
+
+
+def test_single(*args, **kwargs):
+    """
+    单次请求
+    """
+    global error_time
+    start_time = time.time()
+    try:
+        resp_dict = get(URL, param={}, return_json=True)
+        assert resp_dict.get('code') == 0
+    except Exception as e:
+        logging.error(u'请求出错:%s' % e)
+        with lock:
+            error_time += 1
+    with lock:
+        durations.append(time.time() - start_time)
+
+
+def run_test(name, host):
+    """
+    对一个地址并发请求，返回统计结果
+    """
+    global error_time
+    set_host(host)
+    durations.clear()
+    error_time = 0
+    start_time = time.time()
+    pool = ThreadPool(THREAD_LINE)
+    for i in range(repeat_number):
+        pool.add_task(test_single)
+    pool.wait_completion(600)
+    run_time = time.time() - start_time
+
+    items = sorted(durations)
+    percentile = lambda p: items[min(len(items) - 1, int(len(items) * p))] * 1000 if items else 0
+    logging.info(u'%s: 总耗时 %.2f 秒, %.1f 请求/秒, 平均 %.1f ms, p50 %.1f ms, p99 %.1f ms, 出错次数:%s',
+                 name, run_time, len(items) / run_time, sum(items) / max(len(items), 1) * 1000,
+                 percentile(0.5), percentile(0.99), error_time)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1:
+        URL = sys.argv[1]
+    logging.info('请求 %s 线程数: %s, 重复次数: %s', URL, THREAD_LINE, repeat_number)
+    for name, host in HOSTS.items():
+        run_test(name, host)
+    ThreadPool.stop()